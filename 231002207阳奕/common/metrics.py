@@ -0,0 +1,199 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 进程内指标：计数器、仪表和直方图，按Prometheus文本格式通过本地HTTP端口导出
+# 每个线程写自己的计数单元（threading.local），热路径上不加锁；只有抓取时才加锁汇总各线程的单元
+
+# 默认的直方图桶（秒），覆盖10µs~1s
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0)
+
+
+class Counter:
+    """只增的计数器：每个线程一个单元，inc()只改本线程的单元"""
+    TYPE = 'counter'
+
+    def __init__(self, labels=None):
+        self.labels = labels or {}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.cells = []  # [(线程, 单元)]
+        self.retired = self.new_cell_value()  # 已结束线程的单元累加到这里
+        self.prune_at = 16  # 单元数达到这个值时先合并已结束线程的单元
+
+    def new_cell_value(self):
+        return [0]
+
+    def cell(self):
+        """创建并登记本线程的单元；热循环可以在循环外取出单元，循环中直接对单元做加法，省去每次查找
+
+        每连接一个线程时没有人抓取也会不断有新线程登记，单元数翻倍时合并一次已结束线程的单元，
+        单元列表的长度不超过存活线程数的两倍左右，均摊下来每次登记的开销不变。
+        """
+        cell = self.new_cell_value()
+        self.local.cell = cell
+        with self.lock:
+            if len(self.cells) >= self.prune_at:
+                self.retire_dead()
+                self.prune_at = max(16, 2 * len(self.cells))
+            self.cells.append((threading.current_thread(), cell))
+        return cell
+
+    def inc(self, n=1):
+        try:
+            self.local.cell[0] += n
+        except AttributeError:
+            self.cell()[0] += n
+
+    def retire_dead(self):
+        """已结束的线程不会再写，把它的单元并入retired（调用时需持有self.lock）"""
+        alive = []
+        for thread, cell in self.cells:
+            if thread.is_alive():
+                alive.append((thread, cell))
+            else:
+                for i, v in enumerate(cell):
+                    self.retired[i] += v
+        self.cells = alive
+
+    def collect(self):
+        """各线程单元之和"""
+        with self.lock:
+            self.retire_dead()
+            total = list(self.retired)
+            for _, cell in self.cells:
+                for i, v in enumerate(cell):
+                    total[i] += v
+        return total
+
+    def value(self):
+        return self.collect()[0]
+
+
+class Gauge(Counter):
+    """可增可减的仪表，各线程的增减相加；指定fn时抓取时调用fn()取值（如连接表大小）"""
+    TYPE = 'gauge'
+
+    def __init__(self, labels=None, fn=None):
+        super().__init__(labels)
+        self.fn = fn
+
+    def dec(self, n=1):
+        self.inc(-n)
+
+    def value(self):
+        return self.fn() if self.fn else super().value()
+
+
+class Histogram(Counter):
+    """固定桶直方图：单元为[各桶计数..., 总和]，observe()只做一次二分查找和两次加法"""
+    TYPE = 'histogram'
+
+    def __init__(self, labels=None, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(labels)
+
+    def new_cell_value(self):
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, v):
+        try:
+            cell = self.local.cell
+        except AttributeError:
+            cell = self.cell()
+        cell[bisect.bisect_left(self.buckets, v)] += 1  # 第i个桶统计 v <= buckets[i]，最后一个为+Inf
+        cell[-1] += v
+
+
+def format_labels(labels, extra=None):
+    items = list(labels.items()) + list((extra or {}).items())
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+
+def format_value(v):
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Registry:
+    """指标登记表，同名不同标签的指标属于同一个family，导出时共用HELP/TYPE行"""
+
+    def __init__(self):
+        self.families = {}  # 名字 -> (类型, 说明, [指标])
+        self.lock = threading.Lock()
+
+    def register(self, name, help_text, metric):
+        with self.lock:
+            family = self.families.setdefault(name, (metric.TYPE, help_text, []))
+            if family[0] != metric.TYPE:
+                raise ValueError(f"指标{name}已登记为{family[0]}")
+            family[2].append(metric)
+        return metric
+
+    def counter(self, name, help_text, **labels):
+        return self.register(name, help_text, Counter(labels))
+
+    def gauge(self, name, help_text, fn=None, **labels):
+        return self.register(name, help_text, Gauge(labels, fn))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS, **labels):
+        return self.register(name, help_text, Histogram(labels, buckets))
+
+    def render(self):
+        """Prometheus文本格式（0.0.4）"""
+        with self.lock:
+            families = [(name, kind, help_text, list(metrics))
+                        for name, (kind, help_text, metrics) in self.families.items()]
+        lines = []
+        for name, kind, help_text, metrics in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for metric in metrics:
+                if kind != 'histogram':
+                    lines.append(f"{name}{format_labels(metric.labels)} {format_value(metric.value())}")
+                    continue
+                cell = metric.collect()
+                cumulative = 0
+                for bound, n in zip(metric.buckets + (float('inf'),), cell):
+                    cumulative += n
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{name}_bucket{format_labels(metric.labels, {'le': le})} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(metric.labels)} {format_value(cell[-1])}")
+                lines.append(f"{name}_count{format_labels(metric.labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # 不输出访问日志
+
+
+def serve(registry, port, host='127.0.0.1'):
+    """在后台线程中启动HTTP服务，GET /metrics 返回registry的内容"""
+    handler = type('Handler', (MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    """给命令行添加指标导出相关参数"""
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help="在该端口以Prometheus文本格式导出指标(GET /metrics)，0表示不导出；多进程时第k个worker使用该端口+k")
+    parser.add_argument('--metrics-host', default='127.0.0.1', help="指标HTTP服务绑定的地址，默认只允许本机访问")
@@ -0,0 +1,135 @@
+import atexit
+import itertools
+import sys
+import threading
+import time
+
+# 事件级别
+OFF = 0
+INFO = 1  # 连接建立/关闭、超时、校验结果等低频事件
+DEBUG = 2  # 每个包的收发、确认、重传
+LEVELS = {'off': OFF, 'info': INFO, 'debug': DEBUG}
+
+
+class Tracer:
+    """事件跟踪：结构化事件写入预分配的环形缓冲区，格式化和终端I/O不在调用线程中进行
+
+    mode='async'：后台线程每interval秒把新事件批量写出；
+    mode='dump'：运行时不输出，退出时只输出缓冲区里最近的capacity条事件。
+    热路径上先判断tracer.debug / tracer.info再调用event()，关闭时只多一次属性读取。
+    formats为{事件名: 格式字符串或函数(fields)->str}，没有登记的事件按"事件名 字段=值"输出。
+    """
+
+    def __init__(self, level=INFO, capacity=65536, mode='async', stream=None, formats=None, interval=0.2):
+        self.level = level
+        self.info = level >= INFO
+        self.debug = level >= DEBUG
+        self.capacity = 1 << max(0, capacity - 1).bit_length()  # 取2的幂，下标用&代替%
+        self.mask = self.capacity - 1
+        self.ring = [None] * self.capacity  # 每个槽位: (序号, 时刻, 事件名, 字段dict)
+        self.counter = itertools.count()  # next()在CPython中是原子操作，多线程写入不需要加锁
+        self.mode = mode
+        self.stream = stream or sys.stdout
+        self.formats = dict(formats or {})
+        self.start = time.monotonic()
+        self.flushed = 0  # 下一条要输出的事件序号
+        self.dropped = 0  # 输出跟不上、被覆盖的事件数
+        self.flush_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+        if level > OFF:
+            if mode == 'async':
+                self.thread = threading.Thread(target=self.flush_loop, args=(interval,), name="tracer", daemon=True)
+                self.thread.start()
+            atexit.register(self.close)
+
+    def event(self, name, **fields):
+        """记录一个事件（调用前由调用方判断级别）"""
+        i = next(self.counter)
+        self.ring[i & self.mask] = (i, time.monotonic(), name, fields)
+
+    def log(self, level, name, **fields):
+        """带级别判断的event()，用于非热路径"""
+        if self.level >= level:
+            self.event(name, **fields)
+
+    def format(self, t, name, fields):
+        fmt = self.formats.get(name)
+        if fmt is None:
+            text = ' '.join([name] + [f"{k}={v}" for k, v in fields.items()])
+        elif callable(fmt):
+            text = fmt(fields)
+        else:
+            text = fmt.format(**fields)
+        return f"[{t - self.start:10.6f}] {text}\n"
+
+    def flush(self):
+        """输出flushed之后已经写好的事件，遇到还没写入的槽位为止（dump模式下只在close()时输出）"""
+        if self.level == OFF or (self.mode == 'dump' and not self.stopping.is_set()):
+            return
+        with self.flush_lock:
+            lines = []
+            ring, mask, i = self.ring, self.mask, self.flushed
+            while True:
+                slot = ring[i & mask]
+                if slot is None or slot[0] < i:
+                    break  # 还没有写入
+                if slot[0] > i:
+                    self.dropped += 1  # 已被更新的事件覆盖
+                else:
+                    lines.append(self.format(slot[1], slot[2], slot[3]))
+                i += 1
+            self.flushed = i
+            if lines:
+                self.stream.write(''.join(lines))
+                self.stream.flush()
+
+    def flush_loop(self, interval):
+        while not self.stopping.wait(interval):
+            self.flush()
+
+    def close(self):
+        """停止后台线程并输出剩余事件；dump模式下只输出最近的capacity条"""
+        if self.stopping.is_set():
+            return
+        self.stopping.set()
+        if self.thread:
+            self.thread.join()
+        if self.mode == 'dump':
+            newest = max((slot[0] for slot in self.ring if slot), default=-1)
+            self.flushed = max(self.flushed, newest + 1 - self.capacity)
+        self.flush()
+        if self.dropped and self.mode == 'async':
+            self.stream.write(f"跟踪缓冲区溢出，丢弃了{self.dropped}条事件\n")
+            self.stream.flush()
+
+
+# 不记录任何事件的跟踪器，作为各个类的默认值
+NULL = Tracer(OFF)
+
+
+def add_arguments(parser):
+    """给命令行添加跟踪相关参数"""
+    parser.add_argument('--trace', choices=list(LEVELS), default='info',
+                        help="跟踪级别：off不输出，info只输出连接级事件（默认），debug输出每个包的事件")
+    parser.add_argument('--trace-mode', choices=['async', 'dump'], default='async',
+                        help="async: 后台线程定期输出；dump: 只在退出时输出最近的事件")
+    parser.add_argument('--trace-file', help="跟踪输出写入该文件，默认标准输出")
+    parser.add_argument('--trace-buffer', type=int, default=65536, help="环形缓冲区能保存的事件数")
+
+
+def trace_path(args, worker):
+    """多进程时第worker个进程的跟踪文件为<--trace-file>.<worker>，各进程不写同一个文件"""
+    return args.trace_file if worker is None else f"{args.trace_file}.{worker}"
+
+
+def from_args(args, formats=None, worker=None):
+    """按add_arguments()添加的参数创建跟踪器
+
+    worker不为None时写入trace_path(args, worker)，并以追加方式打开：文件由主进程启动时清空，
+    异常退出后重新启动的worker接在原来的记录后面写。
+    """
+    stream = None
+    if args.trace_file:
+        stream = open(trace_path(args, worker), 'w' if worker is None else 'a', encoding='utf-8')
+    return Tracer(LEVELS[args.trace], args.trace_buffer, args.trace_mode, stream, formats)
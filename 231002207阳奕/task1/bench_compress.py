@@ -0,0 +1,75 @@
+import argparse
+import os
+import random
+import string
+import time
+
+from framing import CAP_ZLIB, CAP_ZSTD, HEADER, Compressor, Decompressor, supported_compression
+
+# 压缩的收益与代价：按协议的方式（整条连接一个流式压缩器，每个报文同步刷新一次）压缩一串reverseRequest报文，
+# 对比不同分块大小下线路上的字节数和压缩+解压的CPU时间，并算出压缩划算的链路带宽上限：
+# 节省的字节数 / 带宽 > 多花的CPU时间 时压缩更快，即带宽 < 节省的字节数 / CPU时间
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_data(kind, size, seed=1):
+    """repeat：text.txt重复到size字节（与实际输入相同的重复文本）；random：随机字母，几乎不可压缩"""
+    if kind == 'repeat':
+        with open(os.path.join(HERE, 'text.txt'), 'rb') as f:
+            text = f.read()
+        return (text * (size // len(text) + 1))[:size]
+    rng = random.Random(seed)
+    return ''.join(rng.choices(string.ascii_letters, k=size)).encode('ascii')
+
+
+def run_once(cap, level, data, piece):
+    """压缩并解压data按piece切成的全部报文，返回(报文字节数, 压缩后字节数, 压缩秒数, 解压秒数)"""
+    frames = [HEADER.pack(3, len(data[i:i + piece])) + data[i:i + piece] for i in range(0, len(data), piece)]
+    compressor = Compressor(cap, level)
+    start = time.perf_counter()
+    wire = [compressor.compress(frame) for frame in frames]
+    t_compress = time.perf_counter() - start
+
+    decompressor = Decompressor(cap)
+    start = time.perf_counter()
+    plain = [decompressor.decompress(chunk) for chunk in wire]
+    t_decompress = time.perf_counter() - start
+    if b''.join(plain) != b''.join(frames):
+        raise RuntimeError("解压结果与原报文不一致")
+    return sum(len(f) for f in frames), sum(len(w) for w in wire), t_compress, t_decompress
+
+
+def main():
+    parser = argparse.ArgumentParser(description="reverse协议流式压缩的带宽节省与CPU开销")
+    parser.add_argument('--sizes', default='16,55,256,1024,4096,65536', help="分块大小列表(字节)")
+    parser.add_argument('--total-mb', type=float, default=4, help="每组测试的数据量(MB)")
+    parser.add_argument('--data', default='repeat,random', help="数据类型：repeat（text.txt重复）、random（随机字母）")
+    args = parser.parse_args()
+
+    codecs = [('zlib-1', CAP_ZLIB, 1), ('zlib-6', CAP_ZLIB, 6)]
+    if supported_compression() & CAP_ZSTD:
+        codecs.append(('zstd-3', CAP_ZSTD, 3))
+    else:
+        print("未安装zstandard，只测试zlib")
+
+    total = int(args.total_mb * 1024 * 1024)
+    print(f"{'data':>7} {'piece':>6} {'codec':>7} {'frame MB':>9} {'wire MB':>8} {'ratio':>6} "
+          f"{'comp MB/s':>10} {'decomp MB/s':>11} {'cpu us/frame':>12} {'break-even':>11}")
+    for kind in args.data.split(','):
+        data = make_data(kind, total)
+        for piece in [int(x) for x in args.sizes.split(',')]:
+            frames = -(-len(data) // piece)
+            for name, cap, level in codecs:
+                raw, wire, t_c, t_d = run_once(cap, level, data, piece)
+                cpu = t_c + t_d  # 一个方向上发送端压缩+接收端解压
+                saved = raw - wire
+                # 压缩划算的链路带宽上限(Mbit/s)，节省为负时压缩总是更慢
+                break_even = f"{saved * 8 / cpu / 1e6:.0f}Mbit/s" if saved > 0 else "-"
+                print(f"{kind:>7} {piece:>6} {name:>7} {raw / 1e6:>9.2f} {wire / 1e6:>8.2f} {wire / raw:>6.3f} "
+                      f"{raw / t_c / 1e6:>10.1f} {raw / t_d / 1e6:>11.1f} {cpu / frames * 1e6:>12.2f} "
+                      f"{break_even:>11}")
+
+
+if __name__ == "__main__":
+    main()
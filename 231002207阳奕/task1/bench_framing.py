@@ -0,0 +1,90 @@
+import argparse
+import socket
+import struct
+import threading
+import time
+import tracemalloc
+
+from framing import FrameReader, FrameWriter
+
+
+# 对比两种收发方式：
+# legacy：原来的写法，struct.pack生成报文头后与报文体拼接再send，接收端逐段recv后拼接成bytes
+# framing：framing.py，报文头pack_into预分配缓冲区+sendmsg，接收端recv_into预分配缓冲区+memoryview
+
+
+def legacy_send(sock, frames, payload):
+    for _ in range(frames):
+        sock.sendall(struct.pack('>HI', 3, len(payload)) + payload)
+
+
+def legacy_recv_exact(sock, n):
+    buf = b''
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("对端关闭了连接")
+        buf += chunk
+    return buf
+
+
+def legacy_recv(sock, frames):
+    for _ in range(frames):
+        Type, length = struct.unpack('>HI', legacy_recv_exact(sock, 6))
+        legacy_recv_exact(sock, length)
+
+
+def framing_send(sock, frames, payload):
+    writer = FrameWriter(sock)
+    for _ in range(frames):
+        writer.send_frame(3, payload)
+
+
+def framing_recv(sock, frames):
+    reader = FrameReader(sock)
+    for _ in range(frames):
+        reader.read_frame()
+
+
+def run_once(send_func, recv_func, payload_size, frames, trace):
+    """在socketpair上收发frames个报文，返回(耗时秒, 内存峰值字节)"""
+    a, b = socket.socketpair()
+    payload = b'x' * payload_size
+    if trace:
+        tracemalloc.start()
+    sender = threading.Thread(target=send_func, args=(a, frames, payload))
+    start = time.perf_counter()
+    sender.start()
+    recv_func(b, frames)
+    sender.join()
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    a.close()
+    b.close()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="framing.py与原写法的收发性能对比")
+    parser.add_argument('--sizes', default='16,55,1024,65536,1048576', help="报文体大小列表(字节)")
+    parser.add_argument('--total-mb', type=float, default=32, help="每组测试传输的总数据量(MB)")
+    parser.add_argument('--max-frames', type=int, default=200000, help="每组测试最多报文数")
+    args = parser.parse_args()
+
+    impls = [('legacy', legacy_send, legacy_recv), ('framing', framing_send, framing_recv)]
+    print(f"{'size':>8} {'impl':>8} {'frames':>8} {'MB/s':>9} {'frames/s':>10} {'peak KB':>9}")
+    for size in [int(x) for x in args.sizes.split(',')]:
+        frames = max(1, min(args.max_frames, int(args.total_mb * 1024 * 1024 / size)))
+        for name, send_func, recv_func in impls:
+            # 吞吐量测试不开tracemalloc，内存峰值单独跑一次（tracemalloc本身开销很大）
+            elapsed, _ = run_once(send_func, recv_func, size, frames, trace=False)
+            _, peak = run_once(send_func, recv_func, size, min(frames, 2000), trace=True)
+            mbps = frames * (size + 6) / elapsed / 1024 / 1024
+            print(f"{size:>8} {name:>8} {frames:>8} {mbps:>9.1f} {frames / elapsed:>10.0f} {peak / 1024:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from framing import (CAP_ZLIB, CAP_ZSTD, CAPS, HEADER, HEADER_SIZE, TYPE_INIT_EX, Compressor, Decompressor,
+                     supported_compression)
+from reversetcpclient import reverse_over_connection, split_pieces
+
+# 本地回环压测：启动reversetcpserver子进程，用多个客户端进程并发传输
+# 统计吞吐量(MB/s, pieces/s)、每个分块的应答时延(p50/p99/p999)和建立连接+握手的耗时，结果可写成JSON便于对比
+# 客户端放在独立进程中，避免客户端自身的GIL成为瓶颈
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def start_server(port, server_args):
+    """启动服务器子进程，等到端口可以连接后返回"""
+    cmd = [sys.executable, os.path.join(HERE, 'reversetcpserver.py'), '--host', '127.0.0.1',
+           '--port', str(port), '--backlog', '1024'] + server_args
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("服务器启动失败")
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def usable_cpus():
+    """本进程可以使用的CPU核数（容器/taskset限制后），比os.cpu_count()更能说明多进程能否并行"""
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+
+
+def make_data(size, seed):
+    """生成size字节的可打印ASCII测试数据"""
+    rng = random.Random(seed)
+    line = bytes(rng.choice(b'abcdefghijklmnopqrstuvwxyz') for _ in range(63)) + b'\n'
+    return (line * (size // len(line) + 1))[:size]
+
+
+def client_job(job):
+    """在一个客户端进程里完成一次完整传输，返回(字节数, 分块数, 开始时刻, 结束时刻, 建连耗时, 各分块时延列表)"""
+    port, size, Lmin, Lmax, depth, batch, seed = job
+    random.seed(seed)
+    data = make_data(size, seed)
+    pieces = split_pieces(data, Lmin, Lmax)
+    sent_at = [0.0] * len(pieces)
+    latencies = []
+
+    def on_send(i, n):
+        # 拿到窗口位置、请求报文即将写入socket时才记下发送时刻：流水线的发送线程先从生成器取分块、再等窗口位置，
+        # 在取分块时计时会把等待窗口的排队时间也算进时延
+        now = time.perf_counter()
+        for j in range(i, i + n):
+            sent_at[j] = now
+
+    def on_answer(i, reversed_bytes):
+        latencies.append(time.perf_counter() - sent_at[i])
+
+    timings = {}
+    # monotonic在各进程间可比，用于计算从第一个客户端开始到最后一个客户端结束的总时间
+    start = time.monotonic()
+    count = reverse_over_connection(('127.0.0.1', port), pieces, len(pieces), depth,
+                                    on_answer, batch, timings, on_send=on_send)
+    return size, count, start, time.monotonic(), timings.get('setup', 0.0), latencies
+
+
+def percentile(sorted_values, q):
+    """最近秩法求百分位数"""
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def run_case(port, clients, size, Lmin, Lmax, depth, batch):
+    """所有客户端同时开始，返回一组测试的统计结果"""
+    jobs = [(port, size, Lmin, Lmax, depth, batch, k) for k in range(clients)]
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.map(client_job, jobs)
+    elapsed = max(r[3] for r in results) - min(r[2] for r in results)
+    total_bytes = sum(r[0] for r in results)
+    total_pieces = sum(r[1] for r in results)
+    setups = sorted(r[4] for r in results)
+    latencies = sorted(x for r in results for x in r[5])
+    return {
+        'elapsed_s': elapsed,
+        'bytes': total_bytes,
+        'pieces': total_pieces,
+        'mb_per_s': total_bytes / elapsed / 1024 / 1024,
+        'pieces_per_s': total_pieces / elapsed,
+        'latency_ms': {
+            'p50': percentile(latencies, 50) * 1000,
+            'p99': percentile(latencies, 99) * 1000,
+            'p999': percentile(latencies, 99.9) * 1000,
+            'max': latencies[-1] * 1000 if latencies else 0.0,
+        },
+        'setup_ms': {
+            'mean': sum(setups) / len(setups) * 1000 if setups else 0.0,
+            'p50': percentile(setups, 50) * 1000,
+            'max': setups[-1] * 1000 if setups else 0.0,
+        },
+    }
+
+
+def run_client(port, client_args, log):
+    """启动reversetcpclient.py子进程，输出写入log文件"""
+    cmd = [sys.executable, os.path.join(HERE, 'reversetcpclient.py'), '127.0.0.1', str(port)] + client_args
+    return subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_progress(path, fraction, client, timeout=60):
+    """等到检查点中已确认的分块达到总数的fraction，返回(已确认数, 分块总数)；客户端先结束或超时返回None"""
+    deadline = time.time() + timeout
+    while time.time() < deadline and client.poll() is None:
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = None
+        if state:
+            done = sum(r[2] for r in state['ranges'])
+            if state['N'] and done >= fraction * state['N']:
+                return done, state['N']
+        time.sleep(0.02)
+    return None
+
+
+def same_file(a, b):
+    with open(a, 'rb') as fa, open(b, 'rb') as fb:
+        return fa.read() == fb.read()
+
+
+def resume_test(port, server_args, size, Lmin, Lmax, depth, batch, connections, kill_at):
+    """续传测试：传输到kill_at比例时 (1)杀掉服务器进程再重启，客户端自动重连、用Resume报文继续；
+    (2)杀掉客户端进程，再用--resume重新运行，从检查点继续。两种情况的输出都必须与不中断的传输逐字节相同"""
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = os.path.join(tmp, 'input.txt')
+        with open(input_path, 'wb') as f:
+            f.write(make_data(size, 0))
+        log = open(os.path.join(tmp, 'client.log'), 'w+')
+        common = [str(Lmin), str(Lmax), '--input', input_path, '--seed', '1', '--pipeline', str(depth),
+                  '--batch', str(batch), '--connections', str(connections)]
+        resume = common + ['--resume', '--checkpoint-interval', '0.05']
+        rows = []
+        proc = start_server(port, server_args)
+        try:
+            # 不中断的传输作为参照
+            reference = os.path.join(tmp, 'reference.txt')
+            run_client(port, common + ['--stream', '--output', reference], log).wait()
+
+            # (1) 杀掉服务器：连接断开，客户端在同一次运行中重连续传
+            output = os.path.join(tmp, 'server_killed.txt')
+            start = time.perf_counter()
+            client = run_client(port, resume + ['--output', output], log)
+            killed = wait_progress(output + '.ckpt', kill_at, client)
+            if killed:
+                proc.kill()
+                proc.wait()
+                proc = start_server(port, server_args)
+            client.wait()
+            rows.append(('kill server', killed, time.perf_counter() - start, same_file(reference, output),
+                         not os.path.exists(output + '.ckpt')))
+
+            # (2) 杀掉客户端：检查点留在磁盘上，重新运行时从检查点继续
+            output = os.path.join(tmp, 'client_killed.txt')
+            start = time.perf_counter()
+            client = run_client(port, resume + ['--output', output], log)
+            killed = wait_progress(output + '.ckpt', kill_at, client)
+            client.kill()
+            client.wait()
+            log.seek(0, os.SEEK_END)
+            mark = log.tell()
+            run_client(port, resume + ['--output', output], log).wait()
+            log.seek(mark)
+            resumed = "从检查点继续" in log.read()
+            rows.append(('kill client', killed if resumed else None, time.perf_counter() - start,
+                         same_file(reference, output), not os.path.exists(output + '.ckpt')))
+        finally:
+            stop_server(proc)
+            log.close()
+    return rows
+
+
+def rss_anon(pid):
+    """进程的匿名内存占用RssAnon(字节)，不含mmap的临时文件页"""
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('RssAnon:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+class RssSampler(threading.Thread):
+    """后台每隔interval秒采样一次RssAnon，记录最大值（VmHWM含大报文mmap的文件页，看不出解压占用的内存）"""
+
+    def __init__(self, pid, interval=0.005):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = rss_anon(pid)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, rss_anon(self.pid))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.peak
+
+
+def ratio_test(port, server_args, cap, size):
+    """高压缩比测试：协商压缩后发送一个size字节、压缩后只有几十KB的reverseRequest报文，
+    检查应答正确，并采样服务器匿名内存的峰值；返回(线路上发送的字节数, 秒数, 应答正确, 峰值比开始时增长的字节数)"""
+    data = make_data(size, 0)
+    expected = data[::-1]
+    proc = start_server(port, server_args)
+    try:
+        before = rss_anon(proc.pid)
+        sampler = RssSampler(proc.pid)
+        sampler.start()
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.sendall(HEADER.pack(TYPE_INIT_EX, 1) + CAPS.pack(cap))
+        agree = b''
+        while len(agree) < HEADER_SIZE:
+            part = sock.recv(HEADER_SIZE - len(agree))
+            if not part:
+                raise ConnectionError("服务器在agree之前断开")
+            agree += part
+        if HEADER.unpack(agree) != (2, cap):
+            raise RuntimeError(f"服务器没有同意压缩: {HEADER.unpack(agree)}")
+        wire = Compressor(cap).compress(HEADER.pack(3, size) + data)
+        del data
+        start = time.perf_counter()
+        # 服务器读大报文时边读边应答，发送放在另一个线程里，避免双方的发送缓冲区都被填满
+        sender = threading.Thread(target=sock.sendall, args=(wire,))
+        sender.start()
+        decompressor = Decompressor(cap)
+        answer = b''
+        pos = 0
+        identical = True
+        while pos < size + HEADER_SIZE:
+            if decompressor.has_tail():
+                plain = decompressor.decompress(b'', 1 << 16)
+            else:
+                raw = sock.recv(65536)
+                if not raw:
+                    identical = False
+                    break
+                plain = decompressor.decompress(raw, 1 << 16)
+            if pos < HEADER_SIZE:
+                answer += plain
+                if len(answer) < HEADER_SIZE:
+                    pos = len(answer)
+                    continue
+                identical = HEADER.unpack(answer[:HEADER_SIZE]) == (4, size)
+                plain = answer[HEADER_SIZE:]
+                pos = HEADER_SIZE
+            if plain != expected[pos - HEADER_SIZE:pos - HEADER_SIZE + len(plain)]:
+                identical = False
+            pos += len(plain)
+        elapsed = time.perf_counter() - start
+        sender.join()
+        sock.close()
+        return len(wire), elapsed, identical, sampler.stop() - before
+    finally:
+        stop_server(proc)
+
+
+def parse_list(text, convert=int):
+    return [convert(x) for x in text.split(',') if x]
+
+
+def parse_range(text):
+    """'50-55' -> (50, 55)"""
+    Lmin, _, Lmax = text.partition('-')
+    return int(Lmin), int(Lmax or Lmin)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="reverse TCP协议本地回环压测")
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--server-args', action='append', default=None,
+                        help="服务器参数，可重复指定以对比多种服务器模式，如 --server-args '--mode asyncio'")
+    parser.add_argument('--clients', default='8', help="并发客户端进程数列表，如 1,8,32")
+    parser.add_argument('--sizes', default='1048576', help="每个客户端传输的字节数列表")
+    parser.add_argument('--ranges', default='50-55', help="分块长度范围列表，如 50-55,1000-2000")
+    parser.add_argument('--pipeline', type=int, default=1)
+    parser.add_argument('--batch', type=int, default=1)
+    parser.add_argument('--json', help="把结果写入JSON文件")
+    parser.add_argument('--resume-test', action='store_true',
+                        help="续传测试：传输中途杀掉服务器/客户端，检查续传后的输出与不中断的传输完全相同（使用--sizes和--ranges的第一个值）")
+    parser.add_argument('--connections', type=int, default=1, help="--resume-test时客户端的并行连接数")
+    parser.add_argument('--kill-at', type=float, default=0.3, help="--resume-test时在完成这个比例的分块后杀掉进程")
+    parser.add_argument('--ratio-test', action='store_true',
+                        help="高压缩比测试：每种压缩方式各发送一个--sizes大小、压缩后很小的分块，检查应答和服务器内存峰值的增长")
+    parser.add_argument('--max-growth', type=float, default=16,
+                        help="--ratio-test时允许的服务器内存峰值增长(MB)，超过时测试失败")
+    args = parser.parse_args()
+    server_configs = args.server_args or ['--mode thread']
+
+    if args.resume_test:
+        size = parse_list(args.sizes)[0]
+        Lmin, Lmax = parse_range(args.ranges.split(',')[0])
+        print(f"续传测试: {size}字节, 分块{Lmin}-{Lmax}, pipeline {args.pipeline}, batch {args.batch}, "
+              f"连接数{args.connections}")
+        print(f"{'server':>24} {'scenario':>12} {'killed at':>16} {'seconds':>8} {'identical':>9} {'ckpt removed':>12}")
+        failed = False
+        for server_args in server_configs:
+            for name, killed, elapsed, identical, removed in resume_test(
+                    args.port, shlex.split(server_args), size, Lmin, Lmax, args.pipeline, args.batch,
+                    args.connections, args.kill_at):
+                at = f"{killed[0]}/{killed[1]}" if killed else "未中断"
+                print(f"{server_args:>24} {name:>12} {at:>16} {elapsed:>8.2f} {str(identical):>9} {str(removed):>12}")
+                failed = failed or not (killed and identical and removed)
+        sys.exit(1 if failed else 0)
+
+    if args.ratio_test:
+        caps = [cap for cap in (CAP_ZSTD, CAP_ZLIB) if cap & supported_compression()]
+        print(f"{'server':>24} {'compress':>8} {'size':>10} {'wire':>8} {'ratio':>7} {'seconds':>8} "
+              f"{'identical':>9} {'peak MB':>8}")
+        failed = False
+        for server_args in server_configs:
+            for cap in caps:
+                for size in parse_list(args.sizes):
+                    wire, elapsed, identical, growth = ratio_test(args.port, shlex.split(server_args), cap, size)
+                    name = 'zstd' if cap == CAP_ZSTD else 'zlib'
+                    print(f"{server_args:>24} {name:>8} {size:>10} {wire:>8} {size / wire:>7.0f} {elapsed:>8.2f} "
+                          f"{str(identical):>9} {growth / 1024 / 1024:>8.1f}")
+                    failed = failed or not identical or growth > args.max_growth * 1024 * 1024
+        sys.exit(1 if failed else 0)
+
+    cpus = usable_cpus()
+    print(f"CPU核数: {os.cpu_count()}（可用{cpus}）  pipeline: {args.pipeline}  batch: {args.batch}")
+    if cpus < 2 and any('--workers' in server_args for server_args in server_configs):
+        print("注意: 只有1个可用CPU核，各worker进程只能轮流运行，--workers的结果不能说明多核上的扩展性")
+    print(f"{'server':>24} {'clients':>7} {'size':>9} {'L':>9} {'MB/s':>8} {'pieces/s':>9} "
+          f"{'p50ms':>7} {'p99ms':>7} {'p999ms':>7} {'setup ms':>8}")
+    records = []
+    for server_args in server_configs:
+        proc = start_server(args.port, shlex.split(server_args))
+        try:
+            for clients in parse_list(args.clients):
+                for size in parse_list(args.sizes):
+                    for Lmin, Lmax in map(parse_range, args.ranges.split(',')):
+                        result = run_case(args.port, clients, size, Lmin, Lmax, args.pipeline, args.batch)
+                        lat = result['latency_ms']
+                        print(f"{server_args:>24} {clients:>7} {size:>9} {f'{Lmin}-{Lmax}':>9} "
+                              f"{result['mb_per_s']:>8.2f} {result['pieces_per_s']:>9.0f} {lat['p50']:>7.3f} "
+                              f"{lat['p99']:>7.3f} {lat['p999']:>7.3f} {result['setup_ms']['mean']:>8.3f}")
+                        result.update({'server_args': server_args, 'clients': clients, 'size': size,
+                                       'Lmin': Lmin, 'Lmax': Lmax, 'pipeline': args.pipeline,
+                                       'batch': args.batch})
+                        records.append(result)
+        finally:
+            stop_server(proc)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'), 'cpu_count': os.cpu_count(),
+                       'usable_cpus': cpus,
+                       'python': platform.python_version(), 'platform': platform.platform(),
+                       'results': records}, f, indent=2, ensure_ascii=False)
+        print(f"结果已写入{args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+import asyncio
+import struct
+import zlib
+
+try:
+    import zstandard  # 可选，安装后优先使用zstd
+except ImportError:
+    zstandard = None
+
+# reverse协议的报文头：Type(2字节) + 长度(4字节)，高位字节在前
+# 与reversetcpclient.py / reversetcpserver.py中的'>HI'保持一致，一定不能修改！！！
+HEADER = struct.Struct('>HI')
+HEADER_SIZE = HEADER.size
+
+# 扩展协商：Initialization(扩展)报文为'>HI'报文头(Type=5, N) + 4字节能力位，
+# 服务器用agree报文'>H'(Type=2) + 4字节同意的能力位应答；旧客户端只发Type=1，服务器仍回复2字节的agree
+TYPE_INIT_EX = 5
+CAPS = struct.Struct('>I')
+CAP_BATCH = 0x1  # 支持batchRequest/batchAnswer
+CAP_ZLIB = 0x2  # agree之后双方向的字节流用zlib压缩
+CAP_ZSTD = 0x4  # agree之后双方向的字节流用zstd压缩（需要zstandard模块）
+CAP_COMPRESS = CAP_ZLIB | CAP_ZSTD
+
+# batchRequest(Type=6)/batchAnswer(Type=7)报文体：分块数(4字节) + 每块长度(各4字节) + 各分块数据依次拼接
+TYPE_BATCH_REQUEST = 6
+TYPE_BATCH_ANSWER = 7
+BATCH_COUNT = struct.Struct('>I')
+
+# 续传：Resume报文为'>HI'报文头(Type=8, N) + 能力位(4字节) + 起始分块序号i(4字节)，服务器用与扩展Initialization相同的
+# agree报文（带同意的能力位）应答，之后只接收第i~N-1块共N-i个分块；旧服务器不认识Type=8会直接断开
+TYPE_RESUME = 8
+RESUME = struct.Struct('>II')
+
+
+class FrameReader:
+    """带缓冲的精确读取器
+
+    recv_into直接读进预分配的bytearray，一次系统调用尽量多读，报文头和报文体都从缓冲区里切出来。
+    read_exact返回的是缓冲区上的memoryview，不复制数据，只在下一次读取之前有效，需要保留时自行bytes()。
+    """
+
+    def __init__(self, sock, bufsize=65536):
+        self.sock = sock
+        self.buf = bytearray(bufsize)
+        self.view = memoryview(self.buf)
+        self.start = 0  # 缓冲区中未消费数据的起点
+        self.end = 0  # 缓冲区中已收到数据的终点
+
+    def read_exact(self, n):
+        """读满n个字节，对端提前关闭时抛出ConnectionError"""
+        if self.end - self.start < n:
+            self._fill(n)
+        mv = self.view[self.start:self.start + n]
+        self.start += n
+        return mv
+
+    def read_header(self):
+        """读取一个'>HI'报文头，返回(Type, 长度)"""
+        if self.end - self.start < HEADER_SIZE:
+            self._fill(HEADER_SIZE)
+        Type, length = HEADER.unpack_from(self.buf, self.start)
+        self.start += HEADER_SIZE
+        return Type, length
+
+    def read_frame(self):
+        """读取一个完整报文，返回(Type, 报文体memoryview)"""
+        Type, length = self.read_header()
+        return Type, self.read_exact(length)
+
+    def _fill(self, n):
+        """保证缓冲区中至少有n个未消费的字节"""
+        pending = self.end - self.start
+        if not pending:
+            self.start = self.end = 0
+            if n > len(self.buf):
+                self.buf = bytearray(n)
+                self.view = memoryview(self.buf)
+        elif self.start + n > len(self.buf):
+            if n > len(self.buf):
+                # 报文比缓冲区大：换一个更大的缓冲区
+                # 已导出memoryview的bytearray不能改变大小，所以新建而不是resize
+                new_buf = bytearray(max(n, 2 * len(self.buf)))
+                new_buf[:pending] = self.view[self.start:self.end]
+                self.buf = new_buf
+                self.view = memoryview(new_buf)
+            else:
+                # 尾部空间不够，把未消费的数据挪到缓冲区开头
+                self.view[:pending] = self.view[self.start:self.end]
+            self.start = 0
+            self.end = pending
+        while self.end - self.start < n:
+            self._recv_some()
+
+    def _recv_some(self):
+        k = self.sock.recv_into(self.view[self.end:])
+        if not k:
+            raise ConnectionError("对端关闭了连接")
+        self.end += k
+
+
+def sendmsg_all(sock, buffers):
+    """用scatter-gather方式发送多个缓冲区，处理部分发送的情况"""
+    total = 0
+    for b in buffers:
+        total += len(b)
+    sent = sock.sendmsg(buffers)
+    if sent == total:
+        return
+    # 部分发送：跳过已发送的部分，剩下的继续发
+    views = [memoryview(b).cast('B') for b in buffers]
+    while sent < total:
+        total -= sent
+        while sent and sent >= len(views[0]):
+            sent -= len(views.pop(0))
+        if sent:
+            views[0] = views[0][sent:]
+        sent = sock.sendmsg(views)
+
+
+def batch_table(lengths):
+    """生成batch报文体开头的分块数和长度表"""
+    return struct.pack(f'>I{len(lengths)}I', len(lengths), *lengths)
+
+
+def parse_batch(payload):
+    """解析batch报文体，返回(长度表, 数据起始位置)，格式不对时抛出ValueError"""
+    if len(payload) < BATCH_COUNT.size:
+        raise ValueError("batch报文过短")
+    count = BATCH_COUNT.unpack_from(payload, 0)[0]
+    data_start = BATCH_COUNT.size + 4 * count
+    if data_start > len(payload):
+        raise ValueError("batch长度表不完整")
+    lengths = struct.unpack_from(f'>{count}I', payload, BATCH_COUNT.size)
+    if sum(lengths) != len(payload) - data_start:
+        raise ValueError("batch长度表与数据长度不符")
+    return lengths, data_start
+
+
+def reverse_batch(payload):
+    """服务器端：直接在字节上逐块反转batchRequest，返回(分块数, batchAnswer报文体)
+
+    长度表原样保留，不做ascii解码/编码。
+    """
+    lengths, pos = parse_batch(payload)
+    data = bytes(payload)
+    out = bytearray(data[:pos])
+    for n in lengths:
+        out += data[pos:pos + n][::-1]
+        pos += n
+    return len(lengths), out
+
+
+def split_batch(payload):
+    """客户端：把batchAnswer报文体拆成各分块的memoryview"""
+    lengths, pos = parse_batch(payload)
+    pieces = []
+    for n in lengths:
+        pieces.append(payload[pos:pos + n])
+        pos += n
+    return pieces
+
+
+class FrameWriter:
+    """报文发送器：报文头写入预分配的bytearray，报文头和报文体通过sendmsg一起发送，不做拼接"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.header = bytearray(HEADER_SIZE)
+        # Windows上的socket没有sendmsg，只能退回到拼接后sendall
+        self.has_sendmsg = hasattr(sock, 'sendmsg')
+
+    def send_frame(self, Type, payload=b''):
+        """发送一个'>HI'报文，payload可以是bytes/bytearray/memoryview"""
+        HEADER.pack_into(self.header, 0, Type, len(payload))
+        if not len(payload):
+            self.sock.sendall(self.header)
+        elif self.has_sendmsg:
+            sendmsg_all(self.sock, [self.header, payload])
+        else:
+            self.sock.sendall(self.header + payload)
+
+    def send_parts(self, Type, parts):
+        """报文体由多段组成时（如batch的长度表+各分块），一次sendmsg发出，不拼接"""
+        length = 0
+        for part in parts:
+            length += len(part)
+        HEADER.pack_into(self.header, 0, Type, length)
+        # sendmsg一次最多IOV_MAX(Linux为1024)段
+        if self.has_sendmsg and len(parts) < 1000:
+            sendmsg_all(self.sock, [self.header] + list(parts))
+        else:
+            self.sock.sendall(self.header + b''.join(parts))
+
+    def send_header(self, Type, length):
+        """只发送报文头，报文体随后用send_raw()分块发送（大报文不在内存中拼出整个报文体）"""
+        HEADER.pack_into(self.header, 0, Type, length)
+        self.sock.sendall(self.header)
+
+    def send_raw(self, data):
+        self.sock.sendall(data)
+
+
+# ---- 压缩 ----
+# 协商了CAP_ZLIB/CAP_ZSTD后，agree报文之后两个方向的整个字节流（报文头和报文体）各用一个流式压缩器压缩，
+# 每个报文压缩后立即同步刷新（zlib的Z_SYNC_FLUSH / zstd的FLUSH_BLOCK），接收方收到即可解出完整报文，
+# 压缩字典在整条连接上延续，重复的分块在后面几乎不占带宽。报文格式本身不变。
+
+COMPRESS_ERRORS = (zlib.error,) + ((zstandard.ZstdError,) if zstandard else ())
+
+
+def supported_compression():
+    """本机支持的压缩能力位"""
+    return CAP_ZLIB | (CAP_ZSTD if zstandard else 0)
+
+
+def choose_compression(requested):
+    """从对方请求的能力位中选出一种压缩（优先zstd），返回0表示不压缩"""
+    requested &= supported_compression()
+    if requested & CAP_ZSTD:
+        return CAP_ZSTD
+    return requested & CAP_ZLIB
+
+
+class Compressor:
+    """流式压缩：compress(data)返回可以立即发送、对方能完整解出的压缩数据"""
+
+    def __init__(self, cap, level=None):
+        if cap == CAP_ZSTD:
+            self.obj = zstandard.ZstdCompressor(level=level or 3).compressobj()
+            self.mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            self.obj = zlib.compressobj(level or 1)
+            self.mode = zlib.Z_SYNC_FLUSH
+
+    def compress(self, data):
+        return self.obj.compress(data) + self.obj.flush(self.mode)
+
+
+class Decompressor:
+    """流式解压：输入任意切分的压缩数据，输出已能解出的明文
+
+    max_length限制一次输出的字节数（0为不限制）：几十KB的压缩数据可以解出几十MB，不限制时一次recv就可能
+    绕过服务器的内存预算。解不完的输入留在解压器中，has_tail()为真时用decompress(b'', n)继续取，不要再送入新数据。
+    zlib直接用decompress(data, max_length)和unconsumed_tail，输出正好填满max_length时即使输入已经用完，
+    zlib内部也可能还有没输出的数据（一次匹配复制到一半），所以这时也算has_tail()；zstandard的decompressobj不能限制输出，
+    只能把输入按ZSTD_SLICE字节切开逐段送入，多解出的部分留到下一次返回
+    （zstd一个块最多128KB，块头3字节+RLE内容1字节，每段多出的输出不超过(ZSTD_SLICE/4+1)*128KB）。
+    """
+
+    ZSTD_SLICE = 64
+
+    @classmethod
+    def overshoot(cls, cap):
+        """超出max_length、暂存在解压器里的输出最多有多少字节（zlib不会超出）"""
+        return (cls.ZSTD_SLICE // 4 + 1) * (128 << 10) if cap == CAP_ZSTD else 0
+
+    def __init__(self, cap):
+        self.zstd = cap == CAP_ZSTD
+        if self.zstd:
+            self.obj = zstandard.ZstdDecompressor().decompressobj(write_size=16384)
+            self.tail = memoryview(b'')  # zstd：还没送入解压器的输入
+            self.extra = b''  # zstd：超出max_length、留到下一次的输出
+        else:
+            self.obj = zlib.decompressobj()
+            self.full = False  # zlib：上一次的输出填满了max_length
+
+    def has_tail(self):
+        if self.zstd:
+            return bool(self.tail) or bool(self.extra)
+        return self.full or bool(self.obj.unconsumed_tail)
+
+    def decompress(self, data, max_length=0):
+        try:
+            if self.zstd:
+                return self.decompress_zstd(data, max_length)
+            tail = self.obj.unconsumed_tail
+            out = self.obj.decompress(tail + data if tail else data, max_length)
+            self.full = bool(max_length) and len(out) == max_length
+            return out
+        except COMPRESS_ERRORS as e:
+            raise ValueError(f"压缩数据错误: {e}")  # 与其他报文格式错误一样处理
+
+    def decompress_zstd(self, data, max_length):
+        if data:
+            self.tail = memoryview(bytes(self.tail) + data if self.tail else data)
+        if not max_length:
+            out = self.extra + self.obj.decompress(self.tail)
+            self.tail = memoryview(b'')
+            self.extra = b''
+            return out
+        parts = [self.extra]
+        got = len(self.extra)
+        while got < max_length and self.tail:
+            part = self.obj.decompress(self.tail[:self.ZSTD_SLICE])
+            self.tail = self.tail[self.ZSTD_SLICE:]
+            parts.append(part)
+            got += len(part)
+        out = b''.join(parts)
+        self.extra = out[max_length:]
+        return out[:max_length]
+
+
+class CompressedSocket:
+    """给FrameReader/FrameWriter用的压缩socket，只实现它们用到的recv_into/sendall
+
+    pending为握手阶段已经读进FrameReader缓冲区、但属于压缩流的字节。
+    没有sendmsg方法，FrameWriter会把报文头和报文体拼接后一次压缩，每个报文刷新一次。
+    """
+
+    def __init__(self, sock, cap, pending=b'', level=None):
+        self.sock = sock
+        self.compressor = Compressor(cap, level)
+        self.decompressor = Decompressor(cap)
+        self.pending = bytes(pending)  # 第一次recv_into时先解压这部分
+        self.raw_in = len(pending)  # 收到的压缩字节数
+        self.raw_out = 0  # 发出的压缩字节数
+
+    def sendall(self, data):
+        out = self.compressor.compress(data)
+        self.raw_out += len(out)
+        self.sock.sendall(out)
+
+    def recv_into(self, buf):
+        """解压后的数据直接写入buf，最多len(buf)字节，解压的输出不会超过调用者准备好的缓冲区"""
+        size = len(buf)
+        while True:
+            if self.decompressor.has_tail():
+                plain = self.decompressor.decompress(b'', size)
+            else:
+                if self.pending:
+                    raw, self.pending = self.pending, b''
+                else:
+                    raw = self.sock.recv(65536)
+                    if not raw:
+                        return 0
+                    self.raw_in += len(raw)
+                plain = self.decompressor.decompress(raw, size)
+            if plain:
+                buf[:len(plain)] = plain
+                return len(plain)
+
+
+def pending_bytes(reader):
+    """FrameReader缓冲区中还没有消费的字节（切换到压缩流时交给CompressedSocket）"""
+    return bytes(reader.view[reader.start:reader.end])
+
+
+class CompressedStreamReader:
+    """asyncio模式：包装StreamReader，readexactly()返回解压后的数据
+
+    每次只解压出还差的字节数，缓冲的明文不超过调用者要读的n字节（服务器读报文体之前已按n申请了内存预算）。
+    """
+
+    def __init__(self, reader, cap):
+        self.reader = reader
+        self.decompressor = Decompressor(cap)
+
+    async def readexactly(self, n):
+        parts = []
+        need = n
+        while need:
+            if self.decompressor.has_tail():
+                plain = self.decompressor.decompress(b'', need)
+            else:
+                raw = await self.reader.read(65536)
+                if not raw:
+                    raise asyncio.IncompleteReadError(b''.join(parts), n)
+                plain = self.decompressor.decompress(raw, need)
+            if plain:
+                parts.append(plain)
+                need -= len(plain)
+        return parts[0] if len(parts) == 1 else b''.join(parts)
+
+
+class CompressedStreamWriter:
+    """asyncio模式：包装StreamWriter，writelines()的各段拼接后压缩并刷新，每个报文一次"""
+
+    def __init__(self, writer, cap):
+        self.writer = writer
+        self.compressor = Compressor(cap)
+
+    def write(self, data):
+        self.writer.write(self.compressor.compress(data))
+
+    def writelines(self, parts):
+        self.write(b''.join(parts))
+
+    async def drain(self):
+        await self.writer.drain()
+
+    def close(self):
+        self.writer.close()
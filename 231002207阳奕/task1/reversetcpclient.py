@@ -1,20 +1,30 @@
+import argparse
+import itertools
+import json
+import mmap
+import os
 import socket
 import struct
 import random
 import sys
+import threading
+import time
 
+from framing import (CAP_BATCH, CAP_COMPRESS, CAP_ZLIB, CAP_ZSTD, CAPS, HEADER, RESUME, TYPE_BATCH_ANSWER,
+                     TYPE_BATCH_REQUEST, TYPE_INIT_EX, TYPE_RESUME, CompressedSocket, FrameReader, FrameWriter,
+                     batch_table, pending_bytes, split_batch, supported_compression)
 
-def main():
-    server_ip = sys.argv[1]
-    server_port = int(sys.argv[2])
-    Lmin = int(sys.argv[3])
-    Lmax = int(sys.argv[4])
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import tracing
 
-    file_path = 'text.txt'
+# 跟踪事件的输出格式：--trace debug时逐块输出"序号:反转后的内容"
+TRACE_FORMATS = {
+    'answer': "{i}:{text}",
+}
 
-    # 读取文件并分块
-    with open(file_path, 'r') as f:
-        data = f.read()
+
+def split_pieces(data, Lmin, Lmax):
+    """将数据按Lmin~Lmax的随机长度分块"""
     piece = []
     pos = 0
     file_len = len(data)
@@ -22,50 +32,588 @@ def main():
         pieces_len = random.randint(Lmin, Lmax) if (file_len - pos) > Lmax else (file_len - pos)
         piece.append(data[pos:pos + pieces_len])
         pos += pieces_len
-    N = len(piece)
+    return piece
+
+
+def piece_lengths(file_len, Lmin, Lmax, rng):
+    """逐个生成分块长度，规则与split_pieces相同，但不生成分块本身"""
+    pos = 0
+    while pos < file_len:
+        pieces_len = rng.randint(Lmin, Lmax) if (file_len - pos) > Lmax else (file_len - pos)
+        yield pieces_len
+        pos += pieces_len
+
+
+def count_pieces(file_len, Lmin, Lmax, seed):
+    """用同一个随机种子预先走一遍分块长度，得到Initialization报文需要的N"""
+    N = 0
+    for _ in piece_lengths(file_len, Lmin, Lmax, random.Random(seed)):
+        N += 1
+    return N
 
-    # 连接服务器
-    clientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    clientSocket.connect((server_ip, server_port))
 
-    # 发送Initialization报文
+def iter_pieces(buf, lengths, pos=0):
+    """从buf（mmap）的pos处开始按长度依次取出分块，分块只在需要发送时才生成"""
+    for pieces_len in lengths:
+        yield buf[pos:pos + pieces_len]
+        pos += pieces_len
+
+
+def batched(pieces, size):
+    """把分块每size个组成一批"""
+    it = iter(pieces)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def send_request(writer, item, batch):
+    """发送一个reverseRequest报文，batch模式下item是一批分块，发送一个batchRequest报文"""
+    if batch:
+        writer.send_parts(TYPE_BATCH_REQUEST, [batch_table([len(p) for p in item])] + item)
+    else:
+        writer.send_frame(3, item)
+
 
+def recv_answer(reader, i, on_answer):
+    """接收一个reverseAnswer/batchAnswer报文并回调每个反转后的分块，返回分块数，报文类型不对时返回0"""
+    Type, payload = reader.read_frame()
+    if Type == 4:
+        on_answer(i, payload)
+        return 1
+    if Type == TYPE_BATCH_ANSWER:
+        answers = split_batch(payload)
+        for j, reversed_data in enumerate(answers):
+            on_answer(i + j, reversed_data)
+        return len(answers)
+    return 0
+
+
+def transfer_lockstep(reader, writer, items, batch, on_answer, on_send=None):
+    """逐块收发：发送一个reverseRequest后等待对应的reverseAnswer再发下一个"""
+    count = 0
+    for item in items:
+        # 发送reverseRequest
+        if on_send:
+            on_send(count, len(item) if batch else 1)
+        send_request(writer, item, batch)
+
+        # 接收reverseAnswer
+        received = recv_answer(reader, count, on_answer)
+        if not received:
+            print("服务器应答报文丢失")
+            break
+        count += received
+    return count
+
+
+def transfer_pipelined(reader, writer, items, N, batch, depth, on_answer, sock=None, on_send=None):
+    """流水线收发：发送线程最多保持depth个未应答的请求报文，主线程按顺序读取应答
+
+    on_send(i, n)在拿到窗口位置之后、第i~i+n-1个分块的请求报文写入socket之前调用，时延从这时开始计算才不含排队等待窗口的时间
+    （不能放在写入之后：应答可能在发送线程回调之前就被主线程收到）。
+    发送线程出错（发送失败、读取输入出错等）时关闭sock的读方向，让阻塞在接收上的主线程退出，再把这个异常抛给调用者。
+    """
+    # TCP保证按序到达，服务器也按序处理，所以第i个应答一定对应第i个请求
+    window = threading.Semaphore(depth)
+    stop = threading.Event()
+    errors = []
+
+    def sender():
+        sent = 0
+        try:
+            for item in items:
+                window.acquire()
+                if stop.is_set():
+                    return
+                n = len(item) if batch else 1
+                if on_send:
+                    on_send(sent, n)
+                send_request(writer, item, batch)
+                sent += n
+        except Exception as e:
+            if stop.is_set():
+                return  # 主线程已经结束，连接随后关闭，发送失败是预期的
+            errors.append(e)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RD)
+                except OSError:
+                    pass
+
+    sender_thread = threading.Thread(target=sender)
+    sender_thread.daemon = True
+    sender_thread.start()
+
+    count = 0
+    try:
+        while count < N:
+            try:
+                received = recv_answer(reader, count, on_answer)
+            except ConnectionError:
+                if errors:
+                    break  # 发送线程出错后关闭了读方向
+                raise
+            if not received:
+                print("服务器应答报文丢失")
+                break
+            window.release()  # 收到一个应答，窗口空出一个位置
+            count += received
+    finally:
+        # 让发送线程退出
+        stop.set()
+        window.release()
+    sender_thread.join(timeout=1.0)
+    if errors:
+        raise errors[0]
+    return count
+
+
+def handshake(clientSocket, reader, N, caps, first=0):
+    """发送Initialization报文并接收agree报文，返回服务器同意的能力位，服务器拒绝时返回None
+
+    first>0时发送Resume报文，告诉服务器从第first个分块继续，只传输剩下的N-first个分块。
+    """
     # 在Python的struct.pack()函数中，'>HI'是格式字符串（format string），用于指定二进制数据的封装格式。
     # H表示2字节，I表示4字节
     # >标识了数据在内存中的排列顺序，会将数据存储为高位字节在前的模式
     # 一定不能修改>HI和下面的H！！！
-    Type = 1
-    clientSocket.send(struct.pack('>HI', Type, N))
+    if first:
+        clientSocket.sendall(HEADER.pack(TYPE_RESUME, N) + RESUME.pack(caps, first))
+    elif caps:
+        # Initialization(扩展)报文，附带希望使用的能力位
+        clientSocket.sendall(HEADER.pack(TYPE_INIT_EX, N) + CAPS.pack(caps))
+    else:
+        Type = 1
+        clientSocket.sendall(struct.pack('>HI', Type, N))
 
     # 接收agree报文
-    Type = struct.unpack('>H', clientSocket.recv(2))[0]
+    Type = struct.unpack('>H', reader.read_exact(2))[0]
     if Type != 2:
-        print("服务器无响应")
+        return None
+    if caps or first:
+        return CAPS.unpack(reader.read_exact(CAPS.size))[0]
+    return 0
+
+
+def open_connection(server_addr, N, caps, first=0):
+    """连接服务器并完成握手，返回(socket, reader, writer, 同意的能力位)
+
+    旧服务器收到扩展握手会直接断开，这时重新连接并退回原来的Initialization报文；
+    不支持Resume报文时改为把剩下的N-first个分块当作一次新的传输。
+    """
+    while True:
+        clientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        clientSocket.connect(server_addr)
+        reader = FrameReader(clientSocket)
+        try:
+            granted = handshake(clientSocket, reader, N, caps, first)
+        except ConnectionError:
+            clientSocket.close()
+            if first:
+                print("服务器不支持Resume报文，剩下的分块按新的传输发送")
+                N -= first
+                first = 0
+                continue
+            if not caps:
+                raise
+            print("服务器不支持扩展协商，退回原协议")
+            caps = 0
+            continue
+        return clientSocket, reader, FrameWriter(clientSocket), granted
+
+
+def reverse_over_connection(server_addr, pieces, N, depth, on_answer, batch=1, timings=None, compress=0, first=0,
+                            on_send=None):
+    """建立一条连接，完成握手后发送N个分块，返回收到的应答个数
+
+    batch>1时协商batch能力，每个batchRequest报文携带batch个分块；compress为希望使用的压缩能力位，由服务器选一种。
+    first>0时用Resume报文从第first个分块续传，pieces从第first个分块开始，只发送和接收N-first个分块。
+    timings不为None时记录建立连接和握手的耗时timings['setup']（压测用），
+    协商了压缩时还记录线路上发送/接收的压缩字节数timings['wire']。
+    on_send(i, n)在第i~i+n-1个分块的请求报文即将写入socket时调用（压测用它记录发送时刻）。
+    """
+    caps = (CAP_BATCH if batch > 1 else 0) | compress
+    start = time.perf_counter()
+    clientSocket, reader, writer, granted = open_connection(server_addr, N, caps, first)
+    if timings is not None:
+        timings['setup'] = time.perf_counter() - start
+    stream = None
+    try:
+        if granted is None:
+            print("服务器无响应")
+            return 0
+        if granted & CAP_COMPRESS:
+            # agree之后两个方向都是压缩流
+            stream = CompressedSocket(clientSocket, granted & CAP_COMPRESS, pending_bytes(reader))
+            reader = FrameReader(stream)
+            writer = FrameWriter(stream)
+        use_batch = bool(granted & CAP_BATCH)
+        items = batched(pieces, batch) if use_batch else pieces
+        if first:
+            N -= first
+            answer = on_answer
+            on_answer = lambda i, reversed_bytes: answer(first + i, reversed_bytes)  # 回调的序号仍从0开始计
+            if on_send:
+                sent = on_send
+                on_send = lambda i, n: sent(first + i, n)
+        if depth > 1:
+            return transfer_pipelined(reader, writer, items, N, use_batch, depth, on_answer, clientSocket, on_send)
+        return transfer_lockstep(reader, writer, items, use_batch, on_answer, on_send)
+    finally:
+        if stream and timings is not None:
+            timings['wire'] = (stream.raw_out, stream.raw_in)
+        clientSocket.close()
+
+
+def run_parallel(server_addr, jobs, depth, batch=1, compress=0):
+    """每个job使用一条独立连接（各自握手、各自的N）并行发送，jobs为[(pieces, N, 字节数, on_answer)]"""
+    stats = [None] * len(jobs)
+
+    def worker(k, pieces, N, nbytes, on_answer):
+        start = time.time()
+        timings = {}
+        try:
+            count = reverse_over_connection(server_addr, pieces, N, depth, on_answer, batch, timings, compress)
+        except Exception as e:
+            # 每个线程自己捕获所有异常：否则线程带着异常退出，stats[k]还是None，主线程也不知道哪条连接失败了
+            print(f"连接{k}出错: {type(e).__name__}: {e}")
+            count = 0
+        stats[k] = (count, N, nbytes, time.time() - start, timings.get('wire'))
+
+    start = time.time()
+    threads = [threading.Thread(target=worker, args=(k,) + tuple(job)) for k, job in enumerate(jobs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return stats, time.time() - start
+
+
+def print_report(stats, elapsed):
+    """打印每条连接和总体的吞吐量"""
+    print("\n----- 传输报告 -----")
+    total_count = total_N = total_bytes = 0
+    wire_out = wire_in = 0
+    for k, (count, N, nbytes, conn_elapsed, wire) in enumerate(stats):
+        mbps = nbytes / conn_elapsed / 1024 / 1024 if conn_elapsed > 0 else 0
+        print(f"连接{k}: {count}/{N}个分块, {nbytes}字节, 用时{conn_elapsed:.3f}s, {mbps:.2f}MB/s")
+        total_count += count
+        total_N += N
+        total_bytes += nbytes
+        if wire:
+            wire_out += wire[0]
+            wire_in += wire[1]
+    mbps = total_bytes / elapsed / 1024 / 1024 if elapsed > 0 else 0
+    print(f"合计: {total_count}/{total_N}个分块, {total_bytes}字节, 用时{elapsed:.3f}s, {mbps:.2f}MB/s")
+    if wire_out:
+        # 未压缩时每个方向的字节数约为数据字节数加上报文头
+        print(f"压缩: 发送{wire_out}字节, 接收{wire_in}字节（数据{total_bytes}字节）")
+
+
+def failed_connections(stats):
+    """没有收到全部应答的连接序号，打印出来；全部完成时返回空列表"""
+    failed = [k for k, (count, N, *_) in enumerate(stats) if count < N]
+    if failed:
+        print(f"传输未完成: 连接{', '.join(map(str, failed))}没有收到全部应答")
+    return failed
+
+
+def split_ranges(N, K):
+    """把N个分块按序号均分成K段，返回每段的(起始序号, 结束序号)"""
+    return [(N * k // K, N * (k + 1) // K) for k in range(K)]
+
+
+def range_offsets(lengths, ranges, file_len):
+    """再走一遍分块长度，求出每段第一个分块的起始字节，末尾追加file_len"""
+    offsets = []
+    cuts = iter([first for first, _ in ranges])
+    cut = next(cuts, None)
+    pos = 0
+    for i, pieces_len in enumerate(lengths):
+        while cut == i:
+            offsets.append(pos)
+            cut = next(cuts, None)
+        pos += pieces_len
+    # 剩下的段（分块数为0）从文件末尾开始
+    while len(offsets) < len(ranges) + 1:
+        offsets.append(file_len)
+    return offsets
+
+
+def main():
+    # 命令行参数: python reversetcpclient.py <server_ip> <server_port> <Lmin> <Lmax> [--pipeline N] [--stream] [--connections K] [--batch B] [--trace debug]
+    parser = argparse.ArgumentParser(description="reverse TCP client")
+    parser.add_argument('server_ip')
+    parser.add_argument('server_port', type=int)
+    parser.add_argument('Lmin', type=int)
+    parser.add_argument('Lmax', type=int)
+    parser.add_argument('--pipeline', type=int, default=1,
+                        help="最多同时在途的reverseRequest个数，1为原来的逐块收发")
+    parser.add_argument('--stream', action='store_true',
+                        help="流式模式：mmap读取输入、边收边写输出，内存占用与文件大小无关")
+    parser.add_argument('--connections', type=int, default=1,
+                        help="并行连接数K，分块按顺序均分到K条连接上")
+    parser.add_argument('--batch', type=int, default=1,
+                        help="每个batchRequest报文携带的分块数，大于1时与服务器协商batch能力")
+    parser.add_argument('--compress', choices=['off', 'zlib', 'zstd', 'auto'], default='off',
+                        help="与服务器协商压缩agree之后的字节流：auto为本机支持的全部方式，由服务器选一种（优先zstd）")
+    parser.add_argument('--input', default='text.txt')
+    parser.add_argument('--output', default='reversed.txt')
+    parser.add_argument('--seed', type=int, default=None,
+                        help="流式/续传模式分块长度的随机种子，默认随机；相同种子得到相同的分块")
+    parser.add_argument('--resume', action='store_true',
+                        help="可续传：按流式模式传输，定期把进度写入<output>.ckpt，连接断开后自动重连并用Resume报文继续；"
+                             "上次中断留下的检查点与输入文件一致时从检查点继续")
+    parser.add_argument('--checkpoint-interval', type=float, default=1.0, help="--resume时两次写检查点的最短间隔(秒)")
+    parser.add_argument('--retries', type=int, default=5, help="--resume时连续多少次重连都没有进展就放弃")
+    tracing.add_arguments(parser)
+    args = parser.parse_args()
+    server_addr = (args.server_ip, args.server_port)
+    trace = tracing.from_args(args, TRACE_FORMATS)
+    args.compress = {'off': 0, 'zlib': CAP_ZLIB, 'zstd': CAP_ZSTD, 'auto': supported_compression()}[args.compress]
+    if args.compress & ~supported_compression():
+        print("zstd压缩需要安装zstandard: pip install zstandard")
         return
 
-    results = []
-    for i, pieces in enumerate(piece):
-        # 发送reverseRequest
-        Type = 3
-        pieces_bytes = pieces.encode('ascii')
-        header = struct.pack('>HI', Type, len(pieces_bytes))
-        clientSocket.send(header + pieces_bytes)
+    if args.resume:
+        resume_main(args, server_addr)
+        return
+    if args.stream:
+        stream_main(args, server_addr)
+        return
 
-        # 接收reverseAnswer
-        header = clientSocket.recv(6)
-        Type, rev_len = struct.unpack('>HI', header)
-        if Type != 4:
-            print("服务器应答报文丢失")
-            break
-        reversed_data = clientSocket.recv(rev_len).decode('ascii')
-        print(f"{i}:{reversed_data}")
-        results.append(reversed_data)
+    # 读取文件并分块
+    with open(args.input, 'r') as f:
+        data = f.read()
+    piece = split_pieces(data, args.Lmin, args.Lmax)
+    N = len(piece)
+    pieces = [pieces.encode('ascii') for pieces in piece]
+
+    def make_job(first, last):
+        results = []
+
+        def on_answer(i, reversed_bytes):
+            reversed_data = str(reversed_bytes, 'ascii')
+            if trace.debug:
+                trace.event('answer', i=first + i, text=reversed_data)
+            results.append(reversed_data)
+
+        job = (pieces[first:last], last - first, sum(len(p) for p in pieces[first:last]), on_answer)
+        return job, results
+
+    jobs, results = zip(*[make_job(first, last) for first, last in split_ranges(N, max(1, args.connections))])
+    stats, elapsed = run_parallel(server_addr, jobs, args.pipeline, args.batch, args.compress)
+    trace.flush()
+    if len(jobs) > 1 or args.compress:
+        print_report(stats, elapsed)
+    if failed_connections(stats):
+        sys.exit(1)  # 不完整的结果不写入输出文件
+
+    # 反转后字符串按原顺序写入文件
+    with open(args.output, 'w') as f:
+        for part in results:
+            f.write(''.join(part))
+
+
+def stream_main(args, server_addr):
+    """流式模式：按字节处理输入文件（不做换行符转换），应答到达后立即写入输出文件"""
+    with open(args.input, 'rb') as f_in:
+        file_len = os.fstat(f_in.fileno()).st_size
+        # 空文件不能mmap
+        buf = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) if file_len else b''
+        try:
+            # 分块长度由种子决定：先数一遍得到N，发送时用同一个种子重新生成，分块不需要全部保存
+            seed = random.randrange(1 << 32) if args.seed is None else args.seed
+            N = count_pieces(file_len, args.Lmin, args.Lmax, seed)
+            ranges = split_ranges(N, max(1, args.connections))
+
+            offsets = range_offsets(piece_lengths(file_len, args.Lmin, args.Lmax, random.Random(seed)),
+                                    ranges, file_len)
+
+            # 反转不改变长度，所以每段应答在输出文件中的位置与输入相同，各连接用自己的文件句柄写自己那一段
+            with open(args.output, 'wb') as f_out:
+                f_out.truncate(file_len)
+            outputs = []
+            jobs = []
+            for k, (first, last) in enumerate(ranges):
+                f_out = open(args.output, 'r+b')
+                f_out.seek(offsets[k])
+                outputs.append(f_out)
+                lengths = itertools.islice(
+                    piece_lengths(file_len, args.Lmin, args.Lmax, random.Random(seed)), first, last)
+                jobs.append((iter_pieces(buf, lengths, offsets[k]), last - first,
+                             offsets[k + 1] - offsets[k], make_writer(f_out)))
+            try:
+                stats, elapsed = run_parallel(server_addr, jobs, args.pipeline, args.batch, args.compress)
+            finally:
+                for f_out in outputs:
+                    f_out.close()
+        finally:
+            if file_len:
+                buf.close()
+    print_report(stats, elapsed)
+    if failed_connections(stats):
+        sys.exit(1)
+
+
+def make_writer(f_out):
+    """生成把应答直接写入文件的回调"""
+    def on_answer(i, reversed_bytes):
+        f_out.write(reversed_bytes)
+    return on_answer
+
+
+# ---- 续传 ----
+# 分块边界由(文件长度, Lmin, Lmax, 种子)完全确定，检查点只需记下种子和每段已确认的分块数及其字节位置。
+# 已确认指应答已写入输出文件并flush：先flush输出文件再写检查点，检查点的进度不会超过输出文件中实际写入的内容。
+
+CHECKPOINT_VERSION = 1
+
+
+class Checkpoint:
+    """<output>.ckpt检查点（JSON）：输入文件的标识、分块参数，以及每段的[起始序号, 结束序号, 已确认数, 续传的字节位置]"""
+
+    def __init__(self, path, meta, ranges, interval):
+        self.path = path
+        self.meta = meta
+        self.ranges = ranges
+        self.interval = interval
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def load(path, meta):
+        """读取检查点，不存在或与本次的输入文件、分块参数不一致时返回None"""
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get('version') != CHECKPOINT_VERSION or any(state.get(k) != v for k, v in meta.items()):
+            print("检查点与输入文件或分块参数不一致，重新开始")
+            return None
+        return state
+
+    def update(self, k, done, offset):
+        """第k段的进度前进到done个分块，写入检查点；写临时文件后os.replace，中途被杀掉也不会留下半个检查点"""
+        with self.lock:
+            self.ranges[k][2:] = [done, offset]
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(dict(self.meta, version=CHECKPOINT_VERSION, ranges=self.ranges), f)
+            os.replace(tmp, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def resume_range(server_addr, args, buf, file_len, seed, checkpoint, k):
+    """第k段：断开后重连，用Resume报文从最后确认的分块继续；连续args.retries次没有进展时放弃，返回已确认的分块数"""
+    first, last, done, offset = checkpoint.ranges[k]
+    N = last - first
+    with open(args.output, 'r+b') as f_out:
+        f_out.seek(offset)
+        progress = [done, offset]
+        saved_at = [time.monotonic()]
+
+        def on_answer(i, reversed_bytes):
+            f_out.write(reversed_bytes)
+            progress[0] += 1
+            progress[1] += len(reversed_bytes)
+            now = time.monotonic()
+            if now - saved_at[0] >= checkpoint.interval:
+                f_out.flush()
+                checkpoint.update(k, *progress)
+                saved_at[0] = now
+
+        failures = 0
+        while progress[0] < N:
+            start_done, start_offset = progress
+            lengths = itertools.islice(piece_lengths(file_len, args.Lmin, args.Lmax, random.Random(seed)),
+                                       first + start_done, last)
+            try:
+                reverse_over_connection(server_addr, iter_pieces(buf, lengths, start_offset), N, args.pipeline,
+                                        on_answer, args.batch, compress=args.compress, first=start_done)
+            except (OSError, ValueError) as e:
+                print(f"连接{k}在第{first + progress[0]}个分块处断开: {e}")
+            f_out.flush()
+            checkpoint.update(k, *progress)
+            if progress[0] >= N:
+                break
+            # 有进展时重新计数，重连间隔指数退避
+            failures = 0 if progress[0] > start_done else failures + 1
+            if failures > args.retries:
+                break
+            time.sleep(min(0.1 * 2 ** failures, 5.0))
+    return progress[0]
+
+
+def resume_main(args, server_addr):
+    """可续传的流式传输：优先从检查点继续，全部完成后删除检查点"""
+    path = args.output + '.ckpt'
+    with open(args.input, 'rb') as f_in:
+        st = os.fstat(f_in.fileno())
+        file_len = st.st_size
+        meta = {'input': os.path.abspath(args.input), 'size': file_len, 'mtime_ns': st.st_mtime_ns,
+                'Lmin': args.Lmin, 'Lmax': args.Lmax}
+        state = Checkpoint.load(path, meta)
+        if state and os.path.exists(args.output) and os.path.getsize(args.output) == file_len:
+            # 分块段的划分以检查点为准，本次的--connections不起作用
+            seed, N, ranges = state['seed'], state['N'], state['ranges']
+            print(f"从检查点继续: 已完成{sum(r[2] for r in ranges)}/{N}个分块")
+        else:
+            seed = random.randrange(1 << 32) if args.seed is None else args.seed
+            N = count_pieces(file_len, args.Lmin, args.Lmax, seed)
+            split = split_ranges(N, max(1, args.connections))
+            offsets = range_offsets(piece_lengths(file_len, args.Lmin, args.Lmax, random.Random(seed)),
+                                    split, file_len)
+            ranges = [[first, last, 0, offsets[k]] for k, (first, last) in enumerate(split)]
+            with open(args.output, 'wb') as f_out:
+                f_out.truncate(file_len)
+        checkpoint = Checkpoint(path, dict(meta, seed=seed, N=N), ranges, args.checkpoint_interval)
+        checkpoint.update(0, *ranges[0][2:])  # 开始传输前先写一次，记下分块边界
+
+        buf = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) if file_len else b''
+        try:
+            # 与run_parallel相同，每段一条连接并行传输，只是断开后各自重连续传
+            stats = [None] * len(ranges)
+            start_offsets = [r[3] for r in ranges]
+
+            def worker(k):
+                started = time.time()
+                try:
+                    count = resume_range(server_addr, args, buf, file_len, seed, checkpoint, k)
+                except Exception as e:
+                    # 断开重连之外的错误（如写输出文件失败）不重试，已确认的进度在检查点中
+                    print(f"连接{k}出错: {type(e).__name__}: {e}")
+                    count = ranges[k][2]
+                first, last, done, offset = ranges[k]
+                # 字节数只算本次运行传输的部分
+                stats[k] = (count, last - first, offset - start_offsets[k], time.time() - started, None)
 
-    # 反转后字符串写入文件
-    with open('reversed.txt', 'w') as f:
-        f.write(''.join(results))
-    clientSocket.close()
+            start = time.time()
+            threads = [threading.Thread(target=worker, args=(k,)) for k in range(len(ranges))]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.time() - start
+        finally:
+            if file_len:
+                buf.close()
+    print_report(stats, elapsed)
+    if all(count == N_k for count, N_k, *_ in stats):
+        checkpoint.remove()
+    else:
+        failed_connections(stats)
+        print(f"进度保存在{path}，用相同的参数加--resume重新运行即可继续")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
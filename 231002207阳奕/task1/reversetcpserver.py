@@ -1,40 +1,602 @@
+import argparse
+import asyncio
+import mmap
+import multiprocessing
+import os
+import signal
 import socket
 import struct
+import sys
+import tempfile
 import threading
+import time
 
+from framing import (BATCH_COUNT, CAP_BATCH, CAP_COMPRESS, CAPS, HEADER, HEADER_SIZE, RESUME, TYPE_BATCH_ANSWER,
+                     TYPE_BATCH_REQUEST, TYPE_INIT_EX, TYPE_RESUME, CompressedSocket, CompressedStreamReader,
+                     CompressedStreamWriter, Decompressor, FrameReader, FrameWriter, choose_compression, pending_bytes,
+                     reverse_batch, supported_compression)
 
-def handle_client(conn):
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import metrics
+
+
+# 服务器支持的扩展能力（压缩能力取决于是否安装了zstandard）
+SERVER_CAPS = CAP_BATCH | supported_compression()
+
+# 指标（--metrics-port导出），各线程写自己的计数单元，不加锁
+METRICS = metrics.Registry()
+CONNECTIONS_ACTIVE = METRICS.gauge('reverse_connections_active', "当前处理中的连接数")
+CONNECTIONS = METRICS.counter('reverse_connections_total', "接受的连接数")
+REJECTED = METRICS.counter('reverse_connections_rejected_total', "超过--max-conn被直接关闭的连接数")
+BYTES_IN = METRICS.counter('reverse_bytes_received_total', "收到的报文字节数（含报文头）")
+BYTES_OUT = METRICS.counter('reverse_bytes_sent_total', "发送的报文字节数（含报文头）")
+PIECES = METRICS.counter('reverse_pieces_total', "反转的数据块数")
+COMPRESSED = METRICS.counter('reverse_compressed_connections_total', "协商了压缩的连接数")
+RESUMED = METRICS.counter('reverse_resumed_connections_total', "用Resume报文从中间分块继续传输的连接数")
+REQUEST_SECONDS = METRICS.histogram('reverse_request_seconds', "处理一个reverseRequest/batchRequest报文的耗时（秒）")
+LARGE_FRAMES = METRICS.counter('reverse_large_frames_total', "超过--large-piece、写入临时文件处理的请求报文数")
+BUDGET_USED = METRICS.gauge('reverse_memory_budget_used_bytes', "已从内存预算中申请的字节数")
+BUDGET_WAITS = METRICS.counter('reverse_memory_budget_waits_total', "因内存预算不足而等待的次数")
+
+# 小报文在内存中处理时大约同时存在的副本数（读缓冲区 + 反转结果，batch还有一份bytes副本）
+SMALL_COPIES = 3
+# 大报文处理时同时存在的块数（读入的块 + 反转后的块）
+LARGE_COPIES = 2
+
+
+class MemoryBudget:
+    """线程模式的全局内存预算：读入报文体之前先申请，超出预算时阻塞
+
+    阻塞期间不再从socket读取，对端的发送窗口被填满后TCP自然限速（反压）。
+    单个请求超过整个预算时，在没有其他占用的情况下也放行，避免永远等待。
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, n):
+        with self.cond:
+            if self.used and self.used + n > self.limit:
+                BUDGET_WAITS.inc()
+                self.cond.wait_for(lambda: not self.used or self.used + n <= self.limit)
+            self.used += n
+            BUDGET_USED.inc(n)
+
+    def release(self, n):
+        with self.cond:
+            self.used -= n
+            BUDGET_USED.dec(n)
+            self.cond.notify_all()
+
+
+class AsyncMemoryBudget:
+    """asyncio模式的全局内存预算，规则与MemoryBudget相同，等待时让出事件循环"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.cond = asyncio.Condition()
+
+    async def acquire(self, n):
+        async with self.cond:
+            if self.used and self.used + n > self.limit:
+                BUDGET_WAITS.inc()
+                await self.cond.wait_for(lambda: not self.used or self.used + n <= self.limit)
+            self.used += n
+            BUDGET_USED.inc(n)
+
+    async def release(self, n):
+        async with self.cond:
+            self.used -= n
+            BUDGET_USED.dec(n)
+            self.cond.notify_all()
+
+
+class PieceLimits:
+    """报文大小相关的参数：超过large_piece字节的请求报文写入spill_dir下的临时文件，按chunk字节分块处理"""
+
+    def __init__(self, budget, large_piece=1 << 20, chunk=1 << 16, spill_dir=None):
+        self.budget = budget
+        self.large_piece = large_piece
+        self.chunk = chunk
+        self.spill_dir = spill_dir
+
+
+def answer_type(Type):
+    return 4 if Type == 3 else TYPE_BATCH_ANSWER
+
+
+def reversed_range(mm, start, end, chunk):
+    """从end往start按块读出[start, end)并反转，拼起来就是整段反转后的数据"""
+    pos = end
+    while pos > start:
+        low = max(start, pos - chunk)
+        yield mm[low:pos][::-1]
+        pos = low
+
+
+def batch_lengths(mm, count, chunk):
+    """按块读取batch报文的长度表，不一次解析整个表"""
+    step = max(1, chunk // 4)
+    for first in range(0, count, step):
+        n = min(step, count - first)
+        yield from struct.unpack_from(f'>{n}I', mm, BATCH_COUNT.size + 4 * first)
+
+
+def check_large(mm, Type, length, chunk):
+    """发送应答之前检查整个报文（应答一旦开始发送就不能撤回），返回分块数，格式不对时抛出ValueError"""
+    if Type == 3:
+        for low in range(0, length, chunk):
+            if not mm[low:low + chunk].isascii():
+                raise ValueError("reverseRequest不是ASCII文本")
+        return 1
+    if length < BATCH_COUNT.size:
+        raise ValueError("batch报文过短")
+    count = BATCH_COUNT.unpack_from(mm, 0)[0]
+    data_start = BATCH_COUNT.size + 4 * count
+    if data_start > length or sum(batch_lengths(mm, count, chunk)) != length - data_start:
+        raise ValueError("batch长度表与数据长度不符")
+    return count
+
+
+def answer_chunks(mm, Type, length, chunk):
+    """按块生成大报文应答的报文体：reverseRequest从末尾往前读；batchRequest先原样输出长度表，再逐块反转，
+    小分块攒够chunk字节再输出"""
+    if Type == 3:
+        yield from reversed_range(mm, 0, length, chunk)
+        return
+    count = BATCH_COUNT.unpack_from(mm, 0)[0]
+    pos = BATCH_COUNT.size + 4 * count
+    for low in range(0, pos, chunk):
+        yield mm[low:min(low + chunk, pos)]
+    out = bytearray()
+    for n in batch_lengths(mm, count, chunk):
+        for part in reversed_range(mm, pos, pos + n, chunk):
+            out += part
+            if len(out) >= chunk:
+                yield bytes(out)
+                out.clear()
+        pos += n
+    if out:
+        yield bytes(out)
+
+
+def reverse_large(reader, writer, Type, length, limits, conn=None, read_timeout=None):
+    """大报文（线程模式）：报文体按块写入临时文件，再mmap按块读出反转后的数据发送，
+    内存中只有几个chunk，与报文大小无关；返回分块数。conn为TimedConn时read_timeout对每个块分别计时（与asyncio模式相同）"""
+    chunk = limits.chunk
+    with tempfile.TemporaryFile(dir=limits.spill_dir) as f:
+        left = length
+        while left:
+            if conn:
+                conn.expect(read_timeout)
+            part = reader.read_exact(min(chunk, left))
+            f.write(part)
+            left -= len(part)
+        if conn:
+            conn.idle()
+        f.flush()
+        with mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ) as mm:
+            count = check_large(mm, Type, length, chunk)
+            writer.send_header(answer_type(Type), length)
+            for part in answer_chunks(mm, Type, length, chunk):
+                writer.send_raw(part)
+    return count
+
+
+async def reverse_large_async(reader, writer, Type, length, limits, read_timeout):
+    """大报文（asyncio模式），做法与reverse_large相同；read_timeout对每个块分别计时，每发送一块等待drain()"""
+    chunk = limits.chunk
+    with tempfile.TemporaryFile(dir=limits.spill_dir) as f:
+        left = length
+        while left:
+            part = await asyncio.wait_for(reader.readexactly(min(chunk, left)), read_timeout)
+            f.write(part)
+            left -= len(part)
+        f.flush()
+        with mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ) as mm:
+            count = check_large(mm, Type, length, chunk)
+            writer.write(HEADER.pack(answer_type(Type), length))
+            for part in answer_chunks(mm, Type, length, chunk):
+                writer.write(part)
+                await writer.drain()
+    return count
+
+
+class TimedConn:
+    """线程模式的连接：接收超时按截止时间计算，其余方法直接转给socket
+
+    expect(t)之后的接收必须在t秒内全部完成，每次recv的超时是剩下的时间，对端每隔不到t秒发一个字节也会超时；
+    idle()之后恢复为每次recv等待idle_timeout（等待下一个报文头）。
+    """
+
+    def __init__(self, conn, idle_timeout=None):
+        self.conn = conn
+        self.idle_timeout = idle_timeout
+        self.deadline = None
+        conn.settimeout(idle_timeout)
+
+    def expect(self, timeout):
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+
+    def idle(self):
+        self.deadline = None
+        self.conn.settimeout(self.idle_timeout)
+
+    def arm(self):
+        if self.deadline is not None:
+            left = self.deadline - time.monotonic()
+            if left <= 0:
+                raise socket.timeout("读取报文体超时")
+            self.conn.settimeout(left)
+
+    def recv(self, n):
+        self.arm()
+        return self.conn.recv(n)
+
+    def recv_into(self, buf):
+        self.arm()
+        return self.conn.recv_into(buf)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+def grant_caps(requested):
+    """服务器同意的能力位：非压缩能力取交集，压缩最多选一种"""
+    return (requested & SERVER_CAPS & ~CAP_COMPRESS) | choose_compression(requested)
+
+
+def handle_client(conn, limits, read_timeout=None, idle_timeout=None):
+    """线程模式下处理一个客户端连接；idle_timeout：等待下一个报文头的最长时间，read_timeout：报文头到达后读完报文体的最长时间"""
+    conn = TimedConn(conn, idle_timeout)
+    reader = FrameReader(conn)
+    writer = FrameWriter(conn)
+    reserve = 0  # 压缩连接为解压器暂存的输出预留的内存预算
+    CONNECTIONS.inc()
+    CONNECTIONS_ACTIVE.inc()
     try:
-        header = conn.recv(6)
-        Type, N = struct.unpack('>HI', header) # Initialization报文
-        if Type != 1:
+        Type, N = reader.read_header() # Initialization报文
+        if Type == 1:
+            caps = 0
+            conn.sendall(struct.pack('>H', 2))  # agree报文
+            BYTES_IN.inc(HEADER_SIZE)
+            BYTES_OUT.inc(2)
+        elif Type == TYPE_INIT_EX or Type == TYPE_RESUME:
+            # Initialization(扩展)/Resume报文：回复带同意能力位的agree报文
+            conn.expect(read_timeout)
+            if Type == TYPE_INIT_EX:
+                requested = CAPS.unpack(reader.read_exact(CAPS.size))[0]
+                body_size = CAPS.size
+            else:
+                requested, first = RESUME.unpack(reader.read_exact(RESUME.size))
+                if first > N:
+                    return
+                N -= first  # 服务器不保存传输状态，续传时只需接收剩下的分块
+                body_size = RESUME.size
+                RESUMED.inc()
+            conn.idle()
+            caps = grant_caps(requested)
+            conn.sendall(HEADER.pack(2, caps))
+            BYTES_IN.inc(HEADER_SIZE + body_size)
+            BYTES_OUT.inc(HEADER_SIZE)
+            if caps & CAP_COMPRESS:
+                # agree之后的字节流是压缩的，读缓冲区里剩下的字节交给压缩socket
+                # 解压出的报文体只写入已按长度申请过预算的缓冲区，解压器暂存的多余输出在连接期间单独申请
+                reserve = Decompressor.overshoot(caps & CAP_COMPRESS)
+                limits.budget.acquire(reserve)
+                stream = CompressedSocket(conn, caps & CAP_COMPRESS, pending_bytes(reader))
+                reader = FrameReader(stream)
+                writer = FrameWriter(stream)
+                COMPRESSED.inc()
+        else:
             return
-        Type = 2
-        conn.send(struct.pack('>H', Type))  # agree报文
-
-        # 处理数据块
-        for _ in range(N):
-            header = conn.recv(6)
-            Type, data_len = struct.unpack('>HI', header) # reverseRequest报文
-            if Type != 3:
+
+        # 处理数据块，batch报文一次处理多块
+        remaining = N
+        while remaining > 0:
+            Type, length = reader.read_header()
+            if not (Type == 3 or Type == TYPE_BATCH_REQUEST and caps & CAP_BATCH):
                 break
-            data = conn.recv(data_len).decode('ascii')
-            reversed_str = data[::-1]
-            rev_bytes = reversed_str.encode('ascii')
-            Type = 4
-            conn.send(struct.pack('>HI', Type, len(rev_bytes)) + rev_bytes) # reverseAnswer报文
+            # 先向全局内存预算申请，预算不足时在这里等待，暂不读取报文体
+            large = length > limits.large_piece
+            charge = LARGE_COPIES * limits.chunk if large else SMALL_COPIES * length
+            limits.budget.acquire(charge)
+            try:
+                start = time.perf_counter()
+                if large:
+                    count = reverse_large(reader, writer, Type, length, limits, conn, read_timeout)
+                    LARGE_FRAMES.inc()
+                else:
+                    # 从这里开始计时，在内存预算上等待的时间不算在read_timeout内
+                    conn.expect(read_timeout)
+                    body = reader.read_exact(length)
+                    conn.idle()
+                    if Type == 3: # reverseRequest报文
+                        # 直接在字节上反转（ASCII文本逐字节反转与逐字符反转相同），只复制一次
+                        rev_bytes = bytes(body[::-1])
+                        if not rev_bytes.isascii():
+                            raise ValueError("reverseRequest不是ASCII文本")
+                        writer.send_frame(4, rev_bytes) # reverseAnswer报文
+                        count = 1
+                    else:
+                        count, answer = reverse_batch(body)
+                        writer.send_frame(TYPE_BATCH_ANSWER, answer)
+                    del body
+            finally:
+                limits.budget.release(charge)
+            remaining -= count
+            REQUEST_SECONDS.observe(time.perf_counter() - start)
+            PIECES.inc(count)
+            BYTES_IN.inc(HEADER_SIZE + length)
+            BYTES_OUT.inc(HEADER_SIZE + length)  # 应答与请求等长
+    except (socket.timeout, ConnectionError, ValueError):
+        pass  # 超时、对端断开或报文格式错误，直接关闭连接
     finally:
+        if reserve:
+            limits.budget.release(reserve)
+        CONNECTIONS_ACTIVE.dec()
         conn.close()
 
 
-def main():
+async def handle_client_async(reader, writer, limits, read_timeout=None, idle_timeout=None):
+    """asyncio模式下处理一个客户端连接，协议与handle_client完全相同"""
+    # idle_timeout：等待下一个报文头的最长时间；read_timeout：报文头到达后读完报文体的最长时间
+    reserve = 0
+    CONNECTIONS.inc()
+    CONNECTIONS_ACTIVE.inc()
+    try:
+        header = await asyncio.wait_for(reader.readexactly(HEADER_SIZE), idle_timeout)
+        Type, N = HEADER.unpack(header)  # Initialization报文
+        if Type == 1:
+            caps = 0
+            writer.write(struct.pack('>H', 2))  # agree报文
+            BYTES_IN.inc(HEADER_SIZE)
+            BYTES_OUT.inc(2)
+        elif Type == TYPE_INIT_EX:
+            caps_bytes = await asyncio.wait_for(reader.readexactly(CAPS.size), read_timeout)
+            caps = grant_caps(CAPS.unpack(caps_bytes)[0])
+            writer.write(HEADER.pack(2, caps))
+            BYTES_IN.inc(HEADER_SIZE + CAPS.size)
+            BYTES_OUT.inc(HEADER_SIZE)
+        elif Type == TYPE_RESUME:
+            resume_bytes = await asyncio.wait_for(reader.readexactly(RESUME.size), read_timeout)
+            requested, first = RESUME.unpack(resume_bytes)
+            if first > N:
+                return
+            N -= first
+            RESUMED.inc()
+            caps = grant_caps(requested)
+            writer.write(HEADER.pack(2, caps))
+            BYTES_IN.inc(HEADER_SIZE + RESUME.size)
+            BYTES_OUT.inc(HEADER_SIZE)
+        else:
+            return
+        await writer.drain()
+        if caps & CAP_COMPRESS:
+            reserve = Decompressor.overshoot(caps & CAP_COMPRESS)
+            await limits.budget.acquire(reserve)
+            reader = CompressedStreamReader(reader, caps & CAP_COMPRESS)
+            writer = CompressedStreamWriter(writer, caps & CAP_COMPRESS)
+            COMPRESSED.inc()
+
+        remaining = N
+        while remaining > 0:
+            header = await asyncio.wait_for(reader.readexactly(HEADER_SIZE), idle_timeout)
+            Type, data_len = HEADER.unpack(header)
+            if not (Type == 3 or Type == TYPE_BATCH_REQUEST and caps & CAP_BATCH):
+                break
+            large = data_len > limits.large_piece
+            charge = LARGE_COPIES * limits.chunk if large else SMALL_COPIES * data_len
+            await limits.budget.acquire(charge)
+            try:
+                if large:
+                    start = time.perf_counter()
+                    count = await reverse_large_async(reader, writer, Type, data_len, limits, read_timeout)
+                    LARGE_FRAMES.inc()
+                else:
+                    data = await asyncio.wait_for(reader.readexactly(data_len), read_timeout)
+                    start = time.perf_counter()
+                    if Type == 3:  # reverseRequest报文
+                        rev_bytes = data[::-1]
+                        if not rev_bytes.isascii():
+                            raise ValueError("reverseRequest不是ASCII文本")
+                        writer.writelines((HEADER.pack(4, len(rev_bytes)), rev_bytes))  # reverseAnswer报文，不拼接
+                        count = 1
+                    else:
+                        count, answer = reverse_batch(data)
+                        writer.writelines((HEADER.pack(TYPE_BATCH_ANSWER, len(answer)), answer))
+                    del data
+                    await writer.drain()
+            finally:
+                await limits.budget.release(charge)
+            remaining -= count
+            REQUEST_SECONDS.observe(time.perf_counter() - start)
+            PIECES.inc(count)
+            BYTES_IN.inc(HEADER_SIZE + data_len)
+            BYTES_OUT.inc(HEADER_SIZE + data_len)  # 应答与请求等长
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass  # 超时、对端提前断开或报文格式错误
+    finally:
+        if reserve:
+            await limits.budget.release(reserve)
+        CONNECTIONS_ACTIVE.dec()
+        writer.close()
+
+
+def make_listener(host, port, backlog, reuse_port=False):
+    """创建监听socket，reuse_port时多个进程可以同时绑定同一端口，由内核分配连接"""
     serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    serverSocket.bind(('0.0.0.0', 9000))
-    serverSocket.listen(5)
-    while True:
-        conn, addr = serverSocket.accept()
-        threading.Thread(target=handle_client, args=(conn,)).start()
+    serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    serverSocket.bind((host, port))
+    serverSocket.listen(backlog)
+    return serverSocket
+
+
+def serve_thread(serverSocket, limits, max_conn=None, read_timeout=None, idle_timeout=None):
+    """线程模式：每个连接一个线程（原实现，保留用于对比）"""
+    slots = threading.BoundedSemaphore(max_conn) if max_conn else None
+
+    def worker(conn):
+        try:
+            handle_client(conn, limits, read_timeout, idle_timeout)
+        finally:
+            if slots:
+                slots.release()
+
+    # 收到SIGTERM时accept()抛出SystemExit，关闭监听socket后不再接受新连接，
+    # 处理中的连接线程不是daemon线程，进程会等它们处理完再退出
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            conn, addr = serverSocket.accept()
+            # 超过连接上限时直接拒绝，不再创建线程
+            if slots and not slots.acquire(blocking=False):
+                REJECTED.inc()
+                conn.close()
+                continue
+            threading.Thread(target=worker, args=(conn,)).start()
+    finally:
+        serverSocket.close()
+
+
+async def serve_async(serverSocket, limits, max_conn=None, read_timeout=None, idle_timeout=None, grace=10.0):
+    """asyncio模式：单线程事件循环处理所有连接"""
+    active = set()
+
+    async def on_connect(reader, writer):
+        # 超过连接上限时直接关闭新连接
+        if max_conn and len(active) >= max_conn:
+            REJECTED.inc()
+            writer.close()
+            return
+        task = asyncio.current_task()
+        active.add(task)
+        try:
+            await handle_client_async(reader, writer, limits, read_timeout, idle_timeout)
+        finally:
+            active.discard(task)
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+    except NotImplementedError:
+        pass  # Windows的事件循环不支持信号处理，只能Ctrl+C退出
+    server = await asyncio.start_server(on_connect, sock=serverSocket)
+    await stop.wait()
+
+    # 优雅关闭：停止接受新连接，等待处理中的连接结束（最多grace秒）
+    server.close()
+    if active:
+        await asyncio.wait(list(active), timeout=grace)
+
+
+def serve(args, reuse_port=False, k=0):
+    """按args.mode启动一个服务进程（prefork模式下k为worker编号）"""
+    serverSocket = make_listener(args.host, args.port, args.backlog, reuse_port)
+    print(f"服务器({args.mode}模式, pid={os.getpid()})在{args.port}端口启动")
+    if args.metrics_port:
+        metrics.serve(METRICS, args.metrics_port + k, args.metrics_host)
+        print(f"指标: http://{args.metrics_host}:{args.metrics_port + k}/metrics")
+    # 内存预算按进程计算，多进程时每个worker各有一份
+    budget_bytes = int(args.memory_budget * 1024 * 1024)
+    if args.mode == 'asyncio':
+        async def run():
+            # asyncio.Condition要在事件循环中创建
+            limits = PieceLimits(AsyncMemoryBudget(budget_bytes), args.large_piece, spill_dir=args.spill_dir)
+            await serve_async(serverSocket, limits, args.max_conn, args.read_timeout, args.idle_timeout, args.grace)
+        asyncio.run(run())
+    else:
+        limits = PieceLimits(MemoryBudget(budget_bytes), args.large_piece, spill_dir=args.spill_dir)
+        serve_thread(serverSocket, limits, args.max_conn, args.read_timeout, args.idle_timeout)
+
+
+def worker_main(args, k):
+    """prefork模式下的worker进程"""
+    # Ctrl+C由主进程统一处理，worker只响应主进程发来的SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    serve(args, reuse_port=True, k=k)
+
+
+def serve_prefork(args):
+    """prefork模式：W个worker进程各自用SO_REUSEPORT绑定同一端口，由内核在进程间分配连接
+
+    主进程只负责监督：worker异常退出时重新启动；收到SIGTERM/SIGINT时通知所有worker优雅退出。
+    """
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        print("当前系统不支持SO_REUSEPORT，无法使用prefork模式")
+        return
+
+    stopping = threading.Event()
+
+    def on_stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+
+    def start_worker(k):
+        p = multiprocessing.Process(target=worker_main, args=(args, k), name=f"worker{k}")
+        p.start()
+        return p
+
+    workers = [start_worker(k) for k in range(args.workers)]
+    print(f"主进程(pid={os.getpid()})启动了{args.workers}个worker")
+    while not stopping.wait(0.5):
+        for k, p in enumerate(workers):
+            if not p.is_alive() and not stopping.is_set():
+                print(f"worker{k}(pid={p.pid})异常退出(exitcode={p.exitcode})，重新启动")
+                workers[k] = start_worker(k)
+
+    print("停止服务器，等待worker处理完当前连接...")
+    for p in workers:
+        if p.is_alive():
+            p.terminate()  # 发送SIGTERM
+    for p in workers:
+        p.join(args.grace)
+        if p.is_alive():
+            p.kill()
+            p.join()
+
+
+def main():
+    # 命令行参数: python reversetcpserver.py [--mode thread|asyncio] [--port 9000] [--backlog 5] [--workers W] ...
+    parser = argparse.ArgumentParser(description="reverse TCP server")
+    parser.add_argument('--mode', choices=['thread', 'asyncio'], default='thread', help="并发模型")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--backlog', type=int, default=5, help="listen()的等待队列长度")
+    parser.add_argument('--max-conn', type=int, default=0, help="最大并发连接数，0表示不限制")
+    parser.add_argument('--read-timeout', type=float, default=30.0,
+                        help="读取报文体的超时时间(秒)，0表示不限制；超时断开连接时释放该报文申请的内存预算")
+    parser.add_argument('--idle-timeout', type=float, default=None, help="等待下一个报文的空闲超时时间(秒)")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="prefork模式的worker进程数，0为单进程；每个worker使用--mode指定的并发模型")
+    parser.add_argument('--grace', type=float, default=10.0, help="优雅关闭时等待处理中连接的最长时间(秒)")
+    parser.add_argument('--large-piece', type=int, default=1 << 20,
+                        help="超过该字节数的请求报文写入临时文件、按块从末尾读出反转后发送，每个连接的内存占用与报文大小无关")
+    parser.add_argument('--memory-budget', type=float, default=256,
+                        help="所有连接处理报文时可占用内存的总预算(MB，按进程计算)，超出时暂停读取，由TCP向客户端施加反压")
+    parser.add_argument('--spill-dir', default=None, help="大报文临时文件所在目录，默认为系统临时目录")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    if args.read_timeout <= 0:
+        args.read_timeout = None
+
+    try:
+        if args.workers > 0:
+            serve_prefork(args)
+        else:
+            serve(args)
+    except KeyboardInterrupt:
+        print("停止服务器...")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,310 @@
+import asyncio
+import hashlib
+import heapq
+import io
+import os
+import random
+import struct
+import sys
+import time
+
+from udpclient import (header_Format, header_Size, flag_SYN, flag_ACK, flag_DATA, flag_FIN, flag_SACK, seq_Mask,
+                       fin_Format, RTOEstimator, unwrap_seq, make_congestion_control)
+from rttstats import RTTStats
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import tracing
+
+# asyncio版的GBN/SR客户端：与udpclient.GBNClient相同的SYN/DATA/ACK/FIN状态机，
+# 但不使用阻塞套接字和线程，收包、定时器都是事件循环的回调，一个事件循环中可以同时运行几百个流
+
+header_Struct = struct.Struct(header_Format)
+
+# 跟踪事件的输出格式（只有连接级事件）
+TRACE_FORMATS = {
+    'flow_connected': "流{flow}连接建立({mode})",
+    'flow_syn_failed': "流{flow}握手失败",
+    'flow_timeout': "流{flow}超时 重传{count}个包，RTO退避为{rto:.2f}ms",
+    'flow_done': lambda f: (f"流{f['flow']}完成: {f['bytes']}字节 {f['elapsed'] * 1000:.1f}ms "
+                            f"校验{f['result'].decode(errors='replace') if f['result'] else '无结果'}"),
+}
+
+
+class FlowResult:
+    """一个流的传输结果"""
+    __slots__ = ('flow', 'connected', 'result', 'payload_bytes', 'packets_new', 'packets_sent', 'bytes_on_wire',
+                 'retrans_bytes', 'elapsed', 'rtt_stats')
+
+    def __init__(self, flow):
+        self.flow = flow
+        self.connected = False
+        self.result = None  # 服务器的校验结果 b'OK' / b'BAD'，没有收到FIN-ACK时为None
+        self.payload_bytes = 0
+        self.packets_new = 0
+        self.packets_sent = 0  # 含重传
+        self.bytes_on_wire = 0
+        self.retrans_bytes = 0
+        self.elapsed = 0.0  # 从发送SYN到收到FIN-ACK（或放弃）的秒数
+        self.rtt_stats = RTTStats()
+
+    @property
+    def ok(self):
+        return self.result == b'OK'
+
+
+class GBNFlow(asyncio.DatagramProtocol):
+    """一个流的协议状态机，每个流有自己的UDP套接字（服务器按源地址区分连接）
+
+    发送窗口在收到ACK的回调中直接补满，不需要发送线程；重传定时器仍是按到期时间排序的最小堆，
+    事件循环上只登记最早的那个到期时刻（loop.call_at），最早的定时器变化时重新登记。
+    """
+
+    def __init__(self, source, mode='gbn', cc='aimd', mss=80, max_cwnd=64, timeout=0.3, min_rto=0.02,
+                 max_rto=2.0, isn=0, loss_rate=0.0, rng=None, flow=0, tracer=None):
+        if isinstance(source, (bytes, bytearray)):
+            source = io.BytesIO(source)
+        self.source = source
+        self.mode = mode
+        self.cc = make_congestion_control(cc, max_cwnd)
+        self.mss = mss
+        self.max_cwnd = max_cwnd
+        self.timeout = timeout
+        self.rto = RTOEstimator(timeout, min_rto, max_rto)
+        self.isn = isn
+        self.loss_rate = loss_rate
+        self.rng = rng or random.Random()
+        self.trace = tracer or tracing.NULL
+        self.result = FlowResult(flow)
+        self.loop = None
+        self.transport = None
+        self.base_seq = isn + 1
+        self.next_seq = isn + 1
+        self.packets = {}  # 已发送未确认的包 {seq: (data, 发送时刻, 发送次数)}
+        self.timers = []  # [(到期时刻, seq, 发送时刻)]，包被确认或重传后旧的条目自然失效
+        self.episode_start = 0.0  # 最近一次超时的时刻，此前发出的包再超时属于同一次丢包事件
+        self.timer_handle = None
+        self.timer_deadline = None  # 事件循环上登记的到期时刻
+        self.digest = hashlib.sha256()
+        self.eof = False
+        self.syn_ack = None  # 等待SYN-ACK的future
+        self.all_acked = None  # 数据全部被确认时完成的future
+        self.fin_ack = None  # 等待FIN-ACK的future
+
+    # ---- asyncio回调 ----
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < header_Size:
+            return
+        seq, ack, flags, _, length = header_Struct.unpack_from(data)
+
+        # SYN-ACK
+        if flags & flag_SYN:
+            if flags & flag_ACK and ack == (self.isn + 1) & seq_Mask and self.syn_ack and not self.syn_ack.done():
+                self.syn_ack.set_result((seq, flags))
+            return
+
+        # FIN-ACK：报文体是服务器的校验结果
+        if flags & flag_FIN and flags & flag_ACK:
+            if self.fin_ack and not self.fin_ack.done():
+                self.fin_ack.set_result(data[header_Size:header_Size + length])
+            return
+
+        if not flags & flag_ACK or self.all_acked is None:
+            return
+        sacked = ()
+        if flags & flag_SACK and length >= 4 and len(data) >= header_Size + length:
+            sacked = struct.unpack_from(f'>{length // 4}I', data, header_Size)
+
+        in_flight = len(self.packets)
+        ack = unwrap_seq(ack, self.base_seq)
+        now = self.loop.time()
+        for s in range(self.base_seq, min(ack, self.next_seq)):
+            self.ack_packet(s, now)
+        for s in sacked:
+            self.ack_packet(unwrap_seq(s, self.base_seq), now)
+        acked = in_flight - len(self.packets)
+        if not acked:
+            return
+        self.cc.on_ack(acked, time.time())
+        base_seq = min(self.packets) if self.packets else self.next_seq
+        if base_seq > self.base_seq:
+            self.rto.reset()  # 与GBNClient相同：累积确认推进窗口后清除退避
+        self.base_seq = base_seq
+        self.fill_window()
+
+    def error_received(self, exc):
+        pass  # 如ICMP端口不可达，按丢包处理，等待超时重传
+
+    # ---- 发送 ----
+
+    def send(self, seq, ack, flags, data=b'', drop=True):
+        packet = header_Struct.pack(seq & seq_Mask, ack, flags, int(time.time() * 1e6), len(data)) + data
+        if drop and self.loss_rate and self.rng.random() < self.loss_rate:
+            return len(packet)  # 模拟丢包
+        self.transport.sendto(packet)
+        return len(packet)
+
+    def send_data_packet(self, seq, data, count):
+        now = self.loop.time()
+        self.packets[seq] = (data, now, count)
+        size = self.send(seq, 0, flag_DATA, data)
+        r = self.result
+        r.packets_sent += 1
+        r.bytes_on_wire += size
+        if count > 1:
+            r.retrans_bytes += size
+        self.arm_timer((now + self.rto.rto, seq, now))
+
+    def fill_window(self):
+        """读取新数据补满窗口；数据读完且全部被确认时完成all_acked"""
+        window_available = min(int(self.cc.cwnd) - len(self.packets), self.base_seq + self.max_cwnd - self.next_seq)
+        while window_available > 0 and not self.eof:
+            data = self.source.read(self.mss)
+            if not data:
+                self.eof = True
+                break
+            self.digest.update(data)
+            self.result.packets_new += 1
+            self.result.payload_bytes += len(data)
+            self.send_data_packet(self.next_seq, data, 1)
+            self.next_seq += 1
+            window_available -= 1
+        if self.eof and not self.packets and not self.all_acked.done():
+            self.all_acked.set_result(None)
+
+    def ack_packet(self, s, now):
+        packet = self.packets.pop(s, None)
+        if packet is None:
+            return
+        if packet[2] == 1:  # Karn算法：重传过的包不作为RTT样本
+            rtt = now - packet[1]
+            self.result.rtt_stats.add(rtt * 1000)
+            self.rto.on_sample(rtt)
+
+    # ---- 重传定时器 ----
+
+    def arm_timer(self, entry):
+        heapq.heappush(self.timers, entry)
+        self.schedule_timer()
+
+    def schedule_timer(self):
+        """丢弃失效的定时器，在事件循环上登记最早的到期时刻（没有变化时不重新登记）"""
+        timers = self.timers
+        while timers and not self.timer_valid(timers[0]):
+            heapq.heappop(timers)
+        deadline = timers[0][0] if timers else None
+        if deadline == self.timer_deadline:
+            return
+        if self.timer_handle:
+            self.timer_handle.cancel()
+            self.timer_handle = None
+        self.timer_deadline = deadline
+        if deadline is not None:
+            self.timer_handle = self.loop.call_at(deadline, self.on_timer)
+
+    def timer_valid(self, entry):
+        packet = self.packets.get(entry[1])
+        return packet is not None and packet[1] == entry[2]
+
+    def on_timer(self):
+        self.timer_handle = None
+        self.timer_deadline = None
+        now = self.loop.time()
+        while self.timers and not self.timer_valid(self.timers[0]):
+            heapq.heappop(self.timers)
+        if not self.timers or self.timers[0][0] > now:
+            self.schedule_timer()
+            return
+        if self.mode == 'sr':
+            expired = []
+            last_sent = 0.0
+            while self.timers and self.timers[0][0] <= now:
+                entry = heapq.heappop(self.timers)
+                if self.timer_valid(entry):
+                    expired.append(entry[1])
+                    last_sent = max(last_sent, entry[2])
+        else:
+            last_sent = heapq.heappop(self.timers)[2]
+            expired = sorted(self.packets)
+
+        # 与GBNClient相同：一次丢包事件只算一次拥塞事件、只退避一次RTO
+        if last_sent >= self.episode_start:
+            self.episode_start = now
+            self.cc.on_timeout(time.time())
+            self.rto.on_timeout()
+        if self.trace.info:
+            self.trace.event('flow_timeout', flow=self.result.flow, count=len(expired), rto=self.rto.rto * 1000)
+        for seq in expired:
+            data, _, count = self.packets[seq]
+            self.send_data_packet(seq, data, count + 1)
+        self.schedule_timer()
+
+    # ---- 整个流 ----
+
+    async def connect(self, syn_timeout=1.0, retries=5):
+        """三次握手，SYN超时重发，返回是否成功"""
+        syn_flags = flag_SYN | (flag_SACK if self.mode == 'sr' else 0)
+        for attempt in range(retries):
+            self.syn_ack = self.loop.create_future()
+            self.send(self.isn, 0, syn_flags, drop=False)  # SYN包不模拟丢包
+            syn_sent = self.loop.time()
+            try:
+                seq, flags = await asyncio.wait_for(self.syn_ack, syn_timeout)
+            except asyncio.TimeoutError:
+                continue
+            if attempt == 0:
+                self.rto.on_sample(self.loop.time() - syn_sent)  # 没有重发过的SYN给出第一个RTT样本
+            if self.mode == 'sr' and not flags & flag_SACK:
+                self.mode = 'gbn'  # 服务器不支持SR
+            self.send(self.isn + 1, (seq + 1) & seq_Mask, flag_ACK)
+            return True
+        return False
+
+    async def run(self, fin_retries=8):
+        """握手、发送全部数据、FIN校验，返回FlowResult"""
+        self.loop = asyncio.get_running_loop()
+        start = self.loop.time()
+        r = self.result
+        try:
+            r.connected = await self.connect()
+            if not r.connected:
+                self.trace.log(tracing.INFO, 'flow_syn_failed', flow=r.flow)
+                return r
+            self.trace.log(tracing.INFO, 'flow_connected', flow=r.flow, mode=self.mode)
+
+            self.all_acked = self.loop.create_future()
+            self.fill_window()
+            await self.all_acked
+
+            # FIN带上总长度和SHA-256，超时按RTO退避重发
+            fin = struct.pack(fin_Format, b'FIN', r.payload_bytes, self.digest.digest())
+            wait = self.rto.rto
+            for _ in range(fin_retries):
+                self.fin_ack = self.loop.create_future()
+                self.send(self.next_seq, 0, flag_FIN, fin)
+                try:
+                    r.result = await asyncio.wait_for(self.fin_ack, wait)
+                    break
+                except asyncio.TimeoutError:
+                    wait = min(wait * 2, self.rto.max_rto)
+            return r
+        finally:
+            r.elapsed = self.loop.time() - start
+            if self.timer_handle:
+                self.timer_handle.cancel()
+            if self.trace.info and r.connected:
+                self.trace.event('flow_done', flow=r.flow, bytes=r.payload_bytes, elapsed=r.elapsed, result=r.result)
+
+
+async def transfer(server_addr, source, **kwargs):
+    """在当前事件循环中创建一个流，把source（bytes或二进制文件）发送到server_addr，返回FlowResult"""
+    loop = asyncio.get_running_loop()
+    transport, flow = await loop.create_datagram_endpoint(lambda: GBNFlow(source, **kwargs),
+                                                          remote_addr=server_addr)
+    try:
+        return await flow.run()
+    finally:
+        transport.close()
@@ -0,0 +1,40 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# 启动时间对比：多次启动新的Python进程，分别测量空解释器、import pandas和udpclient.py --help的耗时（中位数）
+# 之前udpclient.py在模块加载时import pandas，启动时间约等于"import pandas"一行
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def measure(cmd, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=HERE)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="udpclient.py启动时间对比")
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--python', default=sys.executable, help="使用的Python解释器（需要安装pandas才能对比）")
+    args = parser.parse_args()
+
+    cases = [
+        ('python -c pass', [args.python, '-c', 'pass']),
+        ('import pandas', [args.python, '-c', 'import pandas']),
+        ('udpclient.py --help', [args.python, 'udpclient.py', '--help']),
+    ]
+    print(f"{'case':>22} {'median ms':>10}")
+    for name, cmd in cases:
+        print(f"{name:>22} {measure(cmd, args.runs):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import argparse
+import multiprocessing
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+from udpserver import header_Format, header_Size, flag_SYN, flag_ACK, flag_DATA, flag_FIN
+
+# UDP服务器吞吐量压测：启动udpserver子进程（不模拟丢包），多个并发流各自握手后
+# 以固定窗口连续发送数据包并等待ACK，统计服务器每秒处理的数据包数和回复的ACK数，
+# 对比不同的分发方式、延迟ACK和多进程（--processes）
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def start_server(port, server_args):
+    cmd = [sys.executable, os.path.join(HERE, 'udpserver.py'), str(port), '0'] + server_args
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    time.sleep(1.0)  # UDP无法探测端口是否就绪，等待服务器启动
+    return proc
+
+
+def run_flow(port, packets, window, payload, result, k):
+    """一个流：三次握手后每次发送window个数据包，累积确认号覆盖这一批（或超时）后再发下一批"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(0.5)
+    server = ('127.0.0.1', port)
+    sock.sendto(struct.pack(header_Format, 0, 0, flag_SYN, 0, 0), server)
+    try:
+        sock.recvfrom(1024)
+    except socket.timeout:
+        result[k] = (0, 0, 0)
+        return
+    sock.sendto(struct.pack(header_Format, 1, 0, flag_ACK, 0, 0), server)
+
+    seq = 1
+    acked = 1  # 累积确认号
+    acks = 0  # 收到的ACK数据报数
+    while seq <= packets:
+        batch = min(window, packets - seq + 1)
+        for _ in range(batch):
+            sock.sendto(struct.pack(header_Format, seq, 0, flag_DATA, 0, len(payload)) + payload, server)
+            seq += 1
+        while acked < seq:
+            try:
+                data, _ = sock.recvfrom(1024)
+            except socket.timeout:
+                break
+            if len(data) >= header_Size:
+                acks += 1
+                acked = max(acked, struct.unpack_from(header_Format, data)[1])
+    sock.sendto(struct.pack(header_Format, seq, 0, flag_FIN, 0, 3) + b'FIN', server)
+    sock.close()
+    result[k] = (packets, acked - 1, acks)
+
+
+def run_flows(port, flows, packets, window, size):
+    """在当前进程中用线程运行flows个流，返回每个流的结果"""
+    result = [None] * flows
+    payload = b'x' * size
+    threads = [threading.Thread(target=run_flow, args=(port, packets, window, payload, result, k))
+               for k in range(flows)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return result
+
+
+def run_case(port, flows, packets, window, size, client_procs=1):
+    """client_procs>1时把流分给多个客户端进程，避免压测端自己受GIL限制"""
+    start = time.perf_counter()
+    if client_procs > 1:
+        shares = [flows // client_procs + (k < flows % client_procs) for k in range(client_procs)]
+        with multiprocessing.Pool(client_procs) as pool:
+            parts = pool.starmap(run_flows, [(port, n, packets, window, size) for n in shares if n])
+        result = [r for part in parts for r in part]
+    else:
+        result = run_flows(port, flows, packets, window, size)
+    elapsed = time.perf_counter() - start
+    sent = sum(r[0] for r in result)
+    acked = sum(r[1] for r in result)
+    acks = sum(r[2] for r in result)
+    return sent, acked, acks, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UDP服务器分发方式吞吐量对比")
+    parser.add_argument('--port', type=int, default=9200)
+    parser.add_argument('--flows', type=int, default=8, help="并发客户端流数")
+    parser.add_argument('--packets', type=int, default=5000, help="每个流发送的数据包数")
+    parser.add_argument('--window', type=int, default=16, help="每批发送的数据包数")
+    parser.add_argument('--size', type=int, default=80, help="数据包负载字节数")
+    parser.add_argument('--server-args', action='append', default=None,
+                        help="要对比的服务器参数，可重复指定，默认对比'--dispatch thread'和'--dispatch sharded'，"
+                             "如 --server-args '--ack-every 4 --ack-delay 5'、--server-args '--processes 4'")
+    parser.add_argument('--client-procs', type=int, default=1, help="压测客户端进程数，流平均分配到各进程")
+    args = parser.parse_args()
+    configs = args.server_args or ['--dispatch thread', '--dispatch sharded']
+
+    print(f"CPU核数: {os.cpu_count()}  流: {args.flows}x{args.packets}个包  窗口: {args.window}  "
+          f"负载: {args.size}字节  客户端进程: {args.client_procs}")
+    print(f"{'server':>28} {'sent':>8} {'acked':>8} {'acks':>8} {'elapsed':>8} {'pkts/s':>9} {'acks/s':>9}")
+    for config in configs:
+        proc = start_server(args.port, config.split())
+        try:
+            sent, acked, acks, elapsed = run_case(args.port, args.flows, args.packets, args.window, args.size,
+                                                 args.client_procs)
+        finally:
+            proc.terminate()
+            proc.wait()
+        print(f"{config:>28} {sent:>8} {acked:>8} {acks:>8} {elapsed:>8.2f} {acked / elapsed:>9.0f} "
+              f"{acks / elapsed:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
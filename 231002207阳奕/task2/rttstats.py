@@ -0,0 +1,90 @@
+import math
+
+
+class StreamingStats:
+    """Welford算法在线计算均值和方差，不保存样本，内存占用固定"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # 与均值之差的平方和
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+
+    @property
+    def variance(self):
+        """样本方差（除以n-1，与pandas的std()一致）"""
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+
+class LogHistogram:
+    """对数分桶直方图：第k个桶覆盖[lowest*growth^k, lowest*growth^(k+1))，分位数的相对误差不超过growth-1
+
+    桶数固定（默认1µs~100s共约930个桶，相对误差2%），超出范围的样本计入首尾两个桶。
+    """
+
+    def __init__(self, lowest=0.001, highest=100000.0, growth=1.02):
+        self.lowest = lowest
+        self.log_growth = math.log(growth)
+        self.buckets = [0] * (int(math.log(highest / lowest) / self.log_growth) + 2)
+        self.count = 0
+
+    def add(self, x):
+        if x <= self.lowest:
+            k = 0
+        else:
+            k = min(int(math.log(x / self.lowest) / self.log_growth) + 1, len(self.buckets) - 1)
+        self.buckets[k] += 1
+        self.count += 1
+
+    def bucket_value(self, k):
+        """桶k的代表值：桶上下界的几何平均"""
+        if k == 0:
+            return self.lowest
+        return self.lowest * math.exp((k - 0.5) * self.log_growth)
+
+    def percentile(self, q):
+        """第q百分位数（最近秩法），没有样本时返回0"""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(q / 100 * self.count))
+        seen = 0
+        for k, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return self.bucket_value(k)
+        return self.bucket_value(len(self.buckets) - 1)
+
+
+class RTTStats:
+    """RTT统计（毫秒）：最大/最小/均值/标准差精确计算，分位数来自对数分桶直方图"""
+
+    def __init__(self):
+        self.stats = StreamingStats()
+        self.histogram = LogHistogram()
+
+    def add(self, rtt_ms):
+        self.stats.add(rtt_ms)
+        self.histogram.add(rtt_ms)
+
+    @property
+    def count(self):
+        return self.stats.count
+
+    def percentile(self, q):
+        # 直方图的代表值可能略超出实际范围，限制在[min, max]内
+        return min(max(self.histogram.percentile(q), self.stats.min), self.stats.max)
@@ -1,10 +1,19 @@
+import argparse
+import hashlib
+import heapq
+import io
+import os
 import socket
 import struct
+import sys
 import time
 import random
-import pandas as pd
 import threading
-import sys
+
+from rttstats import RTTStats
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import tracing
 
 # 自定义协议首部格式
 # I：4字节，B：1字节，Q：8字节，H：2字节
@@ -16,6 +25,189 @@ flag_SYN = 0x1
 flag_ACK = 0x2
 flag_DATA = 0x4
 flag_FIN = 0x8
+flag_SACK = 0x10  # SYN中表示请求Selective Repeat；ACK中表示报文体带有被单独确认的序列号列表(每个4字节)
+
+# 序列号只有32位，超过后回绕到0；内部使用不回绕的逻辑序列号，收发时再转换
+seq_Mask = 0xFFFFFFFF
+
+# FIN报文体：b'FIN' + 数据总字节数(8字节) + SHA-256(32字节)；FIN-ACK报文体为服务器的校验结果
+fin_Format = ">3sQ32s"
+
+# IP首部20字节 + UDP首部8字节，数据包总长不超过路径MTU时不会分片
+ip_udp_Overhead = 28
+
+# 服务器每次recvfrom读取的字节数（udpserver.max_Datagram），更长的数据报会被截断
+max_Datagram = 4096
+
+# 服务器SR模式的乱序缓存大小（udpserver.sr_Window），窗口超出时服务器按out_of_window丢弃
+sr_Window = 64
+
+
+def max_mss(mtu):
+    """--mss的上限：数据包不超过路径MTU，也不超过服务器一次接收的长度"""
+    return min(mtu - ip_udp_Overhead, max_Datagram) - header_Size
+
+
+class FixedWindow:
+    """固定窗口（原实现）：窗口始终为max_in_flight个包"""
+
+    def __init__(self, max_in_flight=5):
+        self.cwnd = max_in_flight
+        self.ssthresh = max_in_flight
+
+    def on_ack(self, acked, now):
+        pass
+
+    def on_timeout(self, now):
+        pass
+
+
+class AIMDWindow:
+    """慢启动 + AIMD：慢启动阶段每确认一个包cwnd加1，拥塞避免阶段每个RTT加1，超时时ssthresh减半、cwnd回到1"""
+
+    def __init__(self, max_cwnd=64, initial_ssthresh=32):
+        self.cwnd = 1.0
+        self.ssthresh = initial_ssthresh
+        self.max_cwnd = max_cwnd
+
+    def on_ack(self, acked, now):
+        for _ in range(acked):
+            if self.cwnd < self.ssthresh:
+                self.cwnd += 1  # 慢启动
+            else:
+                self.cwnd += 1 / self.cwnd  # 拥塞避免：加性增
+        self.cwnd = min(self.cwnd, self.max_cwnd)
+
+    def on_timeout(self, now):
+        self.ssthresh = max(self.cwnd / 2, 2)  # 乘性减
+        self.cwnd = 1.0
+
+
+class CubicWindow:
+    """类Cubic：拥塞避免阶段按W(t) = C*(t-K)^3 + Wmax增长，与丢包前窗口Wmax的距离决定增长快慢"""
+
+    C = 0.4
+    BETA = 0.7
+
+    def __init__(self, max_cwnd=64, initial_ssthresh=32):
+        self.cwnd = 1.0
+        self.ssthresh = initial_ssthresh
+        self.max_cwnd = max_cwnd
+        self.w_max = 0.0
+        self.k = 0.0
+        self.epoch_start = None
+
+    def on_ack(self, acked, now):
+        for _ in range(acked):
+            if self.cwnd < self.ssthresh:
+                self.cwnd += 1  # 慢启动
+                continue
+            if self.epoch_start is None:
+                # 进入新的拥塞避免周期
+                self.epoch_start = now
+                if self.cwnd < self.w_max:
+                    self.k = ((self.w_max - self.cwnd) / self.C) ** (1 / 3)
+                else:
+                    self.k = 0.0
+                    self.w_max = self.cwnd
+            t = now - self.epoch_start
+            target = self.C * (t - self.k) ** 3 + self.w_max
+            # 增量至少与AIMD相同（TCP友好区域）
+            self.cwnd += max((target - self.cwnd) / self.cwnd, 1 / self.cwnd)
+        self.cwnd = min(self.cwnd, self.max_cwnd)
+
+    def on_timeout(self, now):
+        self.w_max = self.cwnd
+        self.ssthresh = max(self.cwnd * self.BETA, 2)
+        self.cwnd = 1.0
+        self.epoch_start = None
+
+
+class RTOEstimator:
+    """Jacobson/Karels重传超时估计（RFC 6298）：RTO = SRTT + 4*RTTVAR，超时后指数退避
+
+    按Karn算法，只用没有重传过的包的RTT更新估计；退避后的RTO保持到出现新的有效样本或累积确认推进窗口。
+    丢包率高时（尤其是GBN整窗重传）几乎所有包都重传过，没有有效样本，只靠新样本清除退避会让RTO一直停在上限。
+    连续退避最多max_backoff次（RTO最多放大2^max_backoff倍），随机丢包率高时同一个包连续丢几次很常见，
+    不限制的话一次丢包事件就可能等到max_rto。
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    def __init__(self, initial_rto=0.3, min_rto=0.02, max_rto=2.0, max_backoff=3):
+        self.srtt = None  # 秒
+        self.rttvar = None
+        self.initial_rto = initial_rto
+        self.rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.max_backoff = max_backoff
+        self.backoff_level = 0  # 当前连续退避的次数
+        self.backoffs = 0  # 超时退避次数
+
+    def on_sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            # 先用旧的SRTT更新RTTVAR，再更新SRTT
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.reset()
+
+    def reset(self):
+        """按SRTT/RTTVAR重新计算RTO，清除退避（还没有样本时回到初始RTO）"""
+        self.backoff_level = 0
+        if self.srtt is None:
+            self.rto = self.initial_rto
+        else:
+            self.rto = min(max(self.srtt + self.K * self.rttvar, self.min_rto), self.max_rto)
+
+    def on_timeout(self):
+        if self.backoff_level < self.max_backoff:
+            self.backoff_level += 1
+            self.rto = min(self.rto * 2, self.max_rto)
+        self.backoffs += 1
+
+
+# 跟踪事件的输出格式（格式化在跟踪器的后台线程中进行）
+TRACE_FORMATS = {
+    'send': "发送包信息: seq={seq}, ack={ack}, flags={flags}, size={size}",
+    'sim_drop': "模拟丢包: seq={seq}, flags={flags}",
+    'syn': "发送SYN给服务器...",
+    'syn_retry': "等待SYN-ACK超时，重试...",
+    'syn_failed': "重发{retries}次SYN仍没有收到SYN-ACK，放弃连接",
+    'syn_ack': "接收SYN-ACK, seq={seq}, ack={ack}",
+    'no_sr': "服务器不支持Selective Repeat，使用Go-Back-N",
+    'connected': "连接建立",
+    'data': "第{n}个(第{start}~{end}字节)client端已经发送",
+    'data_drop': "模拟数据包丢包: seq={seq}",
+    'timeout': "超时！({mode}) 重传{count}个包，最早的是第{seq}个，RTO退避为{rto:.2f}ms",
+    'retransmit': "重传第{seq}个包 ({reason})",
+    'ack': "第{seq}个包确认(RTT={rtt:.2f}ms)",
+    'ack_karn': "第{seq}个包确认(重传过，不计RTT)",
+    'server_time': lambda f: f"服务器系统时间: {time.strftime('%H:%M:%S', time.localtime(f['ts'] / 1e6))}",
+    'rto': "RTO: {rto:.2f}ms (SRTT {srtt:.2f}ms, RTTVAR {rttvar:.2f}ms)",
+    'recv_error': "接收错误: {error}",
+}
+
+
+def unwrap_seq(wire_seq, ref):
+    """把32位序列号还原成离逻辑序列号ref最近的逻辑序列号（前后各2^31以内）"""
+    diff = (wire_seq - ref) & seq_Mask
+    if diff >= 0x80000000:
+        diff -= 0x100000000
+    return ref + diff
+
+
+def make_congestion_control(name, max_cwnd):
+    if name == 'aimd':
+        return AIMDWindow(max_cwnd)
+    if name == 'cubic':
+        return CubicWindow(max_cwnd)
+    return FixedWindow()
 
 
 class GBNClient:
@@ -23,19 +215,34 @@ class GBNClient:
     # udpclient.py代码中没有显式绑定端口（GBNClient类初始化时没有调用bind()）
     # 但是为了确保客户端知道自己要连接哪个服务器，所以必须显示指定一个监听端口，所有客户端线程共享这个端口
     # 所以当一个客户端第一次发送数据时，操作系统会自动分配一个临时端口给这个客户端，与其他客户端区分开
-    def __init__(self, server_ip, server_port, timeout=0.3, loss_rate=0.3):
+    def __init__(self, server_ip, server_port, timeout=0.3, loss_rate=0.3, mode='gbn', cc='fixed', mss=80,
+                 max_cwnd=64, min_rto=0.02, max_rto=2.0, isn=0, export=None, tracer=None, max_backoff=3):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.settimeout(timeout)  # 设置接收超时时间
         self.server_addr = (server_ip, server_port)
-        self.window_size = 400  # 字节
-        self.packet_size = 80  # 固定每个包80字节
-        self.max_in_flight = 5  # 窗口最多容纳5个包 (400/80=5)
-        self.timeout = timeout  # 秒
-        self.base_seq = 0  # 窗口起始序列号
+        self.packet_size = mss  # 每个包的数据字节数（默认80）
+        self.cc = make_congestion_control(cc, max_cwnd)  # 拥塞窗口（单位：包），fixed为原来的5个包
+        self.max_cwnd = max_cwnd  # 同时限制窗口跨越的序列号范围，SR模式下不超出服务器的乱序缓存
+        self.cwnd_log = []  # 拥塞窗口变化记录 [(相对时间ms, cwnd, ssthresh, 在途包数)]
+        self.start_time = time.time()
+        self.timeout = timeout  # 秒，用作握手阶段的接收超时和初始RTO
+        self.rto = RTOEstimator(timeout, min_rto, max_rto, max_backoff)
+        self.timers = []  # 重传定时器最小堆 [(到期时间, seq, 发送时间)]，包被确认或重传后旧的条目自然失效
+        self.karn_skipped = 0  # 按Karn算法丢弃的RTT样本数（重传过的包）
+        self.episode_start = 0.0  # 最近一次超时（丢包事件）的时刻monotonic，此前发出的包再超时属于同一次丢包事件
+        self.isn = isn  # 初始序列号（SYN的序列号），数据包从isn+1开始
+        self.base_seq = 0  # 窗口起始序列号（逻辑序列号，不回绕）
         self.next_seq = 0  # 下一个可用的序列号
-        self.packets = {}  # 存储已发送但未确认的包 {seq: (data, 发送时间)}
-        self.packet_info = {}  # 包详细信息记录
-        self.rtt_samples = []  # RTT样本
+        self.packets = {}  # 存储已发送但未确认的包 {seq: (data, 发送时间monotonic)}
+        self.packet_info = {}  # 未确认包的详细信息，确认后删除，内存占用与窗口大小有关而与文件大小无关
+        self.packets_new = 0  # 发送的不同数据包个数
+        self.packets_sent = 0  # 发送总次数（含重传）
+        self.payload_bytes = 0  # 有效数据字节数
+        self.fin_acked = threading.Event()
+        self.fin_result = None  # 服务器的校验结果
+        self.rtt_stats = RTTStats()  # RTT统计（毫秒），不保存样本，内存占用固定
+        self.export = export  # 逐包记录导出的文件路径（.csv或.parquet），None表示不记录
+        self.records = [] if export else None  # 逐包记录，只在需要导出时保存
         self.packet_counter = 0  # 全局包计数器
         self.timer_active = True
         self.is_connected = False
@@ -43,9 +250,15 @@ class GBNClient:
         self.loss_rate = loss_rate
         self.expected_ack = 0
         self.lock = threading.Lock()
+        self.window_open = threading.Condition(self.lock)  # 收到ACK窗口有空位时唤醒发送线程
+        self.timer_wakeup = threading.Condition(self.lock)  # 最早到期的定时器变化或传输结束时唤醒定时器线程
         self.data_sent = False
         self.finish_event = threading.Event()
         self.receiver_thread = None
+        self.mode = mode  # 'gbn': Go-Back-N；'sr': Selective Repeat
+        self.bytes_on_wire = 0  # 数据包实际发送的总字节数（含包头和重传）
+        self.retrans_bytes = 0  # 其中重传的字节数
+        self.trace = tracer or tracing.NULL  # 事件跟踪，代替逐包print
 
     def send_packet(self, seq, ack, flags, data):
         """发送控制包（SYN/ACK/FIN）"""
@@ -55,23 +268,28 @@ class GBNClient:
         packet = header + data
 
         # 模拟丢包
-        if random.random() < self.loss_rate and flags != flag_SYN:  # SYN包不模拟丢包
-            print(f"模拟丢包: seq={seq}, flags={flags}")
+        if self.loss_rate and random.random() < self.loss_rate and not flags & flag_SYN:  # SYN包不模拟丢包
+            if self.trace.info:
+                self.trace.event('sim_drop', seq=seq, flags=flags)
             return
 
         self.sock.sendto(packet, self.server_addr)
-        print(f"发送包信息: seq={seq}, ack={ack}, flags={flags}, size={packet_length}")
+        if self.trace.info:
+            self.trace.event('send', seq=seq, ack=ack, flags=flags, size=packet_length)
 
-    def connect(self):
-        """建立连接（三次握手）"""
+    def connect(self, retries=8):
+        """建立连接（三次握手），SYN最多重发retries次，仍没有收到SYN-ACK时返回False"""
         syn_timeout = 1.0  # SYN超时时间稍长
 
-        # 第一次握手：发送SYN
-        print("发送SYN给服务器...")
-        self.send_packet(seq=0, ack=0, flags=flag_SYN, data=b'')
-        self.expected_ack = 1  # 期望的确认号
+        # 第一次握手：发送SYN（SR模式带上SACK标志请求服务器缓存乱序包）
+        syn_flags = flag_SYN | (flag_SACK if self.mode == 'sr' else 0)
+        self.trace.log(tracing.INFO, 'syn')
+        self.send_packet(seq=self.isn & seq_Mask, ack=0, flags=syn_flags, data=b'')
+        syn_sent = time.monotonic()  # SYN没有重发过时，SYN到SYN-ACK的时间是第一个RTT样本（RFC 6298）
+        self.expected_ack = (self.isn + 1) & seq_Mask  # 期望的确认号
 
         # 第二次握手：等待SYN-ACK
+        left = retries  # 还可以重发SYN的次数
         while not self.is_connected:
             try:
                 data, addr = self.sock.recvfrom(1024)
@@ -84,26 +302,42 @@ class GBNClient:
                 # 检查是否是有效的SYN-ACK
                 if flags & flag_SYN and flags & flag_ACK and ack == self.expected_ack:
                     # 第三次握手：发送ACK
-                    print(f"接收SYN-ACK, seq={seq}, ack={ack}")
-                    self.send_packet(seq=1, ack=seq + 1, flags=flag_ACK, data=b'')
+                    self.trace.log(tracing.INFO, 'syn_ack', seq=seq, ack=ack)
+                    if syn_sent is not None:
+                        self.rto.on_sample(time.monotonic() - syn_sent)
+                    if self.mode == 'sr' and not flags & flag_SACK:
+                        self.trace.log(tracing.INFO, 'no_sr')
+                        self.mode = 'gbn'
+                    self.send_packet(seq=self.expected_ack, ack=(seq + 1) & seq_Mask, flags=flag_ACK, data=b'')
                     self.is_connected = True
-                    print("连接建立")
+                    self.trace.log(tracing.INFO, 'connected')
 
                     # 初始化序列号
-                    self.base_seq = 1
-                    self.next_seq = 1
+                    self.base_seq = self.isn + 1
+                    self.next_seq = self.isn + 1
                     return True
             except socket.timeout:
-                print("等待SYN-ACK超时，重试...")
-                self.send_packet(seq=0, ack=0, flags=flag_SYN, data=b'')
+                if left == 0:
+                    self.trace.log(tracing.INFO, 'syn_failed', retries=retries)
+                    return False
+                left -= 1
+                self.trace.log(tracing.INFO, 'syn_retry')
+                syn_sent = None
+                self.send_packet(seq=self.isn & seq_Mask, ack=0, flags=syn_flags, data=b'')
 
         return False
 
-    def send_data(self, data_bytes):
-        """发送数据（使用GBN协议）"""
+    def send_data(self, source):
+        """发送数据（使用GBN或SR协议）
+
+        source为bytes或以二进制方式打开的文件，每次只读取一个包的数据，文件大小不受限制；
+        边读边计算SHA-256，随FIN发给服务器校验。
+        """
         if not self.is_connected:
             print("未连接到服务器")
             return
+        if isinstance(source, (bytes, bytearray)):
+            source = io.BytesIO(source)
 
         # 启动接收线程
         self.receiver_thread = threading.Thread(target=self.receive)
@@ -115,121 +349,192 @@ class GBNClient:
         timer_thread.daemon = True
         timer_thread.start()
 
-        # 计算数据总量和起始字节位置
-        total_length = len(data_bytes)
+        digest = hashlib.sha256()
         byte_pos = 0
         packet_count = 0  # 包计数器
+        eof = False
 
-        # 分段发送数据
-        while packet_count < 50 or self.packets:
+        # 分段发送数据，直到文件读完且所有包都被确认
+        while not eof or self.packets:
             with self.lock:
                 # 计算当前窗口可用空间（按照包的数目计算）
-                window_available = self.max_in_flight - len(self.packets)
-
-                # 发送新数据包（如果窗口有空间且未达50个包）
-                while window_available > 0 and packet_count < 50:
-                    # 获取固定80字节的数据块（最后不足80则取剩余）
-                    end_pos = min(byte_pos + self.packet_size, total_length)
-                    data_piece = data_bytes[byte_pos:end_pos]
-
-                    # 发送数据包
-                    self.send_data_packet(data_piece)
-
-                    # 记录包信息（用于日志）
-                    self.packet_info[self.total_packets] = {
+                # SR模式下被选择确认的包已离开窗口，还要保证新包的序列号不超出base_seq + max_cwnd
+                window_available = min(int(self.cc.cwnd) - len(self.packets),
+                                       self.base_seq + self.max_cwnd - self.next_seq)
+
+                # 发送新数据包（如果窗口有空间且数据未读完）
+                while window_available > 0 and not eof:
+                    # 读取一个包的数据（最后不足packet_size则取剩余）
+                    data_piece = source.read(self.packet_size)
+                    if not data_piece:
+                        eof = True
+                        break
+                    digest.update(data_piece)
+
+                    # 分配序列号并放入窗口，再发送
+                    seq = self.next_seq
+                    self.next_seq += 1
+                    self.packet_info[seq] = {
                         'start_byte': byte_pos,
                         'end_byte': byte_pos + len(data_piece) - 1,
-                        'sent_time': time.time(),
-                        'ack_received': False,
                         'retransmissions': 0,
                         'send_count': 0,
                         'first_sent': time.time()
                     }
+                    self.packets_new += 1
+                    self.payload_bytes += len(data_piece)
+                    self.send_data_packet(seq, data_piece)
 
-                    # 打印发送日志
-                    print(f"第{packet_count}个(第{byte_pos}~{byte_pos + len(data_piece) - 1}字节)client端已经发送")
+                    # 发送日志
+                    if self.trace.debug:
+                        self.trace.event('data', n=packet_count, start=byte_pos, end=byte_pos + len(data_piece) - 1)
 
                     byte_pos += len(data_piece)
                     packet_count += 1
                     window_available -= 1
 
-            # 短暂休眠避免忙等待
-            time.sleep(0.01)
+                # 等待ACK空出窗口（最多10ms），避免忙等待
+                self.window_open.wait(0.01)
 
         self.data_sent = True
 
-        # 等待所有ACK
-        while self.packets:
-            time.sleep(0.1)
-
-        # 关闭连接
-        self.send_packet(seq=self.next_seq, ack=0, flags=flag_FIN, data=b'FIN')
-        self.finish_event.set()
+        # 关闭连接：FIN带上总长度和SHA-256，等待服务器回复校验结果，超时按RTO退避重发
+        fin = struct.pack(fin_Format, b'FIN', byte_pos, digest.digest())
+        wait = self.rto.rto
+        for _ in range(8):
+            self.send_packet(seq=self.next_seq & seq_Mask, ack=0, flags=flag_FIN, data=fin)
+            if self.fin_acked.wait(wait):
+                break
+            wait = min(wait * 2, self.rto.max_rto)
+        with self.lock:
+            self.finish_event.set()
+            self.timer_wakeup.notify()
+
+        self.trace.flush()  # 先输出跟踪事件，再打印结果和报告
+        if self.fin_result == b'OK':
+            print(f"服务器校验通过: {byte_pos}字节, SHA-256 {digest.hexdigest()}")
+        elif self.fin_result == b'BAD':
+            print(f"服务器校验失败: 本地{byte_pos}字节, SHA-256 {digest.hexdigest()}")
+        elif self.fin_result is None:
+            print("没有收到服务器的FIN-ACK，未能确认传输结果")
 
         # 生成报告
         self.generate_report()
 
-    def send_data_packet(self, data_piece):
-        """发送数据包"""
-        seq = self.next_seq
-        if seq not in self.packet_info:
-            self.packet_info[seq] = {
-                'send_count': 0,
-                'first_sent': time.time(),
-                'retransmissions': 0,
-                'ack_received': False,
-                'start_byte': 0,
-                'end_byte': 0
-            }
-        self.packet_info[seq]['send_count'] += 1
+    def send_data_packet(self, seq, data_piece, retransmit=False):
+        """发送（或重传）序列号为seq的数据包，放入窗口并启动它的重传定时器（调用时需持有self.lock）"""
+        info = self.packet_info[seq]
+        info['send_count'] += 1
+        self.packets_sent += 1
+        if retransmit:
+            info['retransmissions'] += 1
 
         timestamp = int(time.time() * 1e6)  # 微秒
         packet_length = len(data_piece)
-        header = struct.pack(header_Format, self.next_seq, 0, flag_DATA, timestamp, packet_length)
+        header = struct.pack(header_Format, seq & seq_Mask, 0, flag_DATA, timestamp, packet_length)
         packet = header + data_piece
-
-        # 模拟丢包
-        if random.random() < self.loss_rate:
-            print(f"模拟数据包丢包: seq={self.next_seq}")
+        self.bytes_on_wire += len(packet)
+        if retransmit:
+            self.retrans_bytes += len(packet)
+
+        # 模拟丢包的包同样留在窗口中、启动定时器，等待超时重传
+        sent_time = time.monotonic()
+        self.packets[seq] = (data_piece, sent_time)
+        self.arm_timer(seq, sent_time)
+        if self.loss_rate and random.random() < self.loss_rate:
+            if self.trace.debug:
+                self.trace.event('data_drop', seq=seq)
             return
 
         self.sock.sendto(packet, self.server_addr)
 
-        # 记录已发送但未确认的包
-        self.packets[self.next_seq] = (data_piece, time.time())
-        self.next_seq += 1
+    def arm_timer(self, seq, sent_time):
+        """为刚发出的包加入定时器，成为最早到期的定时器时唤醒定时器线程"""
+        entry = (sent_time + self.rto.rto, seq, sent_time)
+        heapq.heappush(self.timers, entry)
+        if self.timers[0] is entry:
+            self.timer_wakeup.notify()
 
-    def timeout_check(self):
-        """定时检查超时包"""
-        while not self.finish_event.is_set():
-            current_time = time.time()
-
-            with self.lock:
-                # 检查所有未确认包是否超时
-                if self.packets and (current_time - min(t for _, t in self.packets.values())) > self.timeout:
-                    print(f"超时！从{self.base_seq}开始重传窗口内所有包")
-
-                    # 记录重传
-                    try:
-                        for seq in range(self.base_seq, self.next_seq):
-                            if seq in self.packet_info:
-                                self.packet_info[seq]['retransmissions'] += 1
-                                print(f"重传第{seq}个包")
-
-                        # 重传所有未确认包
-                        for seq in sorted(self.packets.keys()):
-                            data_piece, _ = self.packets[seq]
-                            self.send_data_packet(data_piece)  # 重新发送
-                            self.packets[seq] = (data_piece, time.time())  # 更新发送时间
+    def timer_valid(self, entry):
+        """定时器对应的那次发送仍未被确认、也没有被重传"""
+        _, seq, sent_time = entry
+        packet = self.packets.get(seq)
+        return packet is not None and packet[1] == sent_time
 
-                    except Exception as e:
-                        print(f"超时检查错误: {e}")
-                        continue
-
-            time.sleep(self.timeout / 2)  # 检查频率为超时时间的一半
+    def timeout_check(self):
+        """定时器线程：睡到最早的定时器到期（或被唤醒），只处理到期的包，开销与窗口大小无关"""
+        with self.lock:
+            while not self.finish_event.is_set():
+                # 丢弃已确认或已重传的包留下的失效定时器
+                while self.timers and not self.timer_valid(self.timers[0]):
+                    heapq.heappop(self.timers)
+                if not self.timers:
+                    self.timer_wakeup.wait()
+                    continue
+                delay = self.timers[0][0] - time.monotonic()
+                if delay > 0:
+                    self.timer_wakeup.wait(delay)
+                    continue
+                self.on_timer_expired()
+
+    def on_timer_expired(self):
+        """最早的定时器已到期，重传并退避RTO（调用时需持有self.lock）"""
+        now = time.monotonic()
+        if self.mode == 'sr':
+            # Selective Repeat：每个包单独计时，只重传已到期的包
+            expired = []
+            last_sent = 0.0
+            while self.timers and self.timers[0][0] <= now:
+                entry = heapq.heappop(self.timers)
+                if self.timer_valid(entry):
+                    expired.append(entry[1])
+                    last_sent = max(last_sent, entry[2])
+            reason = 'SR单包超时'
+        else:
+            # Go-Back-N：最早的未确认包超时，重传窗口内所有包（使用各自原来的序列号）
+            last_sent = heapq.heappop(self.timers)[2]
+            expired = sorted(self.packets.keys())
+            reason = 'GBN窗口重传'
+
+        # 一次丢包事件只算一次拥塞事件、只退避一次RTO：上次超时之前发出的包陆续到期不再退避，
+        # 上次超时之后发出（用退避后的RTO计时）的包仍然超时才再次退避；重传的包用退避后的RTO计时
+        if last_sent >= self.episode_start:
+            self.episode_start = now
+            self.cc.on_timeout(time.time())
+            self.log_cwnd()
+            self.rto.on_timeout()
+        if self.trace.info and expired:
+            self.trace.event('timeout', mode=self.mode, count=len(expired), seq=expired[0], rto=self.rto.rto * 1000)
+        for seq in expired:
+            if self.trace.debug:
+                self.trace.event('retransmit', seq=seq, reason=reason)
+            self.send_data_packet(seq, self.packets[seq][0], retransmit=True)
+
+    def ack_packet(self, s):
+        """序列号为s的包被确认：计算RTT并移出窗口（调用时需持有self.lock）"""
+        if s not in self.packets:
+            return
+        # 计算RTT：重传过的包无法判断ACK对应哪一次发送，按Karn算法不作为样本
+        sent_time = self.packets[s][1]
+        rtt = time.monotonic() - sent_time
+        info = self.packet_info.pop(s)
+        if self.records is not None:
+            self.records.append((s, info['start_byte'], info['end_byte'] - info['start_byte'] + 1, info['send_count'],
+                                 info['first_sent'], time.time(), rtt * 1000 if info['send_count'] == 1 else None))
+        if info['send_count'] == 1:
+            self.rtt_stats.add(rtt * 1000)  # 毫秒
+            self.rto.on_sample(rtt)
+            if self.trace.debug:
+                self.trace.event('ack', seq=s, rtt=rtt * 1000)
+        else:
+            self.karn_skipped += 1
+            if self.trace.debug:
+                self.trace.event('ack_karn', seq=s)
+
+        del self.packets[s]  # 从窗口中移除
 
     def receive(self):
-        """接收ACK包（GBN协议实现）"""
+        """接收ACK包（累积确认，SR模式下还处理选择确认）"""
         while not self.finish_event.is_set():
             try:
                 data, addr = self.sock.recvfrom(1024)
@@ -243,48 +548,63 @@ class GBNClient:
                 header = data[:header_Size]
                 seq, ack, flags, ts, length = struct.unpack(header_Format, header)
 
-                server_time = self.timestamp_to_time(ts)
-                print(f"服务器系统时间: {server_time}")
+                # 服务器时间在输出跟踪事件时才转换成可读格式
+                if self.trace.debug:
+                    self.trace.event('server_time', ts=ts)
+
+                # FIN-ACK：报文体是服务器的校验结果
+                if flags & flag_FIN and flags & flag_ACK:
+                    self.fin_result = data[header_Size:header_Size + length]
+                    self.fin_acked.set()
+                    continue
 
                 # 处理ACK包
                 if flags & flag_ACK:
-                    if seq in self.packet_info:
-                        rtt = (time.time() - self.packet_info[seq]['first_sent']) * 1000
-                        self.rtt_samples.append(rtt)
+                    # 选择确认：报文体是被单独确认的序列号列表
+                    sacked = ()
+                    if flags & flag_SACK and length >= 4 and len(data) >= header_Size + length:
+                        sacked = struct.unpack_from(f'>{length // 4}I', data, header_Size)
 
-                    # GBN累积确认处理
                     with self.lock:
-                        if ack > self.base_seq:
-                            # 处理所有被确认的包
-                            for s in range(self.base_seq, ack):
-                                if s in self.packets:
-                                    # 计算RTT
-                                    sent_time = self.packets[s][1]
-                                    rtt = (time.time() - sent_time) * 1000  # 毫秒
-                                    self.rtt_samples.append(rtt)
-
-                                    # 更新包状态
-                                    if s in self.packet_info:
-                                        self.packet_info[s]['ack_received'] = True
-                                        print(f"第{s}个包确认(RTT={rtt:.2f}ms)")
-
-                                    del self.packets[s]  # 从窗口中移除
-
-                            # 滑动窗口
-                            self.base_seq = ack
-
-                            # 动态调整超时时间（基于平均RTT）
-                            if self.rtt_samples:
-                                avg_rtt = sum(self.rtt_samples) / len(self.rtt_samples)
-                                self.timeout = min(100, avg_rtt * 5) / 1000 # 上限100ms，单位为ms
-                                print(f"调整超时时间为: {self.timeout * 1000:.2f}ms 基于平均RTT{avg_rtt:.2f}ms")
+                        # 累积确认：ack之前的包都已收到（32位确认号以窗口起点为参照还原成逻辑序列号）
+                        in_flight = len(self.packets)
+                        ack = unwrap_seq(ack, self.base_seq)
+                        for s in range(self.base_seq, min(ack, self.next_seq)):
+                            self.ack_packet(s)
+                        for s in sacked:
+                            self.ack_packet(unwrap_seq(s, self.base_seq))
+
+                        # 新确认的包使拥塞窗口增长，并唤醒发送线程
+                        acked = in_flight - len(self.packets)
+                        if acked:
+                            self.cc.on_ack(acked, time.time())
+                            self.log_cwnd()
+                            self.window_open.notify()
+
+                        # 滑动窗口：窗口起点为最小的未确认序列号
+                        base_seq = min(self.packets) if self.packets else self.next_seq
+                        if base_seq > self.base_seq:
+                            # 累积确认推进了窗口，说明链路恢复：清除退避，按SRTT/RTTVAR重新计算RTO
+                            self.rto.reset()
+                        self.base_seq = base_seq
+                        if acked and self.rto.srtt is not None and self.trace.debug:
+                            self.trace.event('rto', rto=self.rto.rto * 1000, srtt=self.rto.srtt * 1000,
+                                             rttvar=self.rto.rttvar * 1000)
 
             except socket.timeout:
                 continue  # 超时是正常现象
             except Exception as e:
-                print(f"接收错误: {e}")
+                self.trace.log(tracing.INFO, 'recv_error', error=e)
                 break
 
+    def log_cwnd(self):
+        """记录拥塞窗口变化（只在窗口的整数部分变化时记录，调用时需持有self.lock）"""
+        cwnd = int(self.cc.cwnd)
+        if self.cwnd_log and self.cwnd_log[-1][1] == cwnd:
+            return
+        t = (time.time() - self.start_time) * 1000
+        self.cwnd_log.append((t, cwnd, self.cc.ssthresh, len(self.packets)))
+
     def timestamp_to_time(self, timestamp):
         """将时间戳转换为可读时间格式（HH:MM:SS）"""
         # timestamp是微秒级时间戳（来自包头）
@@ -293,50 +613,133 @@ class GBNClient:
 
     def generate_report(self):
         """生成传输报告"""
-        if not self.packet_info:
+        if not self.packets_new:
             print("没有包发送，无法生成报告")
             return
 
         # 计算丢包率（重传包占总发送包的比例）
-        total_packets_sent = sum(info['send_count'] for info in self.packet_info.values())
-        total_retransmissions = total_packets_sent - len(self.packet_info)
+        total_packets_sent = self.packets_sent
+        total_retransmissions = total_packets_sent - self.packets_new
         loss_rate = (total_retransmissions / total_packets_sent) * 100 if total_packets_sent >0 else 0
 
         # 计算RTT统计信息
         print("\n----- 传输接收报告 -----")
-        print(f"应发送包数: {len(self.packet_info)}")
+        print(f"应发送包数: {self.packets_new}")
         print(f"实际发送总量: {total_packets_sent} (含{total_retransmissions}次重传)")
         print(f"丢包率: {loss_rate:.2f}%")
 
-        # RTT统计（过滤掉异常值）
-        if self.rtt_samples:
-            df = pd.DataFrame(self.rtt_samples, columns=['RTT'])
-            print(f"最大RTT: {df['RTT'].max():.2f}ms")
-            print(f"最小RTT: {df['RTT'].min():.2f}ms")
-            print(f"平均RTT: {df['RTT'].mean():.2f}ms")
-            print(f"RTT标准差: {df['RTT'].std():.2f}ms")
+        # 线路上的字节数：GBN超时重传整个窗口，SR只重传超时的包
+        payload_bytes = self.payload_bytes
+        print(f"传输模式: {'Selective Repeat' if self.mode == 'sr' else 'Go-Back-N'}")
+        print(f"线路上发送的数据包字节数: {self.bytes_on_wire} (其中重传{self.retrans_bytes}字节)")
+        if self.bytes_on_wire:
+            print(f"有效数据{payload_bytes}字节，占发送字节的{payload_bytes / self.bytes_on_wire * 100:.2f}%")
+
+        # 拥塞窗口变化
+        if self.cwnd_log:
+            print(f"拥塞控制: {type(self.cc).__name__}, 包大小{self.packet_size}字节")
+            print(f"最大cwnd: {max(c for _, c, _, _ in self.cwnd_log)}个包, 最终cwnd: {int(self.cc.cwnd)}个包")
+            # 变化记录太多时均匀抽样显示
+            step = max(1, len(self.cwnd_log) // 20)
+            print("时间(ms)   cwnd  ssthresh  在途包数")
+            for t, cwnd, ssthresh, in_flight in self.cwnd_log[::step]:
+                print(f"{t:>8.1f} {cwnd:>6} {ssthresh:>9.1f} {in_flight:>9}")
+
+        # 重传超时
+        if self.rto.srtt is not None:
+            print(f"SRTT: {self.rto.srtt * 1000:.2f}ms, RTTVAR: {self.rto.rttvar * 1000:.2f}ms, "
+                  f"最终RTO: {self.rto.rto * 1000:.2f}ms")
+        print(f"超时退避次数: {self.rto.backoffs}, 按Karn算法丢弃的RTT样本: {self.karn_skipped}")
+
+        # RTT统计（只含未重传包的样本）
+        rtt = self.rtt_stats
+        if rtt.count:
+            print(f"最大RTT: {rtt.stats.max:.2f}ms")
+            print(f"最小RTT: {rtt.stats.min:.2f}ms")
+            print(f"平均RTT: {rtt.stats.mean:.2f}ms")
+            print(f"RTT标准差: {rtt.stats.std:.2f}ms")
+            print(f"RTT分位数: p50 {rtt.percentile(50):.2f}ms, p90 {rtt.percentile(90):.2f}ms, "
+                  f"p99 {rtt.percentile(99):.2f}ms, p999 {rtt.percentile(99.9):.2f}ms")
+
+        if self.export:
+            self.export_records(self.export)
+
+    def export_records(self, path):
+        """把逐包记录导出为CSV或Parquet（按扩展名），需要pandas，只在导出时才导入"""
+        try:
+            import pandas as pd
+        except ImportError:
+            print("导出逐包记录需要安装pandas: pip install pandas")
+            return
+        df = pd.DataFrame(self.records, columns=['seq', 'start_byte', 'length', 'send_count', 'first_sent',
+                                                 'acked', 'rtt_ms'])
+        try:
+            if path.endswith('.parquet'):
+                df.to_parquet(path, index=False)  # 需要pyarrow或fastparquet
+            else:
+                df.to_csv(path, index=False)
+        except (ImportError, OSError) as e:
+            print(f"导出{path}失败: {e}")
+            return
+        print(f"逐包记录({len(df)}行)已导出到{path}")
 
 
 def main():
-    # 命令行参数: python udpclient.py <server_ip> <server_port> [loss_rate] [timeout]
-    if len(sys.argv) < 3:
-        print("命令: python/python3 udpclient.py <server_ip> <server_port> [loss_rate=0.3] [timeout=0.3]")
+    # 命令行参数: python udpclient.py <server_ip> <server_port> [loss_rate] [timeout] [--mode gbn|sr] [--input 文件]
+    parser = argparse.ArgumentParser(description="GBN UDP client")
+    parser.add_argument('server_ip')
+    parser.add_argument('server_port', type=int)
+    parser.add_argument('loss_rate', type=float, nargs='?', default=0.3)
+    parser.add_argument('timeout', type=float, nargs='?', default=0.3)
+    parser.add_argument('--cc', choices=['fixed', 'aimd', 'cubic'], default='fixed',
+                        help="拥塞控制：fixed（默认）为原来固定5个包的窗口，aimd为慢启动+AIMD，cubic为类Cubic")
+    parser.add_argument('--mss', type=int, default=80, help="每个包的数据字节数")
+    parser.add_argument('--mtu', type=int, default=1500, help="路径MTU，限制--mss的上限")
+    parser.add_argument('--max-cwnd', type=int, default=sr_Window,
+                        help=f"拥塞窗口上限（包），SR模式下不能超过服务器的乱序缓存大小{sr_Window}")
+    parser.add_argument('--min-rto', type=float, default=0.02, help="RTO下限(秒)")
+    parser.add_argument('--max-rto', type=float, default=2.0, help="RTO指数退避的上限(秒)")
+    parser.add_argument('--max-backoff', type=int, default=3, help="连续超时时RTO最多翻倍的次数，累积确认推进窗口后清零")
+    parser.add_argument('--input', help="要发送的文件，不指定时发送50个测试包")
+    parser.add_argument('--export', help="把逐包记录导出为CSV或Parquet文件(.csv/.parquet)，需要pandas")
+    parser.add_argument('--isn', type=lambda x: int(x, 0), default=0,
+                        help="初始序列号(0~0xFFFFFFFF)，设为接近0xFFFFFFFF的值可以验证序列号回绕")
+    parser.add_argument('--mode', choices=['gbn', 'sr'], default='gbn',
+                        help="gbn: Go-Back-N，超时重传整个窗口；sr: Selective Repeat，逐包计时、逐包确认")
+    tracing.add_arguments(parser)
+    args = parser.parse_args()
+    if args.max_cwnd < 1:
+        parser.error("--max-cwnd至少为1")
+    if args.mode == 'sr' and args.max_cwnd > sr_Window:
+        parser.error(f"SR模式下--max-cwnd不能超过服务器的乱序缓存大小{sr_Window}（超出的数据包会被服务器丢弃）")
+
+    server_ip = args.server_ip
+    server_port = args.server_port
+    loss_rate = args.loss_rate
+    timeout = args.timeout
+    if not 0 < args.mss <= max_mss(args.mtu):
+        print(f"--mss必须在1~{max_mss(args.mtu)}之间（min(MTU {args.mtu} - IP/UDP首部{ip_udp_Overhead}, "
+              f"服务器接收长度{max_Datagram}) - 协议首部{header_Size}）")
         return
 
-    server_ip = sys.argv[1]
-    server_port = int(sys.argv[2])
-    loss_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.3
-    timeout = float(sys.argv[4]) if len(sys.argv) > 4 else 0.3
-
-    # 生成测试数据 (50个包，每个包80字节)
-    data = b''.join([f"PKT{i:02d}".encode() + b'x'*(80-5) for i in range(50)])
+    # 生成测试数据 (50个包，每个包mss字节，默认80)
+    data = b''.join([f"PKT{i:02d}".encode() + b'x'*(args.mss-5) for i in range(50)])
     # 包头标识：f"PKT{i:02d}".encode()，每个占5字节
-    # 数据填充部分：b'x'*(80-5)
+    # 数据填充部分：b'x'*(mss-5)
 
-    client = GBNClient(server_ip, server_port, timeout, loss_rate)
+    client = GBNClient(server_ip, server_port, timeout, loss_rate, args.mode, args.cc, args.mss, args.max_cwnd,
+                       args.min_rto, args.max_rto, args.isn & seq_Mask, args.export,
+                       tracing.from_args(args, TRACE_FORMATS), args.max_backoff)
 
     try:
-        if client.connect():
+        if not client.connect():
+            client.trace.flush()
+            print("连接失败：多次重发SYN仍没有收到服务器的SYN-ACK")
+            sys.exit(1)
+        if args.input:
+            with open(args.input, 'rb') as f:
+                client.send_data(f)
+        else:
             client.send_data(data)
     finally:
         # 确保线程正确关闭
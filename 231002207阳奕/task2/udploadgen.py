@@ -0,0 +1,119 @@
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+from aiogbn import transfer, FlowResult, TRACE_FORMATS
+from udpclient import max_Datagram, header_Size, sr_Window
+from rttstats import RTTStats
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import tracing
+
+# UDP负载生成器：在一个事件循环中运行大量并发GBN/SR流（aiogbn.py），每个流发送--size字节并由服务器校验SHA-256，
+# 输出总有效吞吐量、重传比例和每个流完成时间的分布
+
+
+async def run_flows(args, tracer):
+    semaphore = asyncio.Semaphore(args.concurrency or args.flows)
+    results = []
+
+    async def one_flow(k):
+        # 各流按--ramp均匀错开启动
+        await asyncio.sleep(args.ramp * k / args.flows)
+        async with semaphore:
+            rng = random.Random(args.seed + k)
+            # Random.randbytes需要Python 3.9；Python 3.8的getrandbits(0)会报错，空负载单独处理
+            payload = rng.getrandbits(8 * args.size).to_bytes(args.size, 'big') if args.size else b''
+            try:
+                result = await asyncio.wait_for(
+                    transfer((args.host, args.port), payload, mode=args.mode, cc=args.cc, mss=args.mss,
+                             max_cwnd=args.max_cwnd, timeout=args.timeout, min_rto=args.min_rto,
+                             max_rto=args.max_rto, loss_rate=args.loss, rng=rng, flow=k, tracer=tracer),
+                    args.flow_timeout)
+            except asyncio.TimeoutError:
+                result = FlowResult(k)  # 超过--flow-timeout仍未完成，记为失败
+                result.elapsed = args.flow_timeout
+            results.append(result)
+
+    await asyncio.gather(*(one_flow(k) for k in range(args.flows)))
+    return results
+
+
+def print_report(args, results, wall):
+    ok = [r for r in results if r.ok]
+    bad = sum(1 for r in results if r.result == b'BAD')
+    no_conn = sum(1 for r in results if not r.connected)
+    payload = sum(r.payload_bytes for r in ok)
+    packets_new = sum(r.packets_new for r in results)
+    packets_sent = sum(r.packets_sent for r in results)
+    wire = sum(r.bytes_on_wire for r in results)
+    retrans = sum(r.retrans_bytes for r in results)
+
+    print("\n----- 负载测试报告 -----")
+    print(f"流: {len(results)}个, 每个{args.size}字节, 模式{args.mode}/{args.cc}, 并发上限{args.concurrency or args.flows}")
+    print(f"校验通过: {len(ok)}, 校验失败: {bad}, 握手失败: {no_conn}, "
+          f"未完成: {len(results) - len(ok) - bad - no_conn}")
+    print(f"总耗时: {wall:.2f}s, 有效吞吐量: {payload * 8 / wall / 1e6:.2f} Mbit/s ({payload}字节)")
+    if packets_sent:
+        print(f"数据包: 新包{packets_new}个, 共发送{packets_sent}次, "
+              f"重传比例{(packets_sent - packets_new) / packets_sent * 100:.2f}%")
+        print(f"线路上发送{wire}字节, 其中重传{retrans}字节({retrans / wire * 100:.2f}%)")
+
+    # 完成时间、单流吞吐量和RTT的分布（只统计校验通过的流）
+    completion = RTTStats()
+    goodput = RTTStats()
+    rtt = RTTStats()
+    for r in ok:
+        completion.add(r.elapsed * 1000)
+        goodput.add(r.payload_bytes * 8 / r.elapsed / 1e3 if r.elapsed else 0.0)  # kbit/s
+        if r.rtt_stats.count:
+            rtt.add(r.rtt_stats.percentile(50))
+    for name, stats, unit in (("完成时间", completion, "ms"), ("单流吞吐量", goodput, "kbit/s"),
+                              ("单流RTT中位数", rtt, "ms")):
+        if stats.count:
+            print(f"{name}: 最小{stats.stats.min:.1f} 平均{stats.stats.mean:.1f} p50 {stats.percentile(50):.1f} "
+                  f"p90 {stats.percentile(90):.1f} p99 {stats.percentile(99):.1f} 最大{stats.stats.max:.1f} {unit}")
+
+
+def main():
+    # 命令行参数: python udploadgen.py <host> <port> [--flows N] [--size 字节] [--concurrency C] [--mode gbn|sr] ...
+    parser = argparse.ArgumentParser(description="UDP load generator (asyncio GBN/SR flows)")
+    parser.add_argument('host')
+    parser.add_argument('port', type=int)
+    parser.add_argument('--flows', type=int, default=100, help="流的总数")
+    parser.add_argument('--concurrency', type=int, default=0, help="同时进行的流数上限，0表示全部同时进行")
+    parser.add_argument('--size', type=int, default=100000, help="每个流发送的字节数")
+    parser.add_argument('--ramp', type=float, default=0.0, help="在这段时间(秒)内均匀错开各流的启动")
+    parser.add_argument('--mode', choices=['gbn', 'sr'], default='sr')
+    parser.add_argument('--cc', choices=['fixed', 'aimd', 'cubic'], default='aimd')
+    parser.add_argument('--mss', type=int, default=1400, help="每个包的数据字节数")
+    parser.add_argument('--max-cwnd', type=int, default=sr_Window, help=f"拥塞窗口上限（包），SR模式下不超过{sr_Window}")
+    parser.add_argument('--timeout', type=float, default=0.3, help="初始RTO(秒)")
+    parser.add_argument('--min-rto', type=float, default=0.02, help="RTO下限(秒)")
+    parser.add_argument('--max-rto', type=float, default=2.0, help="RTO指数退避的上限(秒)")
+    parser.add_argument('--loss', type=float, default=0.0, help="客户端模拟的数据包丢包率")
+    parser.add_argument('--flow-timeout', type=float, default=120.0, help="单个流的最长时间(秒)，超过记为未完成")
+    parser.add_argument('--seed', type=int, default=1, help="随机数种子（数据内容和模拟丢包）")
+    tracing.add_arguments(parser)
+    args = parser.parse_args()
+    if args.max_cwnd < 1:
+        parser.error("--max-cwnd至少为1")
+    if args.mode == 'sr' and args.max_cwnd > sr_Window:
+        parser.error(f"SR模式下--max-cwnd不能超过服务器的乱序缓存大小{sr_Window}（超出的数据包会被服务器丢弃）")
+    if not 0 < args.mss <= max_Datagram - header_Size:
+        print(f"--mss必须在1~{max_Datagram - header_Size}之间（服务器接收长度{max_Datagram} - 协议首部{header_Size}）")
+        return
+
+    tracer = tracing.from_args(args, TRACE_FORMATS)
+    start = time.perf_counter()
+    results = asyncio.run(run_flows(args, tracer))
+    wall = time.perf_counter() - start
+    tracer.flush()
+    print_report(args, results, wall)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,174 +1,736 @@
+import argparse
+import hashlib
+import heapq
+import multiprocessing
+import os
+import queue
+import signal
 import socket
 import struct
 import random
 import sys
 import time
 import threading
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import metrics, tracing
 
 # 自定义协议首部格式
 # I：4字节，B：1字节，Q：8字节，H：2字节
 header_Format = ">IIBQH"  # 序列号(4字节) + 确认号(4字节) + 标志(1字节) + 时间戳(8字节) + 数据长度(2字节)
 header_Size = struct.calcsize(header_Format)
+header_Struct = struct.Struct(header_Format)  # 预编译，避免每个包都解析格式字符串
 
 # 标志位定义
 flag_SYN = 0x1
 flag_ACK = 0x2
 flag_DATA = 0x4
 flag_FIN = 0x8
+flag_SACK = 0x10  # SYN中表示请求Selective Repeat；ACK中表示报文体带有被单独确认的序列号列表(每个4字节)
+
+# Selective Repeat模式下接收端最多缓存的乱序包个数
+sr_Window = 64
+
+# 序列号只有32位，超过后回绕到0；内部使用不回绕的逻辑序列号，收发时再转换
+seq_Mask = 0xFFFFFFFF
+
+# FIN报文体：b'FIN' + 数据总字节数(8字节) + SHA-256(32字节)；FIN-ACK报文体为校验结果
+fin_Format = ">3sQ32s"
+fin_Size = struct.calcsize(fin_Format)
+
+# 服务器每次recvfrom读取的字节数，即数据报（首部+数据）的上限，客户端的mss不能超过 max_Datagram - header_Size
+max_Datagram = 4096
+
+# 处理耗时直方图的采样间隔（每多少个数据报计时一次）
+latency_Sample = 8
+
+
+# 跟踪事件的输出格式（格式化在跟踪器的后台线程中进行）
+TRACE_FORMATS = {
+    'connect': "与 {addr} 建立连接({mode})",
+    'sim_drop': "丢包 {addr}, 第{seq}个 (模拟丢包)",
+    'recv': "收到包 {addr}, 第{seq}个, 长度为 {size}",
+    'buffered': "收到乱序包 {addr}, 第{seq}个, 缓存等待第{expected}个",
+    'discard': "丢弃包 {addr}, 第{seq}个, 期望第{expected}个",
+    'ack': "发送ACK {addr}, ack={ack}, sack={sack}",
+    'idle_expire': "{addr} 空闲超时，移除连接状态",
+    'error': "{where}: {error}",
+    'verify': lambda f: (f"校验{'通过' if f['ok'] else '失败'}: 客户端发送{f['total']}字节，按序收到{f['received']}字节，"
+                         f"SHA-256 {f['digest'][:16]}..." + (f"，已写入{f['sink']}" if f['sink'] else "")),
+    'close': "与 {addr} 关闭连接，共按序收到{received}字节，收到{packets}个数据包，发送{acks}个ACK",
+}
+
+
+def unwrap_seq(wire_seq, ref):
+    """把32位序列号还原成离逻辑序列号ref最近的逻辑序列号（前后各2^31以内）"""
+    diff = (wire_seq - ref) & seq_Mask
+    if diff >= 0x80000000:
+        diff -= 0x100000000
+    return ref + diff
+
+
+class ClientState:
+    """单个客户端的连接状态，用__slots__代替dict，每个连接只占几十字节"""
+    __slots__ = ('next_seq', 'server_seq', 'connected', 'last_seen', 'sr', 'buffer', 'received_bytes', 'sink',
+                 'digest', 'fin_result', 'unacked', 'ack_deadline', 'data_packets', 'acks_sent')
+
+    def __init__(self, now):
+        self.next_seq = 0  # 期望收到的下一个序列号
+        self.server_seq = random.randint(1, 1000)
+        self.connected = False
+        self.last_seen = now
+        self.sr = False  # 是否使用Selective Repeat
+        self.buffer = None  # SR模式下的乱序缓存 {seq: payload}
+        self.received_bytes = 0  # 已按顺序交付的字节数
+        self.sink = None  # 按顺序写入数据的文件（未指定--output-dir时为None）
+        self.digest = hashlib.sha256()  # 已交付数据的SHA-256，收到FIN时与客户端的比较
+        self.fin_result = None  # 收到FIN后的校验结果，重复的FIN直接回复该结果
+        self.unacked = 0  # 延迟ACK：已按序收到但还没有确认的包数
+        self.ack_deadline = None  # 延迟ACK的发送时刻
+        self.data_packets = 0  # 收到的数据包数
+        self.acks_sent = 0  # 发送的ACK数
+
+    def close(self):
+        if self.sink:
+            self.sink.close()
+            self.sink = None
+
+
+class ConnectionTable:
+    """连接表：空闲超时淘汰 + 连接数上限（LRU淘汰）
+
+    OrderedDict按最近访问顺序保存连接，超过上限时淘汰最久未访问的；
+    过期时间放在最小堆里，只检查堆顶，被访问过的连接在出堆时按最新访问时间重新入堆（惰性删除），不需要全表扫描。
+    """
+
+    def __init__(self, idle_timeout=60.0, max_conns=0, tracer=None):
+        self.trace = tracer or tracing.NULL
+        self.idle_timeout = idle_timeout
+        self.max_conns = max_conns
+        self.table = OrderedDict()  # addr -> ClientState
+        self.heap = []  # (过期时刻, 序号, addr, ClientState)
+        self.ack_heap = []  # 延迟ACK定时器 (发送时刻, 序号, addr, ClientState)
+        self.counter = 0
+        self.evicted_idle = 0
+        self.evicted_lru = 0
+        # 统计：关闭（FIN或被淘汰）的连接在关闭时把自己的计数累加进来
+        self.opened = 0
+        self.closed = 0
+        self.data_packets = 0
+        self.acks_sent = 0
+        self.bytes_received = 0
+
+    def __len__(self):
+        return len(self.table)
+
+    def get(self, addr, now):
+        """取出（不存在时新建）addr的连接状态，并刷新最近访问时间"""
+        client_state = self.table.get(addr)
+        if client_state is None:
+            if self.max_conns and len(self.table) >= self.max_conns:
+                self.drop(self.table.popitem(last=False)[1])  # 淘汰最久未访问的连接
+                self.evicted_lru += 1
+            client_state = ClientState(now)
+            self.table[addr] = client_state
+            if self.idle_timeout:
+                self.counter += 1
+                heapq.heappush(self.heap, (now + self.idle_timeout, self.counter, addr, client_state))
+        else:
+            self.table.move_to_end(addr)
+            client_state.last_seen = now
+        return client_state
+
+    def renew(self, addr, now):
+        """同一地址开始新的连接：新建连接状态替换表中的旧状态，旧状态在两个堆中的记录出堆时跳过"""
+        old = self.table.pop(addr, None)
+        if old is not None:
+            self.drop(old)
+        return self.get(addr, now)
+
+    def remove(self, addr):
+        client_state = self.table.pop(addr, None)
+        if client_state:
+            self.drop(client_state)
+
+    def retire(self, client_state):
+        """连接结束，把它的计数累加到连接表的统计中"""
+        self.closed += 1
+        self.data_packets += client_state.data_packets
+        self.acks_sent += client_state.acks_sent
+        self.bytes_received += client_state.received_bytes
+
+    def drop(self, client_state):
+        """移除连接时关闭接收文件；没有正常FIN结束的连接在这里计入统计"""
+        client_state.close()
+        if client_state.connected and client_state.fin_result is None:
+            self.retire(client_state)
+
+    def schedule_ack(self, addr, client_state, deadline):
+        """延迟到deadline再发送ACK（已经有延迟ACK等待发送时不重复加入）"""
+        if client_state.ack_deadline is not None:
+            return
+        client_state.ack_deadline = deadline
+        self.counter += 1
+        heapq.heappush(self.ack_heap, (deadline, self.counter, addr, client_state))
+
+    def next_ack_deadline(self):
+        return self.ack_heap[0][0] if self.ack_heap else None
+
+    def due_acks(self, now):
+        """取出到时间的延迟ACK，已经提前发送了ACK或已被移除的连接跳过"""
+        heap = self.ack_heap
+        while heap and heap[0][0] <= now:
+            deadline, _, addr, client_state = heapq.heappop(heap)
+            if client_state.ack_deadline == deadline and self.table.get(addr) is client_state:
+                yield addr, client_state
+
+    def expire(self, now):
+        """淘汰空闲超时的连接"""
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            _, _, addr, client_state = heapq.heappop(heap)
+            if self.table.get(addr) is not client_state:
+                continue  # 已经因为FIN或LRU被移除
+            deadline = client_state.last_seen + self.idle_timeout
+            if deadline > now:
+                # 期间被访问过，按最新访问时间重新入堆
+                self.counter += 1
+                heapq.heappush(heap, (deadline, self.counter, addr, client_state))
+            else:
+                del self.table[addr]
+                self.drop(client_state)
+                self.evicted_idle += 1
+                self.trace.log(tracing.INFO, 'idle_expire', addr=addr)
 
 
 class UDPServer:
-    def __init__(self, port, loss_rate=0.3):
+    def __init__(self, port, loss_rate=0.3, workers=4, dispatch='sharded', idle_timeout=60.0, max_conns=0,
+                 output_dir=None, ack_every=1, ack_delay=0.005, tracer=None, reuse_port=False, registry=None,
+                 queue_size=1024):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if reuse_port:
+            # 多个进程绑定同一端口，内核按(源地址, 源端口)的哈希把同一个客户端的数据报总分给同一个进程
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.sock.bind(('0.0.0.0', port))
         self.loss_rate = loss_rate
-        # 存储客户端状态: {addr: {'next_seq': int, 'server_seq': int}}
-        self.connections = {}
+        # 存储客户端状态: {addr: ClientState}
+        # sharded模式下每个worker一个分片，同一地址的状态只由一个worker访问，不需要加锁；
+        # thread模式下所有处理线程共用self.connections，OrderedDict和两个堆都不是线程安全的，访问时持有table_lock
+        self.idle_timeout = idle_timeout
+        self.max_conns = max_conns
+        self.output_dir = output_dir  # 收到的数据写入该目录，每个连接一个文件
+        self.trace = tracer or tracing.NULL  # 事件跟踪，代替逐包print
+        # 延迟ACK：每按序收到ack_every个包确认一次，不足时最多等待ack_delay秒；乱序或补上空缺时立即确认
+        # 延迟ACK的定时器由sharded模式的worker驱动，thread模式下始终逐包确认
+        self.ack_every = ack_every if dispatch == 'sharded' else 1
+        self.ack_delay = ack_delay
+        self.connections = ConnectionTable(idle_timeout, max_conns, self.trace)
+        self.table_lock = threading.Lock()
+        self.tables = [self.connections] if dispatch == 'thread' else []  # 所有连接表，汇总统计用
         self.running = True
+        self.dispatch = dispatch
+        self.workers = workers
+        self.queue_size = queue_size  # sharded模式每个worker队列的长度上限，队列满时丢弃新到的数据报
+        self.queues = []
+        self.worker_threads = []
+        self.init_metrics(registry or metrics.Registry())
+
+    def init_metrics(self, registry):
+        """登记指标；计数单元按线程划分，worker线程更新时不加锁"""
+        self.metrics = registry
+        self.m_datagrams = registry.counter('udp_datagrams_received_total', "收到的数据报数")
+        self.m_bytes_in = registry.counter('udp_bytes_received_total', "收到的字节数（含协议首部）")
+        self.m_bytes_out = registry.counter('udp_bytes_sent_total', "发送的字节数（含协议首部）")
+        self.m_sim_drop = registry.counter('udp_datagrams_dropped_total', "丢弃的数据报数", reason='sim_loss')
+        self.m_discard = registry.counter('udp_datagrams_dropped_total', "丢弃的数据报数", reason='out_of_window')
+        self.m_malformed = registry.counter('udp_datagrams_dropped_total', "丢弃的数据报数", reason='malformed')
+        self.m_queue_full = registry.counter('udp_datagrams_dropped_total', "丢弃的数据报数", reason='queue_full')
+        self.m_acks = registry.counter('udp_acks_sent_total', "发送的ACK数（不含SYN-ACK和FIN-ACK）")
+        self.m_connections = registry.counter('udp_connections_total', "建立的连接数")
+        registry.gauge('udp_connections_active', "已建立、还没有结束（FIN或被淘汰）的连接数",
+                       fn=lambda: sum(table.opened - table.closed for table in list(self.tables)))
+        registry.gauge('udp_connections_tracked', "连接表中保存的连接状态数（含等待重复FIN的）",
+                       fn=lambda: sum(len(table) for table in list(self.tables)))
+        self.m_handle_seconds = registry.histogram('udp_handle_seconds',
+                                                   f"处理一个数据报的耗时（秒），每{latency_Sample}个数据报采样一个")
 
     def start(self):
         """启动UDP服务器"""
-        print(f"服务器在{self.sock.getsockname()[1]}端口启动")
+        print(f"服务器(pid={os.getpid()})在{self.sock.getsockname()[1]}端口启动({self.dispatch}模式)")
 
+        if self.dispatch == 'thread':
+            self.serve_thread_per_datagram()
+        else:
+            self.serve_sharded()
+
+    def serve_thread_per_datagram(self):
+        """原实现：每收到一个数据报就创建一个线程处理（保留用于对比）"""
+        datagrams, bytes_in = self.m_datagrams.cell(), self.m_bytes_in.cell()  # 接收线程自己的计数单元
         while self.running:
             try:
-                data, addr = self.sock.recvfrom(4096)
+                data, addr = self.sock.recvfrom(max_Datagram)
+                datagrams[0] += 1
+                bytes_in[0] += len(data)
+                with self.table_lock:
+                    self.connections.expire(time.monotonic())
                 # 启动线程处理客户端请求
-                threading.Thread(target=self.handle_client, args=(data, addr)).start()
+                threading.Thread(target=self.handle_locked, args=(data, addr)).start()
             except Exception as e:
                 if self.running:
-                    print(f"服务器异常: {e}")
+                    self.trace.log(tracing.INFO, 'error', where="服务器异常", error=e)
+                break
+
+    def handle_locked(self, data, addr):
+        """thread模式的处理线程：持有table_lock处理一个数据报，各线程对连接表和连接状态的修改互斥"""
+        with self.table_lock:
+            self.handle_client(data, addr, self.connections)
+
+    def serve_sharded(self):
+        """固定数量的worker线程，按客户端地址分片：同一客户端的数据报总由同一个worker按到达顺序处理"""
+        for k in range(self.workers):
+            q = queue.Queue(maxsize=self.queue_size)
+            t = threading.Thread(target=self.worker_loop, args=(q,), name=f"shard{k}")
+            t.daemon = True
+            t.start()
+            self.queues.append(q)
+            self.worker_threads.append(t)
+
+        queues = self.queues
+        n = len(queues)
+        # 计数单元在循环外取出，每个数据报只多两次列表元素加法
+        datagrams, bytes_in = self.m_datagrams.cell(), self.m_bytes_in.cell()
+        queue_full = self.m_queue_full.cell()
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(max_Datagram)
+            except Exception as e:
+                if self.running:
+                    self.trace.log(tracing.INFO, 'error', where="服务器异常", error=e)
+                break
+            datagrams[0] += 1
+            bytes_in[0] += len(data)
+            # worker处理不过来时丢弃（与网络丢包相同，由客户端超时重传），接收线程不阻塞，队列占用的内存有上限
+            try:
+                queues[hash(addr) % n].put_nowait((data, addr))
+            except queue.Full:
+                queue_full[0] += 1
+
+        for q in queues:
+            q.put(None)  # 通知worker退出
+
+    def worker_loop(self, q):
+        """worker线程：处理分到自己的客户端的数据报，连接表只属于这个worker"""
+        # 连接数上限平均分到各个分片
+        max_conns = -(-self.max_conns // self.workers) if self.max_conns else 0
+        connections = ConnectionTable(self.idle_timeout, max_conns, self.trace)
+        self.tables.append(connections)
+        handled = 0
+        while True:
+            # 有延迟ACK等待发送时，最多等到它的发送时刻
+            timeout = 1.0
+            deadline = connections.next_ack_deadline()
+            if deadline is not None:
+                timeout = min(timeout, max(0.0, deadline - time.monotonic()))
+            try:
+                item = q.get(timeout=timeout)
+            except queue.Empty:
+                item = ()  # 空闲时也要检查过期连接
+            if item is None:
                 break
+            if item:
+                data, addr = item
+                handled += 1
+                # 处理耗时按latency_Sample采样，避免每个数据报都多两次取时间和一次直方图更新
+                start = time.perf_counter() if not handled % latency_Sample else None
+                try:
+                    self.handle_client(data, addr, connections)
+                except Exception as e:
+                    self.trace.log(tracing.INFO, 'error', where=f"处理{addr}的数据报出错", error=e)
+                if start is not None:
+                    self.m_handle_seconds.observe(time.perf_counter() - start)
+            now = time.monotonic()
+            for addr, client_state in connections.due_acks(now):
+                self.send_ack(addr, client_state, client_state.next_seq)
+            connections.expire(now)
 
     def stop(self):
         """停止服务器"""
         self.running = False
         self.sock.close()
 
-    def handle_client(self, data, addr):
-        """处理客户端请求"""
+    def snapshot(self):
+        """当前统计（各连接表的计数之和，读取时不加锁，是近似值）"""
+        stats = {'pid': os.getpid(), 'datagrams': self.m_datagrams.value(), 'tracked': 0, 'opened': 0, 'closed': 0,
+                 'data_packets': 0, 'acks_sent': 0, 'bytes_received': 0, 'evicted_idle': 0, 'evicted_lru': 0}
+        for table in list(self.tables):
+            stats['tracked'] += len(table)
+            for key in ('opened', 'closed', 'data_packets', 'acks_sent', 'bytes_received', 'evicted_idle',
+                        'evicted_lru'):
+                stats[key] += getattr(table, key)
+        return stats
+
+    def handle_client(self, data, addr, connections):
+        """处理客户端请求，connections为该客户端所在的连接表"""
         if len(data) < header_Size:
+            self.m_malformed.inc()
             return
 
         # 解析包头
         header = data[:header_Size]
         payload = data[header_Size:]
-        seq, ack, flags, ts, data_len = struct.unpack(header_Format, header)
+        seq, ack, flags, ts, data_len = header_Struct.unpack(header)
         payload = payload[:data_len]
 
-        # 检查连接状态
-        if addr not in self.connections:
-            # 新连接
-            self.connections[addr] = {
-                'client_addr': addr,
-                'next_seq': 0,
-                'server_seq': random.randint(1, 1000),
-                'connected': False
-            }
-
-        client_state = self.connections[addr]
+        # 检查连接状态（新连接时创建）
+        client_state = connections.get(addr, time.monotonic())
 
         # 处理SYN标志
         if flags & flag_SYN:
-            return self.handle_syn(addr, client_state, seq)
+            return self.handle_syn(addr, client_state, seq, flags, connections)
 
         # 处理数据包
         if flags & flag_DATA:
-            return self.handle_data(addr, client_state, seq, payload)
+            return self.handle_data(addr, client_state, seq, payload, connections)
 
         # 处理FIN标志
         if flags & flag_FIN:
+            if client_state.connected and client_state.fin_result is None:
+                connections.retire(client_state)
+            self.handle_fin(client_state, payload)
             self.send_fin_ack(addr, client_state, seq)
-            # 移除客户端状态
-            if addr in self.connections:
-                del self.connections[addr]
+            # FIN-ACK可能丢失，保留校验结果等待重复的FIN，空闲超时后再移除；不淘汰空闲连接时立即移除
+            if not self.idle_timeout:
+                connections.remove(addr)
 
-    def handle_syn(self, addr, client_state, seq):
+    def handle_syn(self, addr, client_state, seq, flags, connections):
         """处理SYN包"""
-        if not client_state['connected']:
+        if client_state.fin_result is not None:
+            # 同一地址上一次传输已结束，开始新的连接
+            client_state = connections.renew(addr, client_state.last_seen)
+        if not client_state.connected:
             # 第一次握手：回复SYN-ACK
-            client_state['next_seq'] = seq + 1
-            ack_num = client_state['next_seq']
+            client_state.next_seq = seq + 1
+            ack_num = client_state.next_seq
+            client_state.sr = bool(flags & flag_SACK)
+            if client_state.sr:
+                client_state.buffer = {}
+            if self.output_dir:
+                client_state.sink = self.open_sink(addr)
             self.send_syn_ack(addr, client_state, ack_num)
-            client_state['connected'] = True
-            print(f"与 {addr} 建立连接")
+            client_state.connected = True
+            connections.opened += 1
+            self.m_connections.inc()
+            self.trace.log(tracing.INFO, 'connect', addr=addr, mode='SR' if client_state.sr else 'GBN')
+        elif seq + 1 == client_state.next_seq:
+            # 同一个ISN的SYN再次到达：SYN-ACK丢失后客户端重发了SYN，重发SYN-ACK（收到数据后next_seq已前移，不再匹配）
+            self.send_syn_ack(addr, client_state, client_state.next_seq)
 
     def send_syn_ack(self, addr, client_state, ack_num):
         """发送SYN-ACK包"""
-        header = struct.pack(
-            header_Format,
-            client_state['server_seq'],
-            ack_num,
-            flag_SYN | flag_ACK,
+        header = header_Struct.pack(
+            client_state.server_seq,
+            ack_num & seq_Mask,
+            flag_SYN | flag_ACK | (flag_SACK if client_state.sr else 0),
             0,  # 时间戳
             0  # 数据长度
         )
         self.sock.sendto(header, addr)
+        self.m_bytes_out.inc(header_Size)
+
+    def handle_data(self, addr, client_state, seq, payload, connections):
+        """处理数据包
 
-    def handle_data(self, addr, client_state, seq, payload):
-        """处理数据包"""
+        GBN：只接受期望的序列号，乱序包丢弃，ACK为累积确认号；
+        SR：窗口内的乱序包先缓存，连续后一起交付，ACK除累积确认号外还带上本包的序列号（SACK）。
+        seq为包头中的32位序列号，转换成逻辑序列号后再比较，序列号回绕后仍能正确排序。
+        开启延迟ACK时，没有空缺的按序包攒够ack_every个或等到ack_delay后才确认，其余情况立即确认。
+        """
         # 模拟丢包
-        if random.random() < self.loss_rate:
-            print(f"丢包 {addr}, 第{seq}个 (模拟丢包)")
+        if self.loss_rate and random.random() < self.loss_rate:
+            self.m_sim_drop.inc()
+            if self.trace.debug:
+                self.trace.event('sim_drop', addr=addr, seq=seq)
             return
 
-        # 打印接收信息
-        print(f"收到包 {addr}, 第{seq}个, 长度为 {len(payload)}")
+        wire_seq = seq
+        seq = unwrap_seq(wire_seq, client_state.next_seq)
+        client_state.data_packets += 1
+        in_order = seq == client_state.next_seq
+        gap_filled = False
+
+        if in_order:
+            # 接收信息
+            if self.trace.debug:
+                self.trace.event('recv', addr=addr, seq=seq, size=len(payload))
+            self.deliver(client_state, payload)
+            client_state.next_seq += 1
+            # SR：把缓存中接上的包依次交付
+            if client_state.sr:
+                buffer = client_state.buffer
+                while client_state.next_seq in buffer:
+                    self.deliver(client_state, buffer.pop(client_state.next_seq))
+                    client_state.next_seq += 1
+                    gap_filled = True
+        elif client_state.sr and client_state.next_seq < seq < client_state.next_seq + sr_Window:
+            if self.trace.debug:
+                self.trace.event('buffered', addr=addr, seq=seq, expected=client_state.next_seq)
+            client_state.buffer[seq] = payload
+        else:
+            self.m_discard.inc()
+            if self.trace.debug:
+                self.trace.event('discard', addr=addr, seq=seq, expected=client_state.next_seq)
 
         # 更新服务器序列号（对于累积确认）
-        client_state['server_seq'] += 1
+        client_state.server_seq += 1
+
+        # 延迟ACK：没有空缺的按序包先攒着，接收端还缓存着乱序包时不延迟
+        if self.ack_every > 1 and in_order and not gap_filled and not client_state.buffer:
+            client_state.unacked += 1
+            if client_state.unacked < self.ack_every:
+                connections.schedule_ack(addr, client_state, time.monotonic() + self.ack_delay)
+                return
+
+        # 累积确认（SR模式附带本包的序列号，只确认已交付或已缓存的包，超出窗口被丢弃的包不能确认）
+        ack_num = client_state.next_seq
+        sack = None
+        if client_state.sr and (seq < client_state.next_seq or seq in client_state.buffer):
+            sack = [wire_seq]
+        self.send_ack(addr, client_state, ack_num, sack)
 
-        # 累积确认
-        ack_num = seq + 1
-        client_state['next_seq'] = ack_num
+    def deliver(self, client_state, payload):
+        """按顺序交付一个包的数据：计入校验和，写入文件"""
+        client_state.received_bytes += len(payload)
+        client_state.digest.update(payload)
+        if client_state.sink:
+            client_state.sink.write(payload)
 
-        # 发送ACK
-        self.send_ack(addr, client_state, ack_num)
+    def open_sink(self, addr):
+        """为新连接创建接收文件"""
+        path = os.path.join(self.output_dir, f"recv_{addr[0]}_{addr[1]}_{int(time.time())}.bin")
+        try:
+            return open(path, 'wb', buffering=1 << 20)
+        except OSError as e:
+            self.trace.log(tracing.INFO, 'error', where=f"无法创建接收文件{path}", error=e)
+            return None
+
+    def handle_fin(self, client_state, payload):
+        """校验收到的数据：FIN带有客户端计算的总长度和SHA-256时比较，结果保存在fin_result中"""
+        if client_state.fin_result is not None:
+            return  # 重复的FIN
+        sink_name = client_state.sink.name if client_state.sink else None
+        client_state.close()
+        if len(payload) < fin_Size:
+            client_state.fin_result = b''  # 旧客户端，不校验
+            return
+        _, total, digest = struct.unpack_from(fin_Format, payload)
+        ok = total == client_state.received_bytes and digest == client_state.digest.digest()
+        client_state.fin_result = b'OK' if ok else b'BAD'
+        self.trace.log(tracing.INFO, 'verify', ok=ok, total=total, received=client_state.received_bytes,
+                       digest=client_state.digest.hexdigest(), sink=sink_name)
 
-    def send_ack(self, addr, client_state, ack_num):
-        """发送ACK包"""
+    def send_ack(self, addr, client_state, ack_num, sack=None):
+        """发送ACK包，ack_num为逻辑序列号，sack为被单独确认的32位序列号列表"""
+        client_state.unacked = 0
+        client_state.ack_deadline = None
+        client_state.acks_sent += 1
         time_stamp = int(time.time() * 1e6)
-        header = struct.pack(
-            header_Format,
-            client_state['server_seq'],
-            ack_num,
-            flag_ACK,
+        flags = flag_ACK
+        body = b''
+        if sack:
+            flags |= flag_SACK
+            body = struct.pack(f'>{len(sack)}I', *sack)
+        header = header_Struct.pack(
+            client_state.server_seq & seq_Mask,
+            ack_num & seq_Mask,
+            flags,
             time_stamp,  # 时间戳
-            0  # 数据长度
+            len(body)  # 数据长度
         )
-        self.sock.sendto(header, addr)
+        self.sock.sendto(header + body, addr)
+        self.m_acks.inc()
+        self.m_bytes_out.inc(header_Size + len(body))
+        if self.trace.debug:
+            self.trace.event('ack', addr=addr, ack=ack_num, sack=sack)
 
     def send_fin_ack(self, addr, client_state, seq):
-        """处理FIN并发送ACK"""
-        ack_num = seq + 1
-        header = struct.pack(
-            header_Format,
-            client_state['server_seq'],
+        """回复FIN-ACK，报文体为校验结果"""
+        ack_num = (seq + 1) & seq_Mask
+        body = client_state.fin_result or b''
+        header = header_Struct.pack(
+            client_state.server_seq & seq_Mask,
             ack_num,
-            flag_ACK,
+            flag_FIN | flag_ACK,
             0,  # 时间戳
-            0  # 数据长度
+            len(body)  # 数据长度
         )
-        self.sock.sendto(header, addr)
-        print(f"与 {addr} 关闭连接")
+        self.sock.sendto(header + body, addr)
+        self.m_bytes_out.inc(header_Size + len(body))
+        self.trace.log(tracing.INFO, 'close', addr=addr, received=client_state.received_bytes,
+                       packets=client_state.data_packets, acks=client_state.acks_sent)
 
 
-def main():
-    # 命令行参数: python udpserver.py <port> [loss_rate]
-    if len(sys.argv) < 2:
-        print("正确命令: python/python3 udpserver.py <port> [loss_rate=0.3]")
+STAT_KEYS = ('datagrams', 'tracked', 'opened', 'closed', 'data_packets', 'acks_sent', 'bytes_received',
+             'evicted_idle', 'evicted_lru')
+
+
+def make_server(args, reuse_port=False, k=0):
+    """按命令行参数创建服务器，指定--metrics-port时启动指标HTTP服务（多进程模式下第k个worker使用端口+k，
+    跟踪文件为<--trace-file>.k）"""
+    server = UDPServer(args.port, args.loss_rate, args.workers, args.dispatch, args.idle_timeout, args.max_conns,
+                       args.output_dir, args.ack_every, args.ack_delay / 1000,
+                       tracing.from_args(args, TRACE_FORMATS, k if reuse_port else None), reuse_port,
+                       queue_size=args.queue_size)
+    if args.metrics_port:
+        metrics.serve(server.metrics, args.metrics_port + k, args.metrics_host)
+        print(f"指标: http://{args.metrics_host}:{args.metrics_port + k}/metrics")
+    return server
+
+
+def worker_main(args, k, report_q):
+    """多进程模式下的worker进程：独立的UDPServer和连接表，定期把统计快照发给主进程"""
+    # Ctrl+C由主进程统一处理，worker只响应主进程发来的SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server = make_server(args, reuse_port=True, k=k)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())  # 关闭套接字，接收循环随之退出
+
+    def report_loop():
+        while server.running:
+            time.sleep(args.report_interval)
+            report_q.put((k, server.snapshot()))
+
+    threading.Thread(target=report_loop, daemon=True).start()
+    server.start()
+    report_q.put((k, server.snapshot()))  # 退出前的最终统计
+
+
+def format_stats(total, per_process=None):
+    line = (f"数据报{total['datagrams']} 连接表{total['tracked']} 已建立{total['opened']} 已关闭{total['closed']} "
+            f"数据包{total['data_packets']} ACK{total['acks_sent']} 接收字节{total['bytes_received']} "
+            f"淘汰(空闲{total['evicted_idle']}/LRU{total['evicted_lru']})")
+    if per_process:
+        line += " 各进程数据报[" + ' '.join(str(stats['datagrams']) for stats in per_process) + "]"
+    return line
+
+
+def serve_processes(args):
+    """多进程模式：N个worker进程各自用SO_REUSEPORT绑定同一端口，每个进程有自己的连接表
+
+    内核按四元组哈希选择进程，同一客户端的数据报总是到达同一个进程，进程之间不需要共享连接状态。
+    主进程汇总各进程定期上报的统计，并在worker异常退出时重新启动它。
+    """
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        print("当前系统不支持SO_REUSEPORT，无法使用多进程模式")
         return
 
-    port = int(sys.argv[1])
-    loss_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+    stopping = threading.Event()
+
+    def on_stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+
+    report_q = multiprocessing.Queue()
+    latest = [None] * args.processes  # 各进程最近一次上报的统计
+    retired = dict.fromkeys(STAT_KEYS, 0)  # 已退出进程的累计统计（active除外）
+
+    if args.trace_file:
+        # 每个worker一个跟踪文件，在这里清空一次，worker（包括重新启动的）以追加方式写入
+        for k in range(args.processes):
+            open(tracing.trace_path(args, k), 'w').close()
 
-    server = UDPServer(port, loss_rate)
+    def start_worker(k):
+        p = multiprocessing.Process(target=worker_main, args=(args, k, report_q), name=f"worker{k}")
+        p.start()
+        return p
+
+    def drain():
+        while True:
+            try:
+                k, stats = report_q.get_nowait()
+            except queue.Empty:
+                return
+            if stats['pid'] == workers[k].pid:  # 忽略已被替换的旧进程迟到的快照
+                latest[k] = stats
+
+    def total():
+        result = dict(retired)
+        for stats in latest:
+            if stats:
+                for key in STAT_KEYS:
+                    result[key] += stats[key]
+        return result
+
+    workers = [start_worker(k) for k in range(args.processes)]
+    print(f"主进程(pid={os.getpid()})启动了{args.processes}个worker进程")
+    next_report = time.monotonic() + args.report_interval
+    while not stopping.wait(0.5):
+        drain()
+        for k, p in enumerate(workers):
+            if not p.is_alive() and not stopping.is_set():
+                print(f"worker{k}(pid={p.pid})异常退出(exitcode={p.exitcode})，重新启动")
+                if latest[k]:
+                    for key in STAT_KEYS:
+                        if key != 'tracked':
+                            retired[key] += latest[k][key]
+                latest[k] = None
+                workers[k] = start_worker(k)
+        if time.monotonic() >= next_report:
+            next_report += args.report_interval
+            print(format_stats(total(), [stats or {'datagrams': 0} for stats in latest]))
+
+    print("停止服务器...")
+    for p in workers:
+        if p.is_alive():
+            p.terminate()  # 发送SIGTERM
+    for p in workers:
+        p.join(5.0)
+        if p.is_alive():
+            p.kill()
+            p.join()
+    drain()
+    print("汇总: " + format_stats(total(), [stats or {'datagrams': 0} for stats in latest]))
+
+
+def main():
+    # 命令行参数: python udpserver.py <port> [loss_rate] [--workers N] [--dispatch sharded|thread] [--processes P]
+    parser = argparse.ArgumentParser(description="GBN UDP server")
+    parser.add_argument('port', type=int)
+    parser.add_argument('loss_rate', type=float, nargs='?', default=0.3)
+    parser.add_argument('--workers', type=int, default=4, help="sharded模式的worker线程数（多进程模式下为每个进程的线程数）")
+    parser.add_argument('--queue-size', type=int, default=1024,
+                        help="sharded模式每个worker队列最多缓存的数据报数，队列满时丢弃新到的数据报")
+    parser.add_argument('--processes', type=int, default=0,
+                        help="worker进程数，各进程用SO_REUSEPORT绑定同一端口，0为单进程")
+    parser.add_argument('--report-interval', type=float, default=5.0, help="多进程模式下主进程输出汇总统计的间隔(秒)")
+    parser.add_argument('--idle-timeout', type=float, default=60.0,
+                        help="连接空闲多少秒后移除其状态（客户端崩溃或FIN丢失时），0表示不淘汰")
+    parser.add_argument('--max-conns', type=int, default=0, help="最多保存的连接数，超过时淘汰最久未活动的，0表示不限制")
+    parser.add_argument('--ack-every', type=int, default=1,
+                        help="延迟ACK：每按序收到k个包确认一次（sharded模式），1为逐包确认")
+    parser.add_argument('--ack-delay', type=float, default=5.0,
+                        help="延迟ACK的最长等待时间(ms)，应小于客户端的RTO下限")
+    parser.add_argument('--output-dir', help="把每个连接收到的数据写入该目录下的文件")
+    parser.add_argument('--dispatch', choices=['sharded', 'thread'], default='sharded',
+                        help="sharded: 按客户端地址分片到固定worker；thread: 每个数据报一个线程（原实现）")
+    tracing.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    if args.queue_size < 1:
+        parser.error("--queue-size至少为1")
+
+    if args.processes > 0:
+        serve_processes(args)
+        return
 
+    server = make_server(args)
     try:
         server.start()
     except KeyboardInterrupt:
         print("停止服务器...")
         server.stop()
+        print("汇总: " + format_stats(server.snapshot()))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,386 @@
+import argparse
+import asyncio
+import collections
+import random
+import signal
+
+# 本地网络损伤模拟代理：放在客户端和服务器之间（回环即可），按配置对经过的数据包做丢包、时延/抖动、乱序、重复和限速
+# UDP：每个客户端地址对应一个上游socket，服务器看到的仍是不同的客户端；
+# TCP：字节流不能丢包/乱序，只做时延、抖动（保持顺序）和限速；限速时不丢数据，排队的数据超过--queue时暂停读取（反压）
+# 所有随机数来自--seed初始化的random.Random，同样的参数和流量得到同样的损伤序列
+
+
+class Bernoulli:
+    """独立丢包：每个包以概率p丢弃"""
+
+    def __init__(self, rng, p):
+        self.rng = rng
+        self.p = p
+
+    def lost(self):
+        return self.p > 0 and self.rng.random() < self.p
+
+
+class GilbertElliott:
+    """Gilbert-Elliott突发丢包模型：好/坏两个状态，好状态以p_gb转入坏状态，坏状态以p_bg回到好状态，
+    两个状态下分别以loss_good/loss_bad丢包；平均丢包率 = (p_gb*loss_bad + p_bg*loss_good) / (p_gb + p_bg)
+    """
+
+    def __init__(self, rng, p_gb, p_bg, loss_good=0.0, loss_bad=1.0):
+        self.rng = rng
+        self.p_gb = p_gb
+        self.p_bg = p_bg
+        self.loss_good = loss_good
+        self.loss_bad = loss_bad
+        self.bad = False
+
+    def lost(self):
+        rng = self.rng
+        if self.bad:
+            if rng.random() < self.p_bg:
+                self.bad = False
+        elif rng.random() < self.p_gb:
+            self.bad = True
+        return rng.random() < (self.loss_bad if self.bad else self.loss_good)
+
+
+class TokenBucket:
+    """令牌桶限速：rate字节/秒，最多积累burst字节；令牌不足时包排队，排队超过queue_limit字节时尾部丢弃"""
+
+    def __init__(self, rate, burst, queue_limit):
+        self.rate = rate
+        self.burst = burst
+        self.queue_limit = queue_limit
+        self.tokens = burst
+        self.last = None
+
+    def reserve(self, size, now, drop=True):
+        """返回这个包离开令牌桶的时刻，队列满时返回None；drop=False时不丢弃（字节流，由调用者做反压）"""
+        if self.last is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if drop and size - self.tokens > self.queue_limit:
+            return None
+        self.tokens -= size
+        return now if self.tokens >= 0 else now + -self.tokens / self.rate
+
+
+class Link:
+    """一个方向上的损伤：丢包 -> 重复 -> 令牌桶 -> 时延/抖动/乱序，到时间后调用send(data)
+
+    ordered=True时（TCP）只做限速和时延，数据不丢弃，按到达顺序排在self.queue中依次发出；
+    排队的字节数超过queue_limit时，wait_room()让读取方暂停，直到排队的数据发出一部分。
+    """
+
+    def __init__(self, loop, rng, args, ordered=False):
+        self.loop = loop
+        self.rng = rng
+        self.ordered = ordered
+        self.delay = args.delay / 1000
+        self.jitter = args.jitter / 1000
+        self.dist = args.dist
+        self.reorder = 0.0 if ordered else args.reorder
+        self.duplicate = 0.0 if ordered else args.duplicate
+        if ordered:
+            self.loss = Bernoulli(rng, 0.0)
+        elif args.ge:
+            self.loss = GilbertElliott(rng, *args.ge)
+        else:
+            self.loss = Bernoulli(rng, args.loss)
+        self.bucket = TokenBucket(args.rate * 1000 / 8, args.burst, args.queue) if args.rate else None
+        self.queue_limit = args.queue
+        self.last_when = 0.0  # ordered模式下上一个包的离开时刻
+        self.queue = collections.deque()  # ordered模式下待发出的 (离开时刻, 数据, send)，数据为None时是EOF回调
+        self.pending = 0  # queue中的字节数
+        self.timer = None
+        self.room = None  # wait_room()等待的future
+        self.stats = {'in': 0, 'out': 0, 'lost': 0, 'queue_drop': 0, 'duplicated': 0, 'reordered': 0}
+
+    def sample_delay(self):
+        if not self.jitter:
+            return self.delay
+        if self.dist == 'normal':
+            d = self.rng.gauss(self.delay, self.jitter)
+        elif self.dist == 'exponential':
+            d = self.delay + self.rng.expovariate(1 / self.jitter)
+        else:
+            d = self.delay + self.rng.uniform(-self.jitter, self.jitter)
+        return max(0.0, d)
+
+    def submit(self, data, send):
+        stats = self.stats
+        stats['in'] += 1
+        if self.loss.lost():
+            stats['lost'] += 1
+            return
+        copies = 1
+        if self.duplicate and self.rng.random() < self.duplicate:
+            copies = 2
+            stats['duplicated'] += 1
+        now = self.loop.time()
+        for _ in range(copies):
+            depart = self.bucket.reserve(len(data), now, not self.ordered) if self.bucket else now
+            if depart is None:
+                stats['queue_drop'] += 1
+                continue
+            if self.reorder and self.rng.random() < self.reorder:
+                when = depart  # 不经过时延，越过前面还在路上的包
+                stats['reordered'] += 1
+            else:
+                when = depart + self.sample_delay()
+            stats['out'] += 1
+            if self.ordered:
+                self.enqueue(max(when, self.last_when), data, send)
+            elif when <= now:
+                send(data)
+            else:
+                self.loop.call_at(when, send, data)
+
+    def submit_eof(self, callback):
+        """ordered模式：在已经提交的数据都发出之后调用callback"""
+        self.enqueue(self.last_when, None, callback)
+
+    def enqueue(self, when, data, send):
+        """ordered模式：排到队尾；离开时刻相同的call_at不保证先后顺序，所以由一个定时器按队列顺序发出"""
+        self.last_when = when
+        self.queue.append((when, data, send))
+        if data is not None:
+            self.pending += len(data)
+        if self.timer is None:
+            self.timer = self.loop.call_at(when, self.run_queue)
+
+    def run_queue(self):
+        self.timer = None
+        queue = self.queue
+        now = self.loop.time()
+        while queue and queue[0][0] <= now:
+            _, data, send = queue.popleft()
+            if data is None:
+                send()
+            else:
+                self.pending -= len(data)
+                send(data)
+        if self.room and not self.room.done() and self.pending <= self.queue_limit:
+            self.room.set_result(None)
+        if queue:
+            self.timer = self.loop.call_at(queue[0][0], self.run_queue)
+
+    async def wait_room(self):
+        """ordered模式：排队的数据不超过queue_limit时返回"""
+        while self.pending > self.queue_limit:
+            self.room = self.loop.create_future()
+            await self.room
+
+
+def make_rng(seed, name):
+    """每个方向（每个TCP连接）用独立的随机数序列，互不影响"""
+    return random.Random(f"{seed}:{name}")
+
+
+class Upstream(asyncio.DatagramProtocol):
+    """UDP：代理与服务器之间、代表一个客户端的socket"""
+
+    def __init__(self, proxy, client_addr):
+        self.proxy = proxy
+        self.client_addr = client_addr
+        self.transport = None
+        self.pending = []  # socket创建好之前到达的包
+        self.last_seen = proxy.loop.time()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        for data in self.pending:
+            transport.sendto(data)
+        self.pending = None
+
+    def send(self, data):
+        if self.transport:
+            self.transport.sendto(data)
+        elif self.pending is not None:
+            self.pending.append(data)
+
+    def datagram_received(self, data, addr):
+        self.last_seen = self.proxy.loop.time()
+        self.proxy.down.submit(data, self.reply)
+
+    def reply(self, data):
+        self.proxy.transport.sendto(data, self.client_addr)
+
+
+class UDPProxy(asyncio.DatagramProtocol):
+    def __init__(self, loop, args):
+        self.loop = loop
+        self.target = args.target
+        self.idle = args.idle
+        self.up = Link(loop, make_rng(args.seed, 'c2s'), args) if args.dir != 's2c' else Link(loop, None, CLEAN)
+        self.down = Link(loop, make_rng(args.seed, 's2c'), args) if args.dir != 'c2s' else Link(loop, None, CLEAN)
+        self.upstreams = {}  # 客户端地址 -> Upstream
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.loop.call_later(self.idle, self.expire)
+
+    def datagram_received(self, data, addr):
+        upstream = self.upstreams.get(addr)
+        if upstream is None:
+            upstream = Upstream(self, addr)
+            self.upstreams[addr] = upstream
+            self.loop.create_task(self.loop.create_datagram_endpoint(lambda: upstream, remote_addr=self.target))
+        upstream.last_seen = self.loop.time()
+        self.up.submit(data, upstream.send)
+
+    def expire(self):
+        """关闭空闲的上游socket"""
+        now = self.loop.time()
+        for addr, upstream in list(self.upstreams.items()):
+            if now - upstream.last_seen > self.idle:
+                if upstream.transport:
+                    upstream.transport.close()
+                del self.upstreams[addr]
+        self.loop.call_later(self.idle, self.expire)
+
+
+async def tcp_pump(reader, writer, link):
+    """把reader的数据经过link转发给writer，对端关闭后在最后的数据发出之后关闭writer的写方向
+
+    link中排队的数据超过--queue、或writer的发送缓冲区已满时暂停读取，反压经TCP窗口传回发送方。
+    """
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            link.submit(data, writer.write)
+            await link.wait_room()
+            await writer.drain()
+    except ConnectionError:
+        pass
+
+    done = link.loop.create_future()
+
+    def shutdown():
+        try:
+            if writer.can_write_eof():
+                writer.write_eof()
+        except OSError:
+            pass
+        done.set_result(None)
+
+    link.submit_eof(shutdown)
+    await done
+
+
+async def serve_tcp(loop, args, totals):
+    async def on_connect(client_reader, client_writer):
+        try:
+            server_reader, server_writer = await asyncio.open_connection(*args.target)
+        except OSError:
+            client_writer.close()
+            return
+        # TCP每个连接、每个方向单独的Link（限速也按连接计算）
+        k = len(totals)
+        up = Link(loop, make_rng(args.seed, f"tcp{k}:c2s"), args if args.dir != 's2c' else CLEAN, ordered=True)
+        down = Link(loop, make_rng(args.seed, f"tcp{k}:s2c"), args if args.dir != 'c2s' else CLEAN, ordered=True)
+        totals.append((up, down))
+        # 两个方向的最后的数据和EOF都发出后再关闭
+        await asyncio.gather(tcp_pump(client_reader, server_writer, up), tcp_pump(server_reader, client_writer, down))
+        server_writer.close()
+        client_writer.close()
+
+    return await asyncio.start_server(on_connect, args.host, args.listen)
+
+
+def print_stats(name, links):
+    total = {}
+    for link in links:
+        for k, v in link.stats.items():
+            total[k] = total.get(k, 0) + v
+    print(f"{name}: " + ", ".join(f"{k}={v}" for k, v in total.items()))
+
+
+async def run(args):
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows只能Ctrl+C退出，看不到统计
+
+    if args.proto == 'udp':
+        transport, proxy = await loop.create_datagram_endpoint(lambda: UDPProxy(loop, args),
+                                                               local_addr=(args.host, args.listen))
+        print(f"UDP代理 {args.host}:{args.listen} -> {args.target[0]}:{args.target[1]}")
+        await stop.wait()
+        transport.close()
+        print_stats("客户端->服务器", [proxy.up])
+        print_stats("服务器->客户端", [proxy.down])
+    else:
+        totals = []
+        server = await serve_tcp(loop, args, totals)
+        print(f"TCP代理 {args.host}:{args.listen} -> {args.target[0]}:{args.target[1]}")
+        await stop.wait()
+        server.close()
+        print(f"共{len(totals)}个连接")
+        print_stats("客户端->服务器", [up for up, _ in totals])
+        print_stats("服务器->客户端", [down for _, down in totals])
+
+
+def parse_target(text):
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def parse_ge(text):
+    """'p_gb,p_bg[,loss_bad[,loss_good]]'"""
+    values = [float(x) for x in text.split(',')]
+    if not 2 <= len(values) <= 4:
+        raise argparse.ArgumentTypeError("格式为 p_gb,p_bg[,loss_bad[,loss_good]]")
+    p_gb, p_bg = values[:2]
+    loss_bad = values[2] if len(values) > 2 else 1.0
+    loss_good = values[3] if len(values) > 3 else 0.0
+    return p_gb, p_bg, loss_good, loss_bad
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description="本地网络损伤模拟代理（UDP/TCP）")
+    parser.add_argument('proto', choices=['udp', 'tcp'])
+    parser.add_argument('--listen', type=int, required=True, help="代理监听的端口，客户端连接这个端口")
+    parser.add_argument('--target', type=parse_target, required=True, help="服务器地址 host:port")
+    parser.add_argument('--host', default='127.0.0.1', help="代理监听的地址")
+    parser.add_argument('--dir', choices=['both', 'c2s', 's2c'], default='both',
+                        help="损伤作用的方向：both双向，c2s只有客户端到服务器，s2c只有服务器到客户端")
+    parser.add_argument('--seed', type=int, default=1, help="随机数种子，相同种子得到相同的损伤序列")
+    parser.add_argument('--loss', type=float, default=0.0, help="独立(Bernoulli)丢包率（仅UDP）")
+    parser.add_argument('--ge', type=parse_ge,
+                        help="Gilbert-Elliott突发丢包（仅UDP）：p_gb,p_bg[,坏状态丢包率=1[,好状态丢包率=0]]，指定后忽略--loss")
+    parser.add_argument('--delay', type=float, default=0.0, help="单向时延(ms)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="抖动(ms)，含义由--dist决定")
+    parser.add_argument('--dist', choices=['uniform', 'normal', 'exponential'], default='uniform',
+                        help="uniform: delay±jitter均匀分布；normal: 均值delay、标准差jitter；exponential: delay+均值为jitter的指数分布")
+    parser.add_argument('--reorder', type=float, default=0.0, help="乱序概率：被选中的包不经过时延直接发出（仅UDP）")
+    parser.add_argument('--duplicate', type=float, default=0.0, help="重复概率（仅UDP）")
+    parser.add_argument('--rate', type=float, default=0.0, help="带宽(kbit/s)，0为不限速")
+    parser.add_argument('--burst', type=int, default=15000, help="令牌桶容量(字节)")
+    parser.add_argument('--queue', type=int, default=100000,
+                        help="最多排队的字节数：UDP限速时超过则丢包；TCP超过则暂停读取，不丢数据")
+    parser.add_argument('--idle', type=float, default=60.0, help="UDP客户端空闲多少秒后关闭对应的上游socket")
+    return parser
+
+
+# 不做任何损伤的配置，用于--dir只损伤一个方向时的另一个方向
+CLEAN = make_parser().parse_args(['udp', '--listen', '0', '--target', '0'])
+
+
+def main():
+    # 例: python netem.py udp --listen 9100 --target 127.0.0.1:9000 --delay 20 --jitter 5 --ge 0.01,0.3 --rate 10000
+    args = make_parser().parse_args()
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
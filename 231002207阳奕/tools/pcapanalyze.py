@@ -0,0 +1,1036 @@
+import argparse
+import collections
+import csv
+import json
+import os
+import socket
+import struct
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'task1'))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'task2'))
+from framing import (BATCH_COUNT, CAP_COMPRESS, CAP_ZSTD, CAPS, HEADER, HEADER_SIZE, RESUME, TYPE_BATCH_ANSWER,
+                     TYPE_BATCH_REQUEST, TYPE_INIT_EX, TYPE_RESUME, Decompressor, supported_compression)
+from udpclient import (header_Format, header_Size, flag_SYN, flag_ACK, flag_DATA, flag_FIN, flag_SACK, fin_Format,
+                       unwrap_seq)
+from rttstats import RTTStats
+
+# 离线抓包分析：纯Python逐块读取pcapng（也支持经典pcap）文件，解码task1的'>HI' reverse协议（TCP）和task2的'>IIBQH' GBN/SR协议（UDP），
+# 按流统计吞吐量、RTT、重传/乱序次数和窗口占用，输出汇总，并可导出按时间分段的CSV和JSON汇总，用于不同版本之间的回归对比。
+# 每次只读一个块、只保留每个流的状态（在途的段/包、乱序缓存有上限），内存占用与抓包文件大小无关。
+
+header_Struct = struct.Struct(header_Format)
+fin_Struct = struct.Struct(fin_Format)
+
+SHB = 0x0A0D0D0A  # Section Header Block
+IDB = 1  # Interface Description Block
+OPB = 2  # Packet Block（已废弃）
+EPB = 6  # Enhanced Packet Block
+BYTE_ORDER_MAGIC = 0x1A2B3C4D
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+
+# 时间序列CSV的列：方向上的字节数都是传输层载荷（TCP数据、UDP数据报），goodput为客户端发出的新数据，
+# inflight对TCP为字节、对GBN为包，app_units对TCP为应答的分块数、对GBN为新确认的包数
+SERIES_FIELDS = ['time', 'flow', 'proto', 'c2s_bytes', 's2c_bytes', 'goodput_bytes', 'retrans', 'out_of_order',
+                 'rtt_ms', 'rtt_samples', 'inflight_max', 'inflight_mean', 'app_units']
+
+
+# ---- 抓包文件读取 ----
+
+def read_exact(f, n):
+    data = f.read(n)
+    if len(data) != n:
+        raise EOFError
+    return data
+
+
+def read_pcapng(f, first):
+    """逐块读取pcapng，生成(时间戳秒, 链路类型, 帧数据, 原始长度)；first为已读出的前8字节"""
+    endian = '<'
+    interfaces = []  # [(链路类型, 时间戳单位(秒), 时间偏移(秒))]
+    head = first
+    while True:
+        btype, blen = struct.unpack(endian + 'II', head)
+        if btype == SHB:
+            # 新的Section：按字节序标记确定字节序，接口编号重新从0开始
+            magic = read_exact(f, 4)
+            endian = '<' if struct.unpack('<I', magic)[0] == BYTE_ORDER_MAGIC else '>'
+            blen = struct.unpack(endian + 'I', head[4:])[0]
+            body = magic + read_exact(f, blen - 12)
+            interfaces = []
+        else:
+            body = read_exact(f, blen - 8)
+        if btype == IDB:
+            linktype = struct.unpack_from(endian + 'H', body)[0]
+            resolution, offset = 1e-6, 0
+            for code, value in block_options(body[8:-4], endian):
+                if code == 9 and value:  # if_tsresol：最高位为0表示10^-n秒，为1表示2^-n秒
+                    resolution = 2.0 ** -(value[0] & 0x7F) if value[0] & 0x80 else 10.0 ** -value[0]
+                elif code == 14 and len(value) == 8:  # if_tsoffset
+                    offset = struct.unpack(endian + 'q', value)[0]
+            interfaces.append((linktype, resolution, offset))
+        elif btype == EPB or btype == OPB:
+            if btype == EPB:
+                iid, ts_high, ts_low, caplen, origlen = struct.unpack_from(endian + 'IIIII', body)
+            else:
+                iid, _, ts_high, ts_low, caplen, origlen = struct.unpack_from(endian + 'HHIIII', body)
+            if iid < len(interfaces):
+                linktype, resolution, offset = interfaces[iid]
+                yield (ts_high << 32 | ts_low) * resolution + offset, linktype, body[20:20 + caplen], origlen
+        # 其他块（Simple Packet Block没有时间戳、统计、名字解析等）跳过
+        head = f.read(8)
+        if len(head) < 8:
+            return
+
+
+def block_options(data, endian):
+    """解析块的选项列表，生成(代码, 值)"""
+    pos = 0
+    while pos + 4 <= len(data):
+        code, length = struct.unpack_from(endian + 'HH', data, pos)
+        if code == 0:
+            return
+        yield code, data[pos + 4:pos + 4 + length]
+        pos += 4 + (length + 3 & ~3)
+
+
+def read_pcap(f, first):
+    """经典pcap格式，first为已读出的前8字节"""
+    magic = struct.unpack('<I', first[:4])[0]
+    endian = '<' if magic in (0xA1B2C3D4, 0xA1B23C4D) else '>'
+    nano = struct.unpack(endian + 'I', first[:4])[0] == 0xA1B23C4D
+    linktype = struct.unpack(endian + 'I', read_exact(f, 16)[12:])[0] & 0xFFFF
+    while True:
+        head = f.read(16)
+        if len(head) < 16:
+            return
+        sec, frac, caplen, origlen = struct.unpack(endian + 'IIII', head)
+        yield sec + frac * (1e-9 if nano else 1e-6), linktype, read_exact(f, caplen), origlen
+
+
+def read_packets(path):
+    """按文件开头的魔数选择pcapng或pcap读取器；文件截断时在最后一个完整的包处结束"""
+    with open(path, 'rb') as f:
+        first = f.read(8)
+        if len(first) < 8:
+            return
+        if struct.unpack('<I', first[:4])[0] == SHB:
+            reader = read_pcapng(f, first)
+        elif first[:4] in (b'\xd4\xc3\xb2\xa1', b'\xa1\xb2\xc3\xd4', b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d'):
+            reader = read_pcap(f, first)
+        else:
+            raise ValueError(f"{path}不是pcap/pcapng文件")
+        try:
+            yield from reader
+        except EOFError:
+            print(f"{path}: 文件末尾不完整，已忽略最后一个块")
+
+
+# ---- 链路层/网络层/传输层解码 ----
+
+def decode_ip(linktype, frame):
+    """取出IP数据包，返回(IP版本, 数据包)，不是IP时返回None"""
+    if linktype == 1:  # Ethernet
+        pos = 12
+        ethertype = struct.unpack_from('>H', frame, pos)[0] if len(frame) >= 14 else 0
+        while ethertype in (0x8100, 0x88A8) and len(frame) >= pos + 6:  # VLAN标签
+            pos += 4
+            ethertype = struct.unpack_from('>H', frame, pos)[0]
+        version = {0x0800: 4, 0x86DD: 6}.get(ethertype)
+        return (version, frame[pos + 2:]) if version else None
+    if linktype == 0:  # BSD loopback：4字节地址族，字节序为抓包主机的字节序
+        family = (frame[0] or frame[3]) if len(frame) >= 4 else 0
+        version = 4 if family == 2 else 6 if family in (10, 24, 28, 30) else None
+        return (version, frame[4:]) if version else None
+    if linktype in (101, 228, 229):  # 原始IP
+        return (frame[0] >> 4, frame) if frame else None
+    if linktype in (113, 276):  # Linux cooked capture v1/v2
+        proto = struct.unpack_from('>H', frame, 14 if linktype == 113 else 0)[0] if len(frame) >= 20 else 0
+        version = {0x0800: 4, 0x86DD: 6}.get(proto)
+        return (version, frame[16 if linktype == 113 else 20:]) if version else None
+    return None
+
+
+def decode_transport(version, packet):
+    """解出(协议号, 源地址, 目的地址, 传输层数据, 按IP长度计算的传输层长度)；不是第一个分片、首部不完整时返回None"""
+    if version == 4:
+        if len(packet) < 20:
+            return None
+        ihl = (packet[0] & 0x0F) * 4
+        total, frag = struct.unpack_from('>H2xH', packet, 2)
+        if frag & 0x1FFF:
+            return None  # 后续分片没有传输层首部
+        src, dst = socket.inet_ntop(socket.AF_INET, packet[12:16]), socket.inet_ntop(socket.AF_INET, packet[16:20])
+        # 以太网最短帧会补0，按IP总长度截掉补齐的字节
+        return packet[9], src, dst, packet[ihl:total], total - ihl
+    if version == 6:
+        if len(packet) < 40:
+            return None
+        length = struct.unpack_from('>H', packet, 4)[0]
+        proto = packet[6]
+        src, dst = socket.inet_ntop(socket.AF_INET6, packet[8:24]), socket.inet_ntop(socket.AF_INET6, packet[24:40])
+        pos = 40
+        end = 40 + length
+        while proto in (0, 43, 44, 60) and pos + 8 <= len(packet):  # 扩展首部
+            if proto == 44 and struct.unpack_from('>H', packet, pos + 2)[0] & 0xFFF8:
+                return None
+            proto, ext_len = packet[pos], 8 if proto == 44 else (packet[pos + 1] + 1) * 8
+            pos += ext_len
+        return proto, src, dst, packet[pos:end], end - pos
+    return None
+
+
+def endpoint(addr, port):
+    return f"[{addr}]:{port}" if ':' in addr else f"{addr}:{port}"
+
+
+# ---- 时间序列 ----
+
+class Series:
+    """一个流的时间序列：按interval秒分段累加，进入新的时间段时把上一段写成一行CSV，只保留当前段"""
+
+    def __init__(self, sink, name, proto, t0, interval):
+        self.sink = sink
+        self.name = name
+        self.proto = proto
+        self.t0 = t0
+        self.interval = interval
+        self.bin = None
+        self.reset()
+
+    def reset(self):
+        self.c2s_bytes = self.s2c_bytes = self.goodput_bytes = 0
+        self.retrans = self.out_of_order = self.app_units = 0
+        self.rtt_sum = 0.0
+        self.rtt_samples = 0
+        self.inflight_max = self.inflight_sum = self.inflight_samples = 0
+
+    def at(self, t):
+        """切换到时刻t所在的时间段"""
+        k = int((t - self.t0) // self.interval)
+        if k != self.bin:
+            self.flush()
+            self.bin = k
+
+    def rtt(self, ms):
+        self.rtt_sum += ms
+        self.rtt_samples += 1
+
+    def inflight(self, value):
+        self.inflight_samples += 1
+        self.inflight_sum += value
+        if value > self.inflight_max:
+            self.inflight_max = value
+
+    def flush(self):
+        if self.sink and self.bin is not None:
+            self.sink.writerow([
+                f"{self.bin * self.interval:.6f}", self.name, self.proto, self.c2s_bytes, self.s2c_bytes,
+                self.goodput_bytes, self.retrans, self.out_of_order,
+                f"{self.rtt_sum / self.rtt_samples:.3f}" if self.rtt_samples else '', self.rtt_samples,
+                self.inflight_max, f"{self.inflight_sum / self.inflight_samples:.1f}" if self.inflight_samples else '',
+                self.app_units])
+        self.reset()
+
+
+def rtt_summary(stats):
+    """RTTStats -> 汇总字典（毫秒）"""
+    if not stats.count:
+        return {'count': 0}
+    return {'count': stats.count, 'min': round(stats.stats.min, 3), 'mean': round(stats.stats.mean, 3),
+            'p50': round(stats.percentile(50), 3), 'p99': round(stats.percentile(99), 3),
+            'max': round(stats.stats.max, 3)}
+
+
+def mbps(nbytes, seconds):
+    return round(nbytes * 8 / seconds / 1e6, 3) if seconds > 0 else 0.0
+
+
+# ---- task1: TCP上的reverse协议 ----
+
+class TcpDirection:
+    """TCP一个方向：按序列号重组字节流（乱序段最多缓存ooo_limit字节），统计重传、乱序、在途字节和RTT"""
+
+    def __init__(self, ooo_limit):
+        self.ooo_limit = ooo_limit
+        self.next = None  # 下一个按序的逻辑序列号
+        self.high = None  # 已发送的最大序列号（不含）
+        self.peer_ack = None  # 对端确认到的序列号
+        self.ooo = {}  # 乱序到达的段 {序列号: 数据}
+        self.ooo_bytes = 0
+        self.unacked = collections.deque()  # 首次发送、尚未确认的段(结束序列号, 抓包时刻)，用于RTT
+        self.karn = None  # 该序列号之前的段被重传过，不作为RTT样本
+        self.segments = 0
+        self.bytes = 0
+        self.new_bytes = 0
+        self.retrans = 0
+        self.retrans_bytes = 0
+        self.out_of_order = 0
+        self.synced = False  # 从SYN开始抓到，字节流可以从头解码
+        self.desync = False  # 缺少数据（抓包截断、乱序缓存溢出），停止应用层解码
+        self.rtt = RTTStats()
+        self.inflight_max = 0
+        self.inflight_sum = 0
+        self.inflight_samples = 0
+
+    def on_syn(self, seq):
+        self.next = self.high = seq + 1
+        self.synced = True
+
+    def on_segment(self, seq, payload, length, t, series):
+        """处理一个带数据的段，返回按序交付的字节列表；length为按IP长度计算的数据长度（payload可能被截断）"""
+        if self.next is None:
+            self.next = self.high = seq  # 没有抓到SYN，从第一个段开始计
+        seq = unwrap_seq(seq, self.next)
+        end = seq + length
+        self.segments += 1
+        self.bytes += length
+        if len(payload) < length:
+            self.desync = True
+        delivered = []
+        if end <= self.next or seq in self.ooo:
+            # 整段都已收到过：重传
+            self.retrans += 1
+            self.retrans_bytes += length
+            series.retrans += 1
+            self.karn = end if self.karn is None else max(self.karn, end)
+            return delivered
+        if seq > self.next:
+            # 前面有空缺：暂存，等空缺补上后再交付
+            if seq < self.high:
+                self.out_of_order += 1
+                series.out_of_order += 1
+            self.ooo[seq] = payload
+            self.ooo_bytes += len(payload)
+            if self.ooo_bytes > self.ooo_limit:
+                # 缓存溢出：放弃空缺，应用层不再解码，TCP层继续统计
+                self.desync = True
+                self.next = max(s + len(p) for s, p in self.ooo.items())
+                self.ooo.clear()
+                self.ooo_bytes = 0
+        else:
+            if seq < self.next:
+                # 部分重叠：重叠部分按重传计
+                self.retrans += 1
+                self.retrans_bytes += self.next - seq
+                series.retrans += 1
+                payload = payload[self.next - seq:]
+            elif end <= self.high:
+                # 空缺被补上：比已发送的最大序列号小的新数据
+                self.out_of_order += 1
+                series.out_of_order += 1
+            delivered.append(payload)
+            self.next = end
+            while self.next in self.ooo:
+                data = self.ooo.pop(self.next)
+                self.ooo_bytes -= len(data)
+                delivered.append(data)
+                self.next += len(data)
+        if end > self.high:
+            if self.karn is None or end > self.karn:
+                self.unacked.append((end, t))
+            self.new_bytes += end - max(seq, self.high)
+            self.high = end
+        if self.peer_ack is not None:
+            inflight = self.high - self.peer_ack
+            self.inflight_samples += 1
+            self.inflight_sum += inflight
+            self.inflight_max = max(self.inflight_max, inflight)
+            series.inflight(inflight)
+        return delivered
+
+    def on_ack(self, ack, t, series):
+        """对端的确认号：确认了最早的未确认段时取一个RTT样本（Karn算法：重传过的段不取样）"""
+        ack = unwrap_seq(ack, self.peer_ack if self.peer_ack is not None else self.high or ack)
+        if self.peer_ack is not None and ack <= self.peer_ack:
+            return
+        self.peer_ack = ack
+        sample = None
+        while self.unacked and self.unacked[0][0] <= ack:
+            sample = self.unacked.popleft()
+        if sample and (self.karn is None or sample[0] > self.karn):
+            ms = (t - sample[1]) * 1000
+            self.rtt.add(ms)
+            series.rtt(ms)
+
+    def summary(self, seconds):
+        return {'segments': self.segments, 'bytes': self.bytes, 'new_bytes': self.new_bytes,
+                'mbit_s': mbps(self.new_bytes, seconds), 'retrans': self.retrans,
+                'retrans_bytes': self.retrans_bytes, 'out_of_order': self.out_of_order,
+                'rtt_ms': rtt_summary(self.rtt), 'inflight_bytes_max': self.inflight_max,
+                'inflight_bytes_mean': round(self.inflight_sum / self.inflight_samples, 1)
+                if self.inflight_samples else 0}
+
+
+PAUSE = 0  # 协议解析生成器yield PAUSE表示暂停，之后的字节先暂存，等resume()（确定是否压缩）后再继续
+
+
+class ByteParser:
+    """驱动协议解析生成器：生成器yield n>0表示读n字节（得到(bytes, 时刻)），yield -n表示跳过n字节（得到(None, 时刻)），
+    报文体不保存，只读出需要的报文头和batch分块数"""
+
+    def __init__(self, gen, on_error, on_pause=None):
+        self.gen = gen
+        self.on_error = on_error
+        self.on_pause = on_pause
+        self.stream = None  # 协商压缩后的解压器
+        self.head = bytearray()
+        self.skip = 0
+        self.held = []  # 暂停期间收到的字节
+        self.op = next(gen)
+
+    @property
+    def paused(self):
+        return self.gen is not None and self.op == PAUSE
+
+    def stop(self):
+        self.gen = None
+        self.held = []
+
+    def advance(self, value, t):
+        try:
+            self.op = self.gen.send((value, t))
+        except StopIteration:
+            self.stop()
+            return
+        if self.op < 0:
+            self.skip = -self.op
+
+    def feed(self, data, t):
+        if self.gen is None:
+            return
+        if self.paused:
+            self.held.append((data, t))
+            return
+        if self.stream:
+            try:
+                data = self.stream.decompress(data)
+            except ValueError as e:
+                self.on_error(str(e))
+                self.stop()
+                return
+        self.parse(data, t)
+        if self.paused and self.on_pause:
+            self.on_pause()
+
+    def parse(self, data, t):
+        pos = 0
+        n = len(data)
+        while pos < n and self.gen is not None:
+            if self.skip:
+                step = min(self.skip, n - pos)
+                self.skip -= step
+                pos += step
+                if not self.skip:
+                    self.advance(None, t)
+                continue
+            if self.op == PAUSE:
+                self.held.append((data[pos:], t))
+                return
+            step = min(self.op - len(self.head), n - pos)
+            self.head += data[pos:pos + step]
+            pos += step
+            if len(self.head) == self.op:
+                head = bytes(self.head)
+                self.head.clear()
+                self.advance(head, t)
+
+    def resume(self, stream, t):
+        """从暂停处继续，stream不为None时之后的字节（包括暂存的）先解压"""
+        self.stream = stream
+        self.advance(None, t)
+        held, self.held = self.held, []
+        for data, when in held:
+            self.feed(data, when)
+
+
+class ReverseFlow:
+    """一条reverse协议的TCP连接：两个方向各自重组、切分报文，请求和应答按顺序一一对应"""
+
+    proto = 'tcp-reverse'
+
+    def __init__(self, client, server, t, sink, t0, interval, ooo_limit):
+        self.name = f"{endpoint(*client)}->{endpoint(*server)}"
+        self.start = self.last = t
+        self.series = Series(sink, self.name, self.proto, t0, interval)
+        self.c2s = TcpDirection(ooo_limit)
+        self.s2c = TcpDirection(ooo_limit)
+        self.closed = False
+        self.reset = False
+        self.init_type = None
+        self.N = None
+        self.first = 0  # Resume报文的起始分块
+        self.caps = None
+        self.c2s_stream = None
+        self.requests = self.request_pieces = 0
+        self.answers = self.answer_pieces = 0
+        self.pending = collections.deque()  # 未收到应答的请求(分块数, 请求报文结束的时刻)，长度不超过流水线深度
+        self.outstanding_max = 0
+        self.latency = RTTStats()
+        self.errors = []
+        self.c2s_parser = ByteParser(self.client_messages(), self.error, self.client_paused)
+        self.s2c_parser = ByteParser(self.server_messages(), self.error, self.agreed)
+
+    def error(self, text):
+        if len(self.errors) < 5 and text not in self.errors:
+            self.errors.append(text)
+
+    def client_messages(self):
+        """客户端方向：Initialization/扩展Initialization/Resume报文，之后是reverseRequest/batchRequest"""
+        head, t = yield HEADER_SIZE
+        Type, N = HEADER.unpack(head)
+        if Type == TYPE_INIT_EX:
+            yield CAPS.size
+        elif Type == TYPE_RESUME:
+            body, t = yield RESUME.size
+            self.first = RESUME.unpack(body)[1]
+        elif Type != 1:
+            self.error(f"未知的Initialization报文Type={Type}")
+            return
+        self.init_type, self.N = Type, N
+        yield PAUSE  # 之后的字节流是否压缩由agree决定
+        while True:
+            head, t = yield HEADER_SIZE
+            Type, length = HEADER.unpack(head)
+            if Type == 3:
+                pieces = 1
+            elif Type == TYPE_BATCH_REQUEST and length >= BATCH_COUNT.size:
+                body, t = yield BATCH_COUNT.size
+                pieces = BATCH_COUNT.unpack(body)[0]
+                length -= BATCH_COUNT.size
+            else:
+                self.error(f"客户端发送了未知的报文Type={Type}")
+                return
+            if length:
+                _, t = yield -length
+            self.requests += 1
+            self.request_pieces += pieces
+            self.pending.append((pieces, t))
+            self.outstanding_max = max(self.outstanding_max, len(self.pending))
+
+    def server_messages(self):
+        """服务器方向：agree报文，之后是reverseAnswer/batchAnswer"""
+        head, t = yield 2
+        if struct.unpack('>H', head)[0] != 2:
+            self.error("服务器没有回复agree报文")
+            return
+        caps = 0
+        if self.init_type in (TYPE_INIT_EX, TYPE_RESUME):
+            body, t = yield CAPS.size
+            caps = CAPS.unpack(body)[0]
+        self.caps = caps
+        yield PAUSE
+        while True:
+            head, t = yield HEADER_SIZE
+            Type, length = HEADER.unpack(head)
+            if Type == 4:
+                pieces = 1
+            elif Type == TYPE_BATCH_ANSWER and length >= BATCH_COUNT.size:
+                body, t = yield BATCH_COUNT.size
+                pieces = BATCH_COUNT.unpack(body)[0]
+                length -= BATCH_COUNT.size
+            else:
+                self.error(f"服务器发送了未知的报文Type={Type}")
+                return
+            if length:
+                _, t = yield -length
+            self.answers += 1
+            self.answer_pieces += pieces
+            self.series.app_units += pieces
+            if self.pending:
+                _, sent = self.pending.popleft()
+                self.latency.add((t - sent) * 1000)
+
+    def agreed(self):
+        """agree报文结束：协商了压缩时两个方向之后的字节都先解压再切分"""
+        s2c_stream = None
+        if self.caps & CAP_COMPRESS:
+            if self.caps & CAP_ZSTD and not supported_compression() & CAP_ZSTD:
+                self.error("连接使用zstd压缩，需要安装zstandard才能解码应用层报文")
+                self.c2s_parser.stop()
+                self.s2c_parser.stop()
+                return
+            s2c_stream = Decompressor(self.caps & CAP_COMPRESS)
+            self.c2s_stream = Decompressor(self.caps & CAP_COMPRESS)
+        self.s2c_parser.resume(s2c_stream, self.last)
+        self.client_paused()
+
+    def client_paused(self):
+        if self.caps is not None and self.c2s_parser.paused:
+            self.c2s_parser.resume(self.c2s_stream, self.last)
+
+    def on_packet(self, from_client, tcp_flags, seq, ack, payload, length, t):
+        self.last = t
+        series = self.series
+        series.at(t)
+        sender, receiver = (self.c2s, self.s2c) if from_client else (self.s2c, self.c2s)
+        parser = self.c2s_parser if from_client else self.s2c_parser
+        if tcp_flags & TCP_SYN:
+            sender.on_syn(seq)
+        if tcp_flags & TCP_ACK:
+            receiver.on_ack(ack, t, series)
+        if length:
+            new_bytes = sender.new_bytes
+            delivered = sender.on_segment(seq, payload, length, t, series)
+            if from_client:
+                series.c2s_bytes += length
+                series.goodput_bytes += sender.new_bytes - new_bytes
+            else:
+                series.s2c_bytes += length
+            if not sender.synced or sender.desync:
+                parser.stop()
+            for data in delivered:
+                parser.feed(data, t)
+        if tcp_flags & (TCP_FIN | TCP_RST):
+            self.closed = True
+            self.reset = self.reset or bool(tcp_flags & TCP_RST)
+
+    def summary(self):
+        seconds = self.last - self.start
+        if self.c2s.synced and not self.s2c.synced and self.reset:
+            self.error("连接被拒绝（服务器回复RST）")
+        elif not (self.c2s.synced and self.s2c.synced):
+            self.error("没有抓到连接的开始，只统计TCP层")
+        elif self.c2s.desync or self.s2c.desync:
+            self.error("字节流有缺失（抓包截断或乱序缓存溢出），应用层统计不完整")
+        expected = self.N - self.first if self.N is not None else None
+        return {
+            'flow': self.name, 'proto': self.proto, 'start': self.start, 'duration_s': round(seconds, 6),
+            'init_type': self.init_type, 'N': self.N, 'resume_from': self.first, 'caps': self.caps,
+            'requests': self.requests, 'request_pieces': self.request_pieces, 'answers': self.answers,
+            'answer_pieces': self.answer_pieces, 'complete': expected is not None and self.answer_pieces == expected,
+            'latency_ms': rtt_summary(self.latency), 'outstanding_max': self.outstanding_max,
+            'c2s': self.c2s.summary(seconds), 's2c': self.s2c.summary(seconds), 'errors': self.errors,
+        }
+
+
+# ---- task2: UDP上的GBN/SR协议 ----
+
+def gbn_header(payload):
+    """报文长度与首部的数据长度字段一致、标志位合法时返回解出的首部，否则返回None（不是GBN数据报）"""
+    if len(payload) < header_Size:
+        return None
+    seq, ack, flags, ts, length = header_Struct.unpack_from(payload)
+    if not flags or flags & ~0x1F or header_Size + length != len(payload):
+        return None
+    return seq, ack, flags, ts, length
+
+
+class GbnFlow:
+    """一个GBN/SR流（客户端地址 <-> 服务器地址）
+
+    RTT取自首部嵌入的微秒时间戳：ACK的抓包时刻 - 被它新确认的数据包中携带的发送时刻（客户端时钟），
+    在客户端所在主机抓包时就是完整的RTT；同时给出抓包点看到的数据包到ACK的间隔（rtt_wire），与抓包位置无关。
+    重传过的包不取样（Karn算法）。在途包只保存到被累积确认为止，内存与窗口大小有关，与传输长度无关。
+    """
+
+    proto = 'udp-gbn'
+
+    def __init__(self, client, server, t, sink, t0, interval):
+        self.name = f"{endpoint(*client)}->{endpoint(*server)}"
+        self.start = self.last = t
+        self.series = Series(sink, self.name, self.proto, t0, interval)
+        self.closed = False
+        self.mode = None
+        self.handshake_ms = None
+        self.syn_at = None
+        self.cum_ack = None  # 服务器累积确认到的逻辑序列号
+        self.high = None  # 发送过的最大逻辑序列号
+        self.sent = {}  # 未被累积确认的包 {逻辑序列号: [嵌入的发送时刻(秒), 抓包时刻, 发送次数, 是否已被SACK]}
+        self.inflight = 0
+        self.inflight_max = 0
+        self.inflight_sum = 0
+        self.c2s_bytes = self.s2c_bytes = 0
+        self.data_packets = self.new_packets = self.new_bytes = 0
+        self.retrans = self.retrans_bytes = 0
+        self.out_of_order = 0
+        self.acks = self.dup_acks = self.sack_acks = self.ack_reordered = 0
+        self.rtt = RTTStats()
+        self.rtt_wire = RTTStats()
+        self.fin_total = None
+        self.fin_digest = None
+        self.result = None
+        self.errors = []
+
+    def on_datagram(self, from_client, header, payload, t):
+        self.last = t
+        series = self.series
+        series.at(t)
+        seq, ack, flags, ts, length = header
+        if from_client:
+            self.c2s_bytes += len(payload)
+            series.c2s_bytes += len(payload)
+        else:
+            self.s2c_bytes += len(payload)
+            series.s2c_bytes += len(payload)
+
+        if flags & flag_SYN:
+            if from_client and not flags & flag_ACK:
+                self.mode = 'sr' if flags & flag_SACK else 'gbn'
+                self.syn_at = (ts / 1e6, t)
+                self.cum_ack = self.high = seq + 1
+            elif not from_client and self.syn_at and self.handshake_ms is None:
+                self.handshake_ms = round((t - self.syn_at[1]) * 1000, 3)
+                if self.mode == 'sr' and not flags & flag_SACK:
+                    self.mode = 'gbn'  # 服务器不支持SR
+            return
+        if flags & flag_FIN:
+            if from_client and length >= fin_Struct.size:
+                _, self.fin_total, digest = fin_Struct.unpack_from(payload, header_Size)
+                self.fin_digest = digest.hex()[:16]
+            elif not from_client and flags & flag_ACK:
+                self.result = payload[header_Size:].decode(errors='replace')
+                self.closed = True
+            return
+        if from_client and flags & flag_DATA:
+            self.on_data(seq, ts, length, len(payload), t, series)
+        elif not from_client and flags & flag_ACK:
+            sack = struct.unpack_from(f'>{length // 4}I', payload, header_Size) if flags & flag_SACK else ()
+            self.on_ack(ack, sack, t, series)
+
+    def on_data(self, seq, ts, length, size, t, series):
+        if self.high is None:
+            self.cum_ack = self.high = seq  # 没有抓到SYN
+        seq = unwrap_seq(seq, self.high)
+        self.data_packets += 1
+        entry = self.sent.get(seq)
+        if seq < self.cum_ack or entry is not None:
+            # 已发送过（或已被确认）的包：重传
+            self.retrans += 1
+            self.retrans_bytes += size
+            series.retrans += 1
+            if entry:
+                entry[2] += 1
+            return
+        if seq < self.high:
+            # 比已发送的最大序列号小的新包，只有抓包点之前发生乱序时才会出现
+            self.out_of_order += 1
+            series.out_of_order += 1
+        self.sent[seq] = [ts / 1e6, t, 1, False]
+        self.high = max(self.high, seq + 1)
+        self.new_packets += 1
+        self.new_bytes += length
+        series.goodput_bytes += length
+        self.inflight += 1
+        self.inflight_max = max(self.inflight_max, self.inflight)
+        self.inflight_sum += self.inflight
+        series.inflight(self.inflight)
+
+    def sample(self, entry, t, series):
+        if entry[2] == 1:
+            ms = (t - entry[0]) * 1000
+            self.rtt.add(ms)
+            series.rtt(ms)
+            self.rtt_wire.add((t - entry[1]) * 1000)
+
+    def on_ack(self, ack, sack, t, series):
+        if self.cum_ack is None:
+            return
+        self.acks += 1
+        ack = unwrap_seq(ack, self.cum_ack)
+        newly = 0
+        for s in sack:
+            entry = self.sent.get(unwrap_seq(s, self.cum_ack))
+            if entry and not entry[3]:
+                entry[3] = True
+                newly += 1
+                self.sample(entry, t, series)
+        if sack:
+            self.sack_acks += 1
+        if ack > self.cum_ack:
+            if ack - self.cum_ack > len(self.sent) + (1 << 16):
+                self.error(f"确认号{ack}远超已发送的包，可能不是同一个流")
+                return
+            # 累积确认：只用触发这个ACK的最后一个包取样，前面的包可能被延迟确认合并
+            last = None
+            for s in range(self.cum_ack, ack):
+                entry = self.sent.pop(s, None)
+                if entry and not entry[3]:
+                    newly += 1
+                    last = entry
+            if last:
+                self.sample(last, t, series)
+            self.cum_ack = ack
+        elif ack < self.cum_ack:
+            self.ack_reordered += 1
+        elif not newly:
+            self.dup_acks += 1
+        self.inflight -= newly
+        series.app_units += newly
+
+    def error(self, text):
+        if len(self.errors) < 5 and text not in self.errors:
+            self.errors.append(text)
+
+    def summary(self):
+        seconds = self.last - self.start
+        return {
+            'flow': self.name, 'proto': self.proto, 'start': self.start, 'duration_s': round(seconds, 6),
+            'mode': self.mode, 'handshake_ms': self.handshake_ms, 'data_packets': self.data_packets,
+            'new_packets': self.new_packets, 'new_bytes': self.new_bytes, 'mbit_s': mbps(self.new_bytes, seconds),
+            'c2s_bytes': self.c2s_bytes, 's2c_bytes': self.s2c_bytes, 'retrans': self.retrans,
+            'retrans_bytes': self.retrans_bytes, 'out_of_order': self.out_of_order, 'acks': self.acks,
+            'dup_acks': self.dup_acks, 'sack_acks': self.sack_acks, 'ack_reordered': self.ack_reordered,
+            'rtt_ms': rtt_summary(self.rtt), 'rtt_wire_ms': rtt_summary(self.rtt_wire),
+            'inflight_max': self.inflight_max,
+            'inflight_mean': round(self.inflight_sum / self.new_packets, 2) if self.new_packets else 0,
+            'fin_total': self.fin_total, 'fin_sha256': self.fin_digest, 'result': self.result,
+            'errors': self.errors,
+        }
+
+
+# ---- 整个抓包文件 ----
+
+class Analyzer:
+    """按包分派到各个流；结束的流（FIN/RST、FIN-ACK）立即汇总并释放状态，只保留汇总结果"""
+
+    def __init__(self, tcp_ports, udp_ports, sink=None, interval=1.0, ooo_limit=4 << 20):
+        self.tcp_ports = tcp_ports
+        self.udp_ports = udp_ports
+        self.sink = sink
+        self.interval = interval
+        self.ooo_limit = ooo_limit
+        self.t0 = None
+        self.t_end = None
+        self.packets = 0
+        self.decoded = collections.Counter()  # 各类包的个数
+        self.flows = {}  # {(较小的端点, 较大的端点): 流}
+        self.summaries = []
+
+    def add(self, t, linktype, frame):
+        self.packets += 1
+        if self.t0 is None:
+            self.t0 = t
+        self.t_end = t
+        ip = decode_ip(linktype, frame)
+        parsed = ip and decode_transport(*ip)
+        if not parsed:
+            self.decoded['other'] += 1
+            return
+        proto, src, dst, segment, seg_len = parsed
+        if proto == 6 and len(segment) >= 20:
+            self.add_tcp(src, dst, segment, seg_len, t)
+        elif proto == 17 and len(segment) >= 8:
+            self.add_udp(src, dst, segment, t)
+        else:
+            self.decoded['other'] += 1
+
+    def flow_key(self, a, b):
+        return (a, b) if a < b else (b, a)
+
+    def finish(self, key):
+        flow = self.flows.pop(key)
+        flow.series.flush()
+        self.summaries.append(flow.summary())
+
+    def add_tcp(self, src, dst, segment, seg_len, t):
+        sport, dport, seq, ack, offset, tcp_flags = struct.unpack_from('>HHIIBB', segment)
+        a, b = (src, sport), (dst, dport)
+        if dport in self.tcp_ports:
+            client, server = a, b
+        elif sport in self.tcp_ports:
+            client, server = b, a
+        else:
+            self.decoded['tcp_other'] += 1
+            return
+        self.decoded['tcp'] += 1
+        key = self.flow_key(a, b)
+        flow = self.flows.get(key)
+        if flow and flow.closed and tcp_flags & TCP_SYN and not tcp_flags & TCP_ACK:
+            self.finish(key)  # 端口被新连接复用
+            flow = None
+        if flow is None:
+            flow = self.flows[key] = ReverseFlow(client, server, t, self.sink, self.t0, self.interval, self.ooo_limit)
+        header_len = (offset >> 4) * 4
+        payload = segment[header_len:]
+        flow.on_packet(a == client, tcp_flags, seq, ack, payload, max(0, seg_len - header_len), t)
+
+    def add_udp(self, src, dst, segment, t):
+        sport, dport, length = struct.unpack_from('>HHH', segment)
+        payload = segment[8:length]
+        header = gbn_header(payload)
+        a, b = (src, sport), (dst, dport)
+        if header is None or (self.udp_ports and not {sport, dport} & self.udp_ports):
+            self.decoded['udp_other'] += 1
+            return
+        self.decoded['udp'] += 1
+        if dport in self.udp_ports or not self.udp_ports and header[2] & (flag_DATA | flag_SYN) and \
+                not header[2] & flag_ACK:
+            client, server = a, b
+        else:
+            client, server = b, a
+        key = self.flow_key(a, b)
+        flow = self.flows.get(key)
+        if flow and flow.closed and header[2] & flag_SYN and not header[2] & flag_ACK:
+            self.finish(key)
+            flow = None
+        if flow is None:
+            flow = self.flows[key] = GbnFlow(client, server, t, self.sink, self.t0, self.interval)
+        flow.on_datagram(a == client, header, payload, t)
+
+    def close(self):
+        for key in list(self.flows):
+            self.finish(key)
+        self.summaries.sort(key=lambda s: s['start'])
+        for s in self.summaries:
+            s['start'] = round(s['start'] - self.t0, 6)
+        return {'packets': self.packets,
+                'duration_s': round(self.t_end - self.t0, 6) if self.t0 is not None else 0.0,
+                'decoded': dict(self.decoded), 'flows': self.summaries}
+
+
+def format_rtt(r):
+    if not r['count']:
+        return "无样本"
+    return (f"{r['count']}个样本 最小{r['min']:.3f} 平均{r['mean']:.3f} p50 {r['p50']:.3f} p99 {r['p99']:.3f} "
+            f"最大{r['max']:.3f} ms")
+
+
+def print_summary(path, report):
+    print(f"===== {path} =====")
+    print(f"共{report['packets']}个包, 时长{report['duration_s']:.3f}s, "
+          + ", ".join(f"{k}={v}" for k, v in sorted(report['decoded'].items())))
+    for s in report['flows']:
+        print(f"\n[{s['proto']}] {s['flow']}  开始于{s['start']:.3f}s, 持续{s['duration_s']:.3f}s")
+        if s['proto'] == 'tcp-reverse' and not s['c2s']['segments'] and not s['s2c']['segments']:
+            pass  # 没有数据的连接（如被拒绝）只输出下面的注意事项
+        elif s['proto'] == 'tcp-reverse':
+            init = {1: "Initialization", TYPE_INIT_EX: "扩展Initialization", TYPE_RESUME: "Resume"}.get(
+                s['init_type'], "未抓到")
+            print(f"  握手: {init}, N={s['N']}, 从第{s['resume_from']}块开始, 能力位={s['caps']}")
+            print(f"  请求{s['requests']}个({s['request_pieces']}块), 应答{s['answers']}个({s['answer_pieces']}块), "
+                  f"{'完整' if s['complete'] else '不完整'}, 最多{s['outstanding_max']}个请求未应答")
+            print(f"  请求->应答时延: {format_rtt(s['latency_ms'])}")
+            for name, d in (("客户端->服务器", s['c2s']), ("服务器->客户端", s['s2c'])):
+                print(f"  {name}: {d['segments']}个段, 新数据{d['new_bytes']}字节({d['mbit_s']:.3f} Mbit/s), "
+                      f"重传{d['retrans']}次({d['retrans_bytes']}字节), 乱序{d['out_of_order']}次, "
+                      f"在途最多{d['inflight_bytes_max']}字节(平均{d['inflight_bytes_mean']})")
+                print(f"    RTT: {format_rtt(d['rtt_ms'])}")
+        else:
+            print(f"  模式{s['mode']}, 握手{s['handshake_ms']}ms, 数据包{s['data_packets']}个(新包{s['new_packets']}个, "
+                  f"{s['new_bytes']}字节, {s['mbit_s']:.3f} Mbit/s), 重传{s['retrans']}次({s['retrans_bytes']}字节), "
+                  f"乱序{s['out_of_order']}次")
+            print(f"  ACK {s['acks']}个: 重复{s['dup_acks']}个, 带SACK {s['sack_acks']}个, 乱序到达{s['ack_reordered']}个; "
+                  f"在途最多{s['inflight_max']}个包(平均{s['inflight_mean']})")
+            print(f"  RTT(嵌入时间戳): {format_rtt(s['rtt_ms'])}")
+            print(f"  RTT(抓包点): {format_rtt(s['rtt_wire_ms'])}")
+            if s['fin_total'] is not None or s['result']:
+                print(f"  FIN: 共{s['fin_total']}字节, SHA-256 {s['fin_sha256']}..., 服务器校验结果{s['result']}")
+        for text in s['errors']:
+            print(f"  注意: {text}")
+
+
+# 回归对比的指标：(名字, 取值函数)，越大越好/越小越好由读者判断
+COMPARE_METRICS = {
+    'tcp-reverse': [('duration_s', lambda s: s['duration_s']), ('c2s Mbit/s', lambda s: s['c2s']['mbit_s']),
+                    ('c2s retrans', lambda s: s['c2s']['retrans']),
+                    ('c2s rtt p50', lambda s: s['c2s']['rtt_ms'].get('p50')),
+                    ('latency p50', lambda s: s['latency_ms'].get('p50')),
+                    ('latency p99', lambda s: s['latency_ms'].get('p99'))],
+    'udp-gbn': [('duration_s', lambda s: s['duration_s']), ('Mbit/s', lambda s: s['mbit_s']),
+                ('retrans', lambda s: s['retrans']), ('out_of_order', lambda s: s['out_of_order']),
+                ('rtt p50', lambda s: s['rtt_ms'].get('p50')), ('rtt p99', lambda s: s['rtt_ms'].get('p99')),
+                ('inflight max', lambda s: s['inflight_max'])],
+}
+
+
+def compare(baseline, report):
+    """与之前保存的JSON汇总对比：流按(协议, 服务器端点, 出现顺序)对应（客户端端口每次都不同）"""
+    def keyed(flows):
+        seen = collections.Counter()
+        result = {}
+        for s in flows:
+            server = s['flow'].split('->')[1]
+            k = (s['proto'], server, seen[(s['proto'], server)])
+            seen[(s['proto'], server)] += 1
+            result[k] = s
+        return result
+
+    old, new = keyed(baseline['flows']), keyed(report['flows'])
+    print("\n----- 与基线对比 -----")
+    for k in sorted(set(old) | set(new), key=str):
+        if k not in old or k not in new:
+            print(f"{k[0]} {k[1]} #{k[2]}: {'基线中没有' if k not in old else '本次没有'}")
+            continue
+        parts = []
+        for name, get in COMPARE_METRICS[k[0]]:
+            a, b = get(old[k]), get(new[k])
+            if a is None or b is None:
+                continue
+            change = f"{(b - a) / a * 100:+.1f}%" if a else ""
+            parts.append(f"{name} {a:g}->{b:g} {change}".rstrip())
+        print(f"{k[0]} {k[1]} #{k[2]}: " + ", ".join(parts))
+
+
+def parse_ports(text):
+    return {int(x) for x in text.split(',') if x}
+
+
+def main():
+    # 例: python pcapanalyze.py ../task2/捕获截图/task2捕获_2.pcapng --csv series.csv --json summary.json
+    parser = argparse.ArgumentParser(description="reverse(TCP)/GBN(UDP)协议的离线抓包分析")
+    parser.add_argument('files', nargs='+', help="pcapng/pcap文件")
+    parser.add_argument('--tcp-port', type=parse_ports, default={9000}, help="reverse服务器的TCP端口列表，如 9000,9100")
+    parser.add_argument('--udp-port', type=parse_ports, default={9000},
+                        help="GBN服务器的UDP端口列表；为空字符串时按首部的长度字段识别所有GBN数据报")
+    parser.add_argument('--interval', type=float, default=1.0, help="时间序列每段的长度(秒)")
+    parser.add_argument('--csv', help="把时间序列写入CSV文件（每个流每段一行）")
+    parser.add_argument('--json', help="把汇总写入JSON文件，可用--baseline与之后的抓包对比")
+    parser.add_argument('--baseline', help="之前用--json保存的汇总，逐流对比主要指标")
+    parser.add_argument('--ooo-limit', type=int, default=4 << 20, help="TCP每个方向最多缓存的乱序字节数")
+    args = parser.parse_args()
+
+    out = open(args.csv, 'w', newline='') if args.csv else None
+    sink = None
+    if out:
+        sink = csv.writer(out)
+        sink.writerow(['file'] + SERIES_FIELDS)
+    reports = {}
+    try:
+        for path in args.files:
+            file_sink = FileColumn(sink, os.path.basename(path)) if sink else None
+            analyzer = Analyzer(args.tcp_port, args.udp_port, file_sink, args.interval, args.ooo_limit)
+            for t, linktype, frame, _ in read_packets(path):
+                analyzer.add(t, linktype, frame)
+            reports[path] = analyzer.close()
+            print_summary(path, reports[path])
+    finally:
+        if out:
+            out.close()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({os.path.basename(path): report for path, report in reports.items()}, f, indent=2,
+                      ensure_ascii=False)
+        print(f"\n汇总已写入{args.json}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for path, report in reports.items():
+            old = baseline.get(os.path.basename(path))
+            if old is None and len(baseline) == 1:
+                old = next(iter(baseline.values()))  # 文件名不同时与基线中唯一的文件对比
+            if old is None:
+                print(f"基线中没有{os.path.basename(path)}")
+            else:
+                compare(old, report)
+
+
+class FileColumn:
+    """给CSV的每一行加上文件名列"""
+
+    def __init__(self, writer, name):
+        self.writer = writer
+        self.name = name
+
+    def writerow(self, row):
+        self.writer.writerow([self.name] + row)
+
+
+if __name__ == "__main__":
+    main()